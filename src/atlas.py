@@ -0,0 +1,312 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import pygame as pg
+from mapio import replacing_file
+
+# Tiles per row and column of an atlas page
+ATLAS_PAGE_TILES = 16
+# Upper bound on the memory used by atlases scaled to zoomed tile sizes (in bytes)
+SCALED_ATLAS_BYTES = 64 * 1024 * 1024
+# Colors of the placeholder squares drawn for tiles without an image
+PLACEHOLDER_COLORS = {
+    1: (0, 255, 0),    # Green for grass
+    2: (0, 0, 255),    # Blue for water
+    3: (139, 69, 19),  # Brown for dirt
+    4: (128, 128, 128)  # Gray for stone
+}
+
+
+class _Atlas:
+    """Tiles of one size packed into pages of ATLAS_PAGE_TILES x ATLAS_PAGE_TILES
+    slots. Pages are allocated when a slot in them is first filled."""
+    def __init__(self, tile_size, slot_count):
+        self.tile_size = tile_size
+        self.pages = [None] * -(-slot_count // (ATLAS_PAGE_TILES * ATLAS_PAGE_TILES))
+        self.filled = set()  # slots holding their tile
+
+    @property
+    def page_size(self):
+        return ATLAS_PAGE_TILES * self.tile_size
+
+    @property
+    def nbytes(self):
+        return sum(self.page_size * self.page_size * 4 for page in self.pages if page is not None)
+
+    def rect(self, slot):
+        """(page index, area) of a slot"""
+        page, index = divmod(slot, ATLAS_PAGE_TILES * ATLAS_PAGE_TILES)
+        row, col = divmod(index, ATLAS_PAGE_TILES)
+        return page, pg.Rect(col * self.tile_size, row * self.tile_size, self.tile_size, self.tile_size)
+
+    def page(self, index):
+        if self.pages[index] is None:
+            surface = pg.Surface((self.page_size, self.page_size), pg.SRCALPHA)
+            self.pages[index] = surface.convert_alpha() if pg.display.get_surface() else surface
+            self.pages[index].fill((0, 0, 0, 0))
+        return self.pages[index]
+
+
+class TileAtlas:
+    """The tile images named in a tile table, packed into atlas pages.
+
+    Every tile has a fixed slot, and is decoded from assets/<name>.png (scaled
+    to tile_size) the first time it is used; tiles without an image get a
+    placeholder square of placeholder_color(tile_id). Zoomed sizes are scaled
+    from the base atlas slot by slot, as tiles are needed.
+
+    Decoded tiles are kept in an on-disk cache of raw atlas pages, so later
+    runs skip PNG decoding. Each cached tile is checked against the image's
+    modification time and size before use.
+    """
+    def __init__(self, tile_types, asset_dir, tile_size, placeholder_color, cache_dir=None,
+                 scaled_bytes=SCALED_ATLAS_BYTES):
+        self.tile_types = tile_types
+        self.asset_dir = asset_dir
+        self.tile_size = tile_size
+        self.placeholder_color = placeholder_color
+        self.cache_dir = cache_dir
+        self.scaled_bytes = scaled_bytes
+        self.slots = {tile_id: slot for slot, tile_id in enumerate(sorted(t for t in tile_types if t != 0))}
+        self.base = _Atlas(tile_size, len(self.slots))
+        self.scaled_atlases = OrderedDict()  # tile size -> _Atlas, least recently used first
+        self.colors = {}  # tile_id -> (r, g, b, a) average color
+        self.sources = {}  # tile_id -> (mtime_ns, size) of the decoded image, None for placeholders
+        self.hits = 0
+        self.misses = 0
+        self.decoded = 0
+
+        # Tiles from the disk cache are only checked (and their pages read) when first used
+        self.cache_key = self._cache_key()
+        self.cached = {}
+        self.cached_pages = set()
+        self.cache_dirty = False
+        self._read_cache_index()
+
+    def __contains__(self, tile_id):
+        return tile_id in self.slots
+
+    def tile(self, tile_id):
+        """Return (page surface, area) holding the tile at the base tile size"""
+        slot = self.slots[tile_id]
+        page, rect = self.base.rect(slot)
+        if slot not in self.base.filled:
+            self._load(tile_id, slot, page, rect)
+        return self.base.pages[page], rect
+
+    def scaled(self, tile_id, size):
+        """Return (page surface, area) holding the tile scaled to size x size pixels"""
+        if size == self.tile_size:
+            self.hits += 1
+            return self.tile(tile_id)
+        atlas = self.scaled_atlases.get(size)
+        if atlas is None:
+            atlas = self.scaled_atlases[size] = _Atlas(size, len(self.slots))
+        else:
+            self.scaled_atlases.move_to_end(size)
+        slot = self.slots[tile_id]
+        page, rect = atlas.rect(slot)
+        if slot in atlas.filled:
+            self.hits += 1
+            return atlas.pages[page], rect
+
+        # Not scaled yet: scale the base tile once into this size's slot
+        self.misses += 1
+        source, area = self.tile(tile_id)
+        _copy(pg.transform.scale(source.subsurface(area), (size, size)), atlas.page(page), rect.topleft)
+        atlas.filled.add(slot)
+        self._evict_scaled()
+        return atlas.pages[page], rect
+
+    def _evict_scaled(self):
+        # Drop the least recently used sizes, but always keep the one in use
+        used = sum(atlas.nbytes for atlas in self.scaled_atlases.values())
+        while used > self.scaled_bytes and len(self.scaled_atlases) > 1:
+            _, atlas = self.scaled_atlases.popitem(last=False)
+            used -= atlas.nbytes
+
+    def clear_scaled(self):
+        self.scaled_atlases.clear()
+
+    def color(self, tile_id):
+        """Average (r, g, b, a) color of a tile"""
+        color = self.colors.get(tile_id)
+        if color is None:
+            if self._from_cache(tile_id) is None:
+                self.tile(tile_id)
+            color = self.colors[tile_id]
+        return color
+
+    def color_table(self, size):
+        """(size, 3) uint8 table of the tiles' average colors premultiplied by
+        alpha; empty and unknown tiles are black"""
+        colors = np.zeros((size, 3), dtype=np.uint8)
+        for tile_id in self.slots:
+            if tile_id < size:
+                r, g, b, a = self.color(tile_id)
+                colors[tile_id] = (r * a // 255, g * a // 255, b * a // 255)
+        return colors
+
+    def pixel_tables(self, size):
+        """Pixels of every tile scaled to size x size, as premultiplied RGB and alpha
+        arrays of shape (max tile ID + 1, size, size, 3) and (..., 1) indexed by
+        tile ID; empty and unknown tiles are transparent"""
+        count = max(self.slots, default=0) + 1
+        rgb = np.zeros((count, size, size, 3), dtype=np.uint8)
+        alpha = np.zeros((count, size, size, 1), dtype=np.uint8)
+        for tile_id in self.slots:
+            page, area = self.scaled(tile_id, size)
+            tile = page.subsurface(area)
+            # surfarray arrays are indexed [x, y]
+            alpha[tile_id, :, :, 0] = pg.surfarray.array_alpha(tile).T
+            colors = pg.surfarray.array3d(tile).transpose(1, 0, 2).astype(np.uint16)
+            rgb[tile_id] = colors * alpha[tile_id] // 255
+        return rgb, alpha
+
+    def _image_path(self, tile_id):
+        return os.path.join(self.asset_dir, f"{self.tile_types[tile_id]}.png")
+
+    def _image_source(self, tile_id):
+        """(mtime_ns, size) of a tile's image, or None if it has none"""
+        try:
+            stat = os.stat(self._image_path(tile_id))
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self, tile_id, slot, page, rect):
+        """Fill a base atlas slot, from the disk cache if it is still valid"""
+        if self._from_cache(tile_id) is not None:
+            try:
+                self._read_cached_page(page)
+                self.base.filled.add(slot)
+                return
+            except (OSError, ValueError):
+                # A missing or damaged cache page: decode everything from now on
+                self.cached.clear()
+                self.cache_dirty = True
+
+        surface = self.base.page(page)
+        source = self._image_source(tile_id)
+        image = None
+        if source is not None:
+            try:
+                # Load image and scale it to the tile size
+                image = pg.image.load(self._image_path(tile_id))
+                image = image.convert_alpha() if pg.display.get_surface() else image
+                image = pg.transform.scale(image, (self.tile_size, self.tile_size))
+            except Exception:
+                image = None
+        if image is None:
+            # Create a placeholder colored square
+            source = None
+            surface.fill(self.placeholder_color(tile_id), rect)
+        else:
+            _copy(image, surface, rect.topleft)
+            self.decoded += 1
+            self.cache_dirty = True
+        self.base.filled.add(slot)
+        self.sources[tile_id] = source
+        self.colors[tile_id] = tuple(pg.transform.average_color(surface, rect))
+
+    # --- Disk cache ---
+
+    def _cache_key(self):
+        """Hash of everything that decides where tiles go and how they are scaled"""
+        layout = [self.tile_size, ATLAS_PAGE_TILES, sorted(self.slots.items()),
+                  [self.tile_types[tile_id] for tile_id in sorted(self.slots)]]
+        return hashlib.sha1(json.dumps(layout).encode()).hexdigest()[:16]
+
+    def _cache_path(self, suffix):
+        return os.path.join(self.cache_dir, f"atlas-{self.cache_key}{suffix}")
+
+    def _read_cache_index(self):
+        if self.cache_dir is None:
+            return
+        try:
+            with open(self._cache_path(".json")) as file:
+                index = json.load(file)
+            self.cached = {int(tile_id): entry for tile_id, entry in index["tiles"].items()}
+        except (OSError, ValueError, KeyError):
+            self.cached = {}
+
+    def _from_cache(self, tile_id):
+        """The tile's cache entry if the image hasn't changed since it was cached, or None.
+        Also takes the tile's color from it."""
+        entry = self.cached.get(tile_id)
+        if entry is None:
+            return None
+        source = self._image_source(tile_id)
+        if source is None or list(source) != entry["source"]:
+            del self.cached[tile_id]
+            self.cache_dirty = True
+            return None
+        self.sources[tile_id] = source
+        self.colors[tile_id] = tuple(entry["color"])
+        return entry
+
+    def _read_cached_page(self, page):
+        """Copy a page from the disk cache into the base atlas (once)"""
+        if page in self.cached_pages:
+            return
+        self.cached_pages.add(page)
+        size = self.base.page_size
+        with open(self._cache_path(f"-{page}.rgba"), "rb") as file:
+            data = file.read()
+        cached = pg.image.frombytes(data, (size, size), "RGBA")
+        if pg.display.get_surface():
+            cached = cached.convert_alpha()
+        # Keep tiles already decoded into this page
+        surface = self.base.pages[page]
+        if surface is not None:
+            for slot in self._page_slots(page) & self.base.filled:
+                _, rect = self.base.rect(slot)
+                _copy(surface, cached, rect.topleft, rect)
+        self.base.pages[page] = cached
+
+    def _page_slots(self, page):
+        per_page = ATLAS_PAGE_TILES * ATLAS_PAGE_TILES
+        return set(range(page * per_page, (page + 1) * per_page))
+
+    def save_cache(self):
+        """Write the decoded tiles (and those still cached) back to the disk cache"""
+        if self.cache_dir is None or not self.cache_dirty:
+            return
+        tiles = dict(self.cached)
+        for tile_id, source in self.sources.items():
+            if source is not None and self.slots[tile_id] in self.base.filled:
+                tiles[tile_id] = {"source": list(source), "color": list(self.colors[tile_id])}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        pages = {self.base.rect(self.slots[tile_id])[0] for tile_id in tiles}
+        for page in sorted(pages):
+            # Pages with cached tiles that were never used still need those tiles
+            unused = [tile_id for tile_id in self.cached
+                      if self.slots[tile_id] in self._page_slots(page) - self.base.filled]
+            if unused:
+                try:
+                    self._read_cached_page(page)
+                except (OSError, ValueError):
+                    for tile_id in unused:
+                        del tiles[tile_id]
+            with replacing_file(self._cache_path(f"-{page}.rgba")) as file:
+                file.write(pg.image.tobytes(self.base.page(page), "RGBA"))
+
+        # The index goes last, so it never lists tiles missing from the pages
+        with replacing_file(self._cache_path(".json")) as file:
+            file.write(json.dumps({"tiles": {str(tile_id): entry for tile_id, entry in tiles.items()}}).encode())
+        self.cached = tiles
+        self.cache_dirty = False
+
+
+def placeholder_color(tile_id):
+    return PLACEHOLDER_COLORS.get(tile_id, (255, 0, 255))  # Default to magenta
+
+
+def _copy(source, dest, position, area=None):
+    """Copy pixels, alpha included, instead of blending them onto what is there"""
+    rect = pg.Rect(position, (area or source.get_rect()).size)
+    dest.fill((0, 0, 0, 0), rect)
+    dest.blit(source, rect, area, special_flags=pg.BLEND_RGBA_ADD)
@@ -0,0 +1,255 @@
+"""Headless batch processing of map files, without opening a window.
+
+Usage examples:
+    python src/batch.py validate assets/
+    python src/batch.py convert --to tmap maps/ --out converted/
+    python src/batch.py resize --size 200x150 maps/level1.csv
+    python src/batch.py histogram --json maps/
+    python src/batch.py export --tile-size 16 maps/level1.tmap --out images/
+
+Directories are searched recursively for .csv and .tmap files, and files are
+processed in parallel across a pool of worker processes.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from tilemap import SparseTileMap, MAP_DTYPE, SPARSE_MAP_CELLS
+from tile_types import TILE_TYPES
+from mapio import (read_csv_map, read_binary_map, write_map_file, is_binary_map_path,
+                   read_layer_manifest, tile_table_hash, BINARY_MAP_EXT)
+from journal import replay_journal, remove_journal
+from export import export_png
+
+# File extensions picked up when a directory is given
+MAP_EXTENSIONS = (".csv", BINARY_MAP_EXT)
+
+
+def find_map_files(paths):
+    """Expand the given files and directories into a sorted list of map files"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names
+                             if name.lower().endswith(MAP_EXTENSIONS))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def load(path):
+    """Read a map file in either format, with its edit journal replayed. Returns the
+    map and a warning (or None)."""
+    warning = None
+    if is_binary_map_path(path):
+        tile_map, header = read_binary_map(path, MAP_DTYPE)
+        if header["tile_hash"] != tile_table_hash(TILE_TYPES):
+            warning = "saved with a different tile table"
+    else:
+        tile_map, _, _ = read_csv_map(path, MAP_DTYPE)
+    tile_map, _, journal_warning = replay_journal(path, tile_map)
+    return tile_map, warning or journal_warning
+
+
+def histogram(tile_map):
+    """Count the cells of each tile ID, returned as {tile_id: count}"""
+    counts = np.zeros(1, dtype=np.int64)
+    if tile_map.is_sparse:
+        # Cells outside the stored chunks are all empty
+        blocks = (chunk for _, chunk in tile_map.iter_chunks())
+    else:
+        blocks = (block for _, block in tile_map.iter_row_blocks(max(1, (1 << 20) // max(1, tile_map.width))))
+    for block in blocks:
+        block_counts = np.bincount(block.ravel())
+        if len(block_counts) > len(counts):
+            block_counts[:len(counts)] += counts
+            counts = block_counts
+        else:
+            counts[:len(block_counts)] += block_counts
+    if tile_map.is_sparse:
+        # Chunks also hold empty padding past the map edges, so count empty cells by subtraction
+        counts[0] = tile_map.width * tile_map.height - int(counts[1:].sum())
+    return {tile_id: int(count) for tile_id, count in enumerate(counts) if count}
+
+
+def output_path(path, out_dir, extension=None):
+    """Where to write the result for path: the same name in out_dir (or next to the
+    input), with the extension replaced if one is given"""
+    name = os.path.basename(path)
+    if extension is not None:
+        name = os.path.splitext(name)[0] + extension
+    return os.path.join(out_dir if out_dir else os.path.dirname(path), name)
+
+
+def save(path, tile_map, compress=False):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if os.name == 'nt':
+        # Windows can't replace a file that is still memory-mapped
+        tile_map.load_into_memory()
+    write_map_file(path, tile_map, tile_table_hash(TILE_TYPES), compress)
+    # Whatever journal the file had is now part of it (or no longer applies)
+    remove_journal(path)
+
+
+def validate_map(path, options):
+    tile_map, warning = load(path)
+    unknown = {tile_id: count for tile_id, count in histogram(tile_map).items() if tile_id not in TILE_TYPES}
+    data = {"width": tile_map.width, "height": tile_map.height,
+            "unknown": {str(tile_id): count for tile_id, count in unknown.items()}}
+    if unknown:
+        ids = ", ".join(str(tile_id) for tile_id in sorted(unknown))
+        return False, f"{sum(unknown.values())} cells with unknown tile IDs ({ids})", data
+    return True, f"OK, {tile_map.width}x{tile_map.height}" + (f" ({warning})" if warning else ""), data
+
+
+def convert_map(path, options):
+    tile_map, _ = load(path)
+    target = output_path(path, options["out"], options["to"])
+    if os.path.abspath(target) == os.path.abspath(path) and not options["out"]:
+        return False, "already in that format", {}
+    save(target, tile_map, options["compress"])
+    return True, f"wrote {target}", {"output": target}
+
+
+def resize_map(path, options):
+    tile_map, _ = load(path)
+    width, height = options["size"]
+    if not tile_map.is_sparse and width * height > SPARSE_MAP_CELLS:
+        tile_map = SparseTileMap.from_tile_map(tile_map)
+    old_size = f"{tile_map.width}x{tile_map.height}"
+    tile_map.resize(width, height)
+    target = output_path(path, options["out"])
+    save(target, tile_map, options["compress"])
+    return True, f"resized {old_size} to {width}x{height}, wrote {target}", {"output": target}
+
+
+def histogram_map(path, options):
+    tile_map, _ = load(path)
+    counts = histogram(tile_map)
+    text = ", ".join(f"{TILE_TYPES.get(tile_id, f'unknown {tile_id}')}: {count}" for tile_id, count in counts.items())
+    return True, text, {"counts": {str(tile_id): count for tile_id, count in counts.items()}}
+
+
+def export_map(path, options):
+    # Every visible layer, listed in the map's layer manifest if it has one
+    manifest = read_layer_manifest(path)
+    paths = [layer_path for _, layer_path, visible in manifest[0] if visible] if manifest else [path]
+    tile_maps = [load(layer_path)[0] for layer_path in paths]
+    if not tile_maps:
+        return False, "no visible layers", {}
+    for tile_map in tile_maps[1:]:
+        tile_map.resize(tile_maps[0].width, tile_maps[0].height)
+
+    # Tile images are decoded at the export size (pygame is only needed here)
+    from atlas import TileAtlas, placeholder_color
+    tile_size = options["tile_size"]
+    atlas = TileAtlas(TILE_TYPES, options["assets"], tile_size, placeholder_color)
+    target = output_path(path, options["out"], ".png")
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    width, height = export_png(target, tile_maps, tile_size, atlas.pixel_tables(tile_size), options["render_jobs"])
+    return True, f"wrote {width}x{height} {target}", {"output": target, "width": width, "height": height}
+
+
+COMMANDS = {
+    "validate": validate_map,
+    "convert": convert_map,
+    "resize": resize_map,
+    "histogram": histogram_map,
+    "export": export_map,
+}
+
+
+def run_task(command, path, options):
+    """Run one command on one file (in a worker process), timing it"""
+    start = time.perf_counter()
+    try:
+        ok, message, data = COMMANDS[command](path, options)
+    except Exception as e:
+        ok, message, data = False, f"error: {e}", {}
+    return {"path": path, "ok": ok, "message": message, "seconds": time.perf_counter() - start, **data}
+
+
+def parse_size(text):
+    try:
+        width, height = (int(part) for part in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("size must look like WIDTHxHEIGHT")
+    if width < 1 or height < 1:
+        raise argparse.ArgumentTypeError("size must be positive")
+    return width, height
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Process tile map files without opening the editor")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("paths", nargs="+", help="map files, or directories to search for .csv/.tmap files")
+    common.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of worker processes (default: %(default)s)")
+    common.add_argument("--json", action="store_true", help="print one JSON object per file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("validate", parents=[common], help="check for tile IDs missing from TILE_TYPES")
+    convert = subparsers.add_parser("convert", parents=[common], help="convert between CSV and .tmap")
+    convert.add_argument("--to", required=True, choices=["csv", BINARY_MAP_EXT[1:]], help="target format")
+    resize = subparsers.add_parser("resize", parents=[common], help="resize maps, keeping the top-left corner")
+    resize.add_argument("--size", required=True, type=parse_size, metavar="WxH", help="new map size")
+    for command in (convert, resize):
+        command.add_argument("--out", help="output directory (default: next to each input)")
+        command.add_argument("--compress", action="store_true", help="zlib-compress .tmap output")
+    subparsers.add_parser("histogram", parents=[common], help="count the cells of each tile ID")
+    export = subparsers.add_parser("export", parents=[common], help="render maps (all visible layers) to PNG")
+    export.add_argument("--tile-size", type=int, default=16, metavar="PIXELS",
+                        help="pixels per map cell (default: %(default)s)")
+    export.add_argument("--assets", default="assets", help="directory of tile images (default: %(default)s)")
+    export.add_argument("--out", help="output directory (default: next to each input)")
+    args = parser.parse_args(argv)
+    if getattr(args, "tile_size", 1) < 1:
+        parser.error("--tile-size must be positive")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = {
+        "to": f".{args.to}" if getattr(args, "to", None) else None,
+        "size": getattr(args, "size", None),
+        "out": getattr(args, "out", None),
+        "compress": getattr(args, "compress", False),
+        "tile_size": getattr(args, "tile_size", None),
+        "assets": getattr(args, "assets", None),
+    }
+    files = find_map_files(args.paths)
+    start = time.perf_counter()
+
+    # Small batches aren't worth starting worker processes for. A single file gets
+    # the workers to itself (exports render strips of it in parallel).
+    jobs = max(1, min(args.jobs or 1, len(files)))
+    options["render_jobs"] = args.jobs or 1 if jobs == 1 else 1
+    if jobs == 1:
+        results = (run_task(args.command, path, options) for path in files)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        results = pool.map(run_task, [args.command] * len(files), files, [options] * len(files))
+
+    failed = 0
+    for result in results:
+        failed += not result["ok"]
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            print(f"{result['path']}: {result['message']} ({result['seconds']:.2f}s)", flush=True)
+    if pool is not None:
+        pool.shutdown()
+
+    if not args.json:
+        print(f"{len(files)} files, {failed} failed, {time.perf_counter() - start:.2f}s with {jobs} worker(s)")
+    return 1 if failed or not files else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,373 @@
+"""Headless benchmarks of the editor's rendering, file and editing hot paths.
+
+Runs the editor on SDL's dummy video driver over a matrix of map sizes, zoom
+levels and tile densities, and prints the timings as JSON. Maps are generated
+from a fixed seed, so runs are comparable between changes:
+
+    python src/benchmark.py -o baseline.json
+    ... change something ...
+    python src/benchmark.py --baseline baseline.json
+
+With --baseline, every timing that got slower by more than --threshold is
+reported as a regression and the exit status is 1.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+
+# Draw into memory instead of a window (set before pygame is imported)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+import pygame as pg
+from tilemap import new_tile_map
+from tile_types import TILE_TYPES
+from main import TileEditor, SAVE_FINISHED_EVENT, TILE_SIZE
+
+# Default benchmark matrix
+MAP_SIZES = [64, 1024, 4096]
+ZOOM_LEVELS = [1.0, 0.25, 0.05]
+DENSITIES = [0.0, 0.25, 1.0]
+BENCHMARKS = ["draw_grid", "scroll", "draw_ui", "load_map", "save_map", "resize_map", "click"]
+REPEAT = 5
+SEED = 1234
+# Brush clicks timed together per repeat (the result is per click)
+CLICKS_PER_RUN = 20
+# Scroll steps (screen pixels per frame) and the frames timed together per repeat
+SCROLL_STEPS = [1, 16, 64]
+SCROLL_FRAMES = 20
+# Changes smaller than this (in seconds) are treated as noise when comparing
+MIN_DELTA = 0.0002
+
+
+def make_map(size, density, seed=SEED):
+    """A size x size map with the given fraction of cells set to random tiles"""
+    rng = np.random.default_rng(seed)
+    tile_map = new_tile_map(size, size)
+    tile_ids = np.array([tile_id for tile_id in TILE_TYPES if tile_id != 0], dtype=tile_map.dtype)
+    rows = max(1, (1 << 20) // size)
+    for y0 in range(0, size, rows):
+        height = min(rows, size - y0)
+        block = tile_ids[rng.integers(0, len(tile_ids), (height, size))]
+        block[rng.random((height, size), dtype=np.float32) >= density] = 0
+        tile_map.set_region(0, y0, block)
+    return tile_map
+
+
+def time_runs(run, repeat, setup=None, per_run=1):
+    """Time run() repeat times (calling setup() untimed before each), returning the
+    timing summary in seconds per operation"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) / per_run)
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "mean": statistics.fmean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "runs": repeat,
+    }
+
+
+class Bench:
+    """Runs the selected benchmarks against one editor and collects the results"""
+    def __init__(self, editor, zooms, repeat, out_dir, only):
+        self.editor = editor
+        self.zooms = zooms
+        self.repeat = repeat
+        self.out_dir = out_dir
+        self.only = only
+        self.results = []
+
+    def record(self, name, params, timing):
+        result = {"name": name, **params, **timing}
+        self.results.append(result)
+        details = " ".join(f"{key}={value}" for key, value in params.items())
+        print(f"{name:<12} {details:<50} {timing['median'] * 1000:9.3f} ms", file=sys.stderr, flush=True)
+
+    def wanted(self, name):
+        return name in self.only
+
+    def show(self, tile_map, zoom):
+        editor = self.editor
+        editor.set_map(tile_map)
+        editor.zoom_level = zoom
+        editor.jump_camera_to(tile_map.width / 2, tile_map.height / 2)
+        # The mip pyramid is built once per map (that cost belongs to loading)
+        editor.ensure_tile_colors()
+        editor.mip_pyramid.ensure_built()
+
+    def drop_map_caches(self):
+        """Forget everything rendered from the map, as after panning somewhere new"""
+        self.editor.map_chunks.clear()
+        self.editor.lod_frame_key = None
+
+    def drop_ui_caches(self):
+        editor = self.editor
+        editor.ui_layers = None
+        editor.minimap_key = None
+        editor.text_cache.clear()
+
+    def run_map(self, size, density):
+        editor = self.editor
+        tile_map = make_map(size, density)
+        params = {"size": f"{size}x{size}", "density": density}
+
+        for zoom in self.zooms:
+            self.show(tile_map, zoom)
+            if self.wanted("draw_grid"):
+                zoom_params = {**params, "zoom": zoom}
+                self.record("draw_grid", {**zoom_params, "cache": "cold"},
+                            time_runs(editor.draw_grid, self.repeat, self.drop_map_caches))
+                self.record("draw_grid", {**zoom_params, "cache": "warm"},
+                            time_runs(editor.draw_grid, self.repeat))
+            if self.wanted("scroll"):
+                self.run_scroll({**params, "zoom": zoom})
+            if self.wanted("click"):
+                self.run_clicks(tile_map, {**params, "zoom": zoom})
+
+        self.show(tile_map, 1.0)
+        if self.wanted("draw_ui"):
+            self.record("draw_ui", {**params, "cache": "cold"},
+                        time_runs(editor.draw_ui, self.repeat, self.drop_ui_caches))
+            self.record("draw_ui", {**params, "cache": "warm"}, time_runs(editor.draw_ui, self.repeat))
+
+        if self.wanted("resize_map"):
+            self.run_resize(tile_map, params)
+
+        for extension in (".csv", ".tmap"):
+            path = os.path.join(self.out_dir, f"bench_{size}_{density}{extension}")
+            file_params = {**params, "format": extension[1:]}
+            if self.wanted("save_map") or self.wanted("load_map"):
+                self.show(tile_map, 1.0)
+                self.record_or_run("save_map", file_params, lambda: self.save(path))
+            if self.wanted("load_map"):
+                editor.map_path = path
+                self.record("load_map", file_params, time_runs(editor.load_map, self.repeat))
+            if os.path.exists(path):
+                os.remove(path)
+
+    def record_or_run(self, name, params, run):
+        """Time run() if the benchmark was asked for, otherwise just run it once"""
+        if self.wanted(name):
+            self.record(name, params, time_runs(run, self.repeat))
+        else:
+            run()
+
+    def save(self, path):
+        editor = self.editor
+        editor.save_map(path)
+        editor.map_saver.wait()
+        for event in pg.event.get(SAVE_FINISHED_EVENT):
+            editor.finish_save(event)
+
+    def run_clicks(self, tile_map, params):
+        """Brush clicks on random visible cells, and a flood fill from the view's center"""
+        editor = self.editor
+        rng = np.random.default_rng(SEED)
+        cell_size = editor.cell_screen_size()
+        view_width = min(editor.palette_rect().x, (tile_map.width - editor.camera_x) * cell_size)
+        view_height = min(editor.viewport_height, editor.window_height - 25,
+                          (tile_map.height - editor.camera_y) * cell_size)
+        xs = rng.integers(0, max(1, int(view_width)), CLICKS_PER_RUN)
+        ys = rng.integers(0, max(1, int(view_height)), CLICKS_PER_RUN)
+        # Skip positions under the minimap, which would move the camera instead of painting
+        positions = [(int(x), int(y)) for x, y in zip(xs, ys)
+                     if not (editor.show_minimap and editor.minimap_rect().collidepoint(x, y))]
+
+        def clicks():
+            for position in positions:
+                editor.handle_mouse_click(position, 1)
+                editor.end_mouse_drag()
+
+        def undo_all():
+            while editor.history.undo_stack:
+                editor.undo()
+
+        # Each run's edits are undone before the next, so every run changes the same cells
+        editor.set_tool("brush")
+        self.record("click", {**params, "tool": "brush"},
+                    time_runs(clicks, self.repeat, undo_all, per_run=max(1, len(positions))))
+        undo_all()
+
+        center = (int(view_width // 2), int(view_height // 2))
+        editor.set_tool("fill")
+        self.record("click", {**params, "tool": "fill"},
+                    time_runs(lambda: editor.handle_mouse_click(center, 1), self.repeat, undo_all))
+        undo_all()
+        editor.set_tool("brush")
+        editor.history.clear()
+
+    def run_scroll(self, params):
+        """Frames of scrolling right, each redrawing what moved into view"""
+        editor = self.editor
+        for step in SCROLL_STEPS:
+            def frames():
+                for _ in range(SCROLL_FRAMES):
+                    editor.scroll(step, 0)
+                    editor.redraw()
+
+            def back():
+                editor.scroll(-step * SCROLL_FRAMES, 0)
+                editor.mark_dirty()
+                editor.redraw()
+
+            self.record("scroll", {**params, "step": step},
+                        time_runs(frames, self.repeat, back, per_run=SCROLL_FRAMES))
+            back()
+
+    def run_resize(self, tile_map, params):
+        editor = self.editor
+        width, height = tile_map.width, tile_map.height
+        self.record("resize_map", {**params, "change": "grow"},
+                    time_runs(lambda: editor.resize_map(width + 1, height + 1), self.repeat,
+                              lambda: editor.resize_map(width, height, record=False)))
+        self.record("resize_map", {**params, "change": "shrink"},
+                    time_runs(lambda: editor.resize_map(width, height), self.repeat,
+                              lambda: editor.resize_map(width + 1, height + 1, record=False)))
+        editor.history.clear()
+
+
+def result_key(result):
+    """Identify a result by its benchmark name and parameters (not its timings)"""
+    timing = {"median", "min", "mean", "stdev", "runs"}
+    return tuple(sorted((key, str(value)) for key, value in result.items() if key not in timing))
+
+
+def describe(result):
+    timing = {"name", "median", "min", "mean", "stdev", "runs"}
+    return result["name"] + " " + " ".join(f"{key}={value}" for key, value in result.items() if key not in timing)
+
+
+def compare(results, baseline, threshold, min_delta=MIN_DELTA):
+    """Print how each timing changed from the baseline. Returns the regressions:
+    results more than threshold (a fraction) and min_delta seconds slower."""
+    old = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        before = old.get(result_key(result))
+        if before is None:
+            continue
+        delta = result["median"] - before["median"]
+        change = delta / before["median"] if before["median"] > 0 else 0.0
+        if abs(delta) < min_delta or abs(change) <= threshold:
+            verdict = "ok"
+        elif delta > 0:
+            verdict = "REGRESSION"
+            regressions.append(result)
+        else:
+            verdict = "faster"
+        print(f"{verdict:<10} {describe(result):<70} {before['median'] * 1000:9.3f} -> "
+              f"{result['median'] * 1000:9.3f} ms ({change:+.0%})", file=sys.stderr)
+    print(f"{len(regressions)} regression(s) over {threshold:.0%}", file=sys.stderr)
+    return regressions
+
+
+def run_benchmarks(args):
+    # Work in a scratch directory so the editor never touches real maps
+    with tempfile.TemporaryDirectory(prefix="tile-editor-bench-") as out_dir:
+        cwd = os.getcwd()
+        assets = os.path.abspath(args.assets) if args.assets else None
+        os.chdir(out_dir)
+        try:
+            if assets:
+                # Real tile images blit differently from the placeholder squares
+                shutil.copytree(assets, "assets", ignore=lambda _, names: [
+                    name for name in names if not name.lower().endswith(".png")])
+            editor = TileEditor(autosave_interval=0)
+            editor.wait_for_loading()
+            bench = Bench(editor, args.zooms, args.repeat, out_dir, set(args.only))
+            for size in args.sizes:
+                for density in args.densities:
+                    bench.run_map(size, density)
+        finally:
+            os.chdir(cwd)
+            pg.quit()
+
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pygame": pg.version.ver,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "tile_size": TILE_SIZE,
+            "repeat": args.repeat,
+            "seed": SEED,
+            "assets": bool(args.assets),
+        },
+        "results": bench.results,
+    }
+
+
+def number_list(kind):
+    def parse(text):
+        try:
+            return [kind(part) for part in text.split(",") if part]
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"expected a comma-separated list of {kind.__name__}s")
+    return parse
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tile editor headlessly")
+    parser.add_argument("--sizes", type=number_list(int), default=MAP_SIZES,
+                        help="comma-separated map side lengths (default: %(default)s)")
+    parser.add_argument("--zooms", type=number_list(float), default=ZOOM_LEVELS,
+                        help="comma-separated zoom levels (default: %(default)s)")
+    parser.add_argument("--densities", type=number_list(float), default=DENSITIES,
+                        help="comma-separated fractions of non-empty cells (default: %(default)s)")
+    parser.add_argument("--only", type=lambda text: text.split(","), default=BENCHMARKS,
+                        help=f"comma-separated benchmarks to run (default: all of {','.join(BENCHMARKS)})")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="timed runs per case (default: %(default)s)")
+    parser.add_argument("--assets", help="directory of tile images to use instead of placeholder squares")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file instead of stdout")
+    parser.add_argument("--baseline", help="compare against results saved by an earlier run")
+    parser.add_argument("--results", help="compare these saved results instead of running the benchmarks")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="slowdown (as a fraction) reported as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+    unknown = set(args.only) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    if args.results and not args.baseline:
+        parser.error("--results needs --baseline")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.results:
+        with open(args.results) as file:
+            results = json.load(file)
+    else:
+        results = run_benchmarks(args)
+        text = json.dumps(results, indent=1)
+        if args.output:
+            with open(args.output, "w") as file:
+                file.write(text + "\n")
+        else:
+            print(text)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import struct
+import zlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from mapio import replacing_file
+
+# Upper bound on the pixels rendered in one strip (in bytes of RGB), which keeps
+# an export's memory use the same for any map height
+EXPORT_STRIP_BYTES = 32 * 1024 * 1024
+# zlib level of exported PNGs
+PNG_COMPRESSION = 6
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Tile pixels of a worker process (views of the exporter's shared memory), set up
+# once by _init_worker
+_worker_tables = None
+_worker_memory = None
+
+
+def export_png(path, tile_maps, tile_size, tables, jobs=1, strip_bytes=EXPORT_STRIP_BYTES, progress=None):
+    """Render maps, stacked bottom first (visible layers of one map), to a PNG at
+    tile_size pixels per cell, with empty cells black. tables are the tiles'
+    (premultiplied RGB, alpha) pixel arrays indexed by tile ID (see
+    TileAtlas.pixel_tables).
+
+    The image is rendered in horizontal strips of at most strip_bytes, spread
+    over jobs worker processes, and streamed into the PNG in order, with only a
+    few strips in memory at a time. Only the cells under each strip are read
+    from the maps, as it's handed out, so the maps mustn't change meanwhile.
+    The workers share one copy of tables. progress(rows done, rows) is called
+    as strips are written. Returns the image size.
+    """
+    width, height = tile_maps[0].width * tile_size, tile_maps[0].height * tile_size
+    if width == 0 or height == 0:
+        raise ValueError("The map is empty")
+    if width >= 1 << 31 or height >= 1 << 31:
+        raise ValueError(f"{width}x{height} pixels is too big for a PNG")
+    rows_per_strip = max(1, strip_bytes // (width * 3))
+    strips = [(y0, min(y0 + rows_per_strip, height)) for y0 in range(0, height, rows_per_strip)]
+    # Small images aren't worth starting worker processes for
+    jobs = min(jobs, len(strips))
+
+    def cells(y0, y1):
+        # The cell rows under pixel rows [y0, y1) of every layer
+        cy0, cy1 = y0 // tile_size, (y1 - 1) // tile_size + 1
+        return np.stack([np.asarray(tile_map.region(0, cy0, tile_map.width, cy1)) for tile_map in tile_maps])
+
+    with replacing_file(path) as file:
+        writer = _PngWriter(file, width, height)
+        if jobs <= 1:
+            for y0, y1 in strips:
+                writer.write_rows(render_rows(cells(y0, y1), y0, y1, tile_size, tables))
+                if progress is not None:
+                    progress(y1, height)
+        else:
+            # Workers render strips ahead of the writer, but only a couple each
+            context = multiprocessing.get_context("spawn")
+            memory = [_shared_copy(table) for table in tables]
+            try:
+                shared = [(block.name, table.shape, table.dtype.str) for block, table in zip(memory, tables)]
+                with ProcessPoolExecutor(jobs, mp_context=context, initializer=_init_worker,
+                                         initargs=(shared,)) as pool:
+                    pending = deque()
+                    for y0, y1 in strips:
+                        pending.append((pool.submit(_render_strip, cells(y0, y1), y0, y1, tile_size), y1))
+                        if len(pending) >= 2 * jobs:
+                            _write_next(writer, pending, height, progress)
+                    while pending:
+                        _write_next(writer, pending, height, progress)
+            finally:
+                for block in memory:
+                    block.close()
+                    block.unlink()
+        writer.close()
+    return width, height
+
+
+def render_rows(cells, y0, y1, tile_size, tables):
+    """Render pixel rows [y0, y1) of the map image from the layers' cells (an array
+    of shape (layers, cell rows, columns) starting at cell row y0 // tile_size).
+    Returns the rows as a (y1 - y0, columns * tile_size * 3) uint8 array."""
+    rgb, alpha = tables
+    rows = np.arange(y0, y1)
+    cell_rows = rows // tile_size - y0 // tile_size
+    tile_rows = (rows % tile_size)[:, None]
+    out = None
+    for layer in cells:
+        # Tile IDs without pixels (empty and unknown tiles) are transparent
+        ids = layer[cell_rows]
+        ids = np.where(ids < len(rgb), ids, 0)
+        color = rgb[ids, tile_rows]  # (rows, columns, tile_size, 3)
+        if out is None:
+            out = color
+        else:
+            # Premultiplied "over": the layer covers what is below by its alpha
+            cover = alpha[ids, tile_rows].astype(np.uint16)
+            out = ((out * (255 - cover) + 127) // 255 + color).astype(np.uint8)
+    return out.reshape(len(rows), -1)
+
+
+def _shared_copy(array):
+    """A shared memory block holding a copy of array"""
+    block = SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+    return block
+
+
+def _init_worker(shared):
+    global _worker_tables, _worker_memory
+    # The blocks must stay open for as long as the views into them are used
+    _worker_memory = [SharedMemory(name=name) for name, _, _ in shared]
+    _worker_tables = tuple(np.ndarray(shape, dtype, buffer=block.buf)
+                           for block, (_, shape, dtype) in zip(_worker_memory, shared))
+
+
+def _render_strip(cells, y0, y1, tile_size):
+    return render_rows(cells, y0, y1, tile_size, _worker_tables)
+
+
+def _write_next(writer, pending, height, progress):
+    future, y1 = pending.popleft()
+    writer.write_rows(future.result())
+    if progress is not None:
+        progress(y1, height)
+
+
+class _PngWriter:
+    """Writes an 8-bit RGB PNG a few rows at a time"""
+    def __init__(self, file, width, height):
+        self.file = file
+        self.compressor = zlib.compressobj(PNG_COMPRESSION)
+        file.write(_PNG_SIGNATURE)
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def write_rows(self, rows):
+        # Every row starts with its filter type (0, none)
+        data = np.zeros((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        data[:, 1:] = rows
+        self._chunk(b"IDAT", self.compressor.compress(data))
+
+    def close(self):
+        self._chunk(b"IDAT", self.compressor.flush())
+        self._chunk(b"IEND", b"", force=True)
+
+    def _chunk(self, kind, data, force=False):
+        if not data and not force:
+            return
+        self.file.write(struct.pack(">I", len(data)) + kind + data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
@@ -0,0 +1,242 @@
+from collections import deque
+import numpy as np
+
+
+class CellEdit:
+    """Scattered single-cell changes stored as packed coordinate and value arrays"""
+    def __init__(self, xs, ys, old, new):
+        self.xs = xs
+        self.ys = ys
+        self.old = old
+        self.new = new
+
+    @property
+    def nbytes(self):
+        return self.xs.nbytes + self.ys.nbytes + self.old.nbytes + self.new.nbytes
+
+    def apply(self, editor, undo):
+        editor.write_cells(self.xs, self.ys, self.old if undo else self.new)
+
+
+class RegionEdit:
+    """A rectangular block of changes with its top-left corner at (x0, y0)"""
+    def __init__(self, x0, y0, old, new):
+        self.x0 = x0
+        self.y0 = y0
+        self.old = old
+        self.new = new
+
+    @property
+    def nbytes(self):
+        return self.old.nbytes + self.new.nbytes
+
+    def apply(self, editor, undo):
+        editor.write_region(self.x0, self.y0, self.old if undo else self.new)
+
+
+class MaskEdit:
+    """Cells in a boolean mask (e.g. a flood fill) that all changed from one tile ID to another"""
+    def __init__(self, x0, y0, mask, old_id, new_id):
+        self.x0 = x0
+        self.y0 = y0
+        self.shape = mask.shape
+        self.bits = np.packbits(mask, axis=None)
+        self.old_id = old_id
+        self.new_id = new_id
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def apply(self, editor, undo):
+        mask = np.unpackbits(self.bits, count=self.shape[0] * self.shape[1]).reshape(self.shape).astype(bool)
+        editor.write_mask(self.x0, self.y0, mask, self.old_id if undo else self.new_id)
+
+
+class ResizeEdit:
+    """A map resize, keeping the cells a shrink cut off so undo can restore them"""
+    def __init__(self, old_size, new_size, lost):
+        self.old_size = old_size
+        self.new_size = new_size
+        self.lost = lost  # [(layer, x0, y0, block)] of non-empty cells outside the new size
+
+    @property
+    def nbytes(self):
+        return sum(block.nbytes for _, _, _, block in self.lost)
+
+    def apply(self, editor, undo):
+        if not undo:
+            editor.resize_map(*self.new_size, record=False)
+            return
+        editor.resize_map(*self.old_size, record=False)
+        for layer, x0, y0, block in self.lost:
+            editor.write_region(x0, y0, block, layer)
+
+
+def capture_cells(tile_map, x0, y0, x1, y1):
+    """Copy the non-empty parts of [x0, x1) x [y0, y1) as a list of (x0, y0, block)"""
+    x1, y1 = min(x1, tile_map.width), min(y1, tile_map.height)
+    if x1 <= x0 or y1 <= y0:
+        return []
+    if not tile_map.is_sparse:
+        block = tile_map.region(x0, y0, x1, y1)
+        return [(x0, y0, block.copy())] if block.any() else []
+
+    # Only allocated chunks can hold anything
+    size = tile_map.chunk_size
+    pieces = []
+    for (cx, cy), chunk in tile_map.iter_chunks():
+        left, top = max(x0, cx * size), max(y0, cy * size)
+        right, bottom = min(x1, (cx + 1) * size), min(y1, (cy + 1) * size)
+        if left >= right or top >= bottom:
+            continue
+        block = chunk[top - cy * size:bottom - cy * size, left - cx * size:right - cx * size]
+        if block.any():
+            pieces.append((left, top, block.copy()))
+    return pieces
+
+
+class EditTransaction:
+    """One undoable action, made of edits applied in order to one map layer"""
+    def __init__(self, name, layer=None):
+        self.name = name
+        self.layer = layer
+        self.edits = []
+
+    @property
+    def nbytes(self):
+        return sum(edit.nbytes for edit in self.edits)
+
+    def apply(self, editor, undo):
+        for edit in reversed(self.edits) if undo else self.edits:
+            edit.apply(editor, undo)
+
+
+class EditHistory:
+    """Undo/redo stacks of edit transactions, limited to max_bytes of recorded changes.
+
+    Cell changes recorded between begin() and commit() are coalesced into one
+    transaction (a cell changed several times keeps its first old and last new
+    value). Changes recorded outside a transaction become their own transaction.
+    When over budget, the oldest undo steps are dropped first. New transactions
+    are tagged with layer, the map layer the caller is editing.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.layer = None
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.used_bytes = 0
+        self.pending = None
+        self.pending_cells = None
+
+    def begin(self, name):
+        self.commit()
+        self.pending = EditTransaction(name, self.layer)
+        self.pending_cells = ([], [], [], [])
+
+    @property
+    def in_transaction(self):
+        return self.pending is not None
+
+    def record_cell(self, x, y, old, new, name="Edit"):
+        if old == new:
+            return
+        auto = self.pending is None
+        if auto:
+            self.begin(name)
+        xs, ys, olds, news = self.pending_cells
+        xs.append(x)
+        ys.append(y)
+        olds.append(old)
+        news.append(new)
+        if auto:
+            self.commit()
+
+    def record_cells(self, xs, ys, old, new, name="Edit"):
+        """Record many cell changes at once from coordinate and value arrays"""
+        auto = self.pending is None
+        if auto:
+            self.begin(name)
+        self._flush_cells()
+        self._add_cell_edit(np.asarray(xs), np.asarray(ys), np.asarray(old), np.asarray(new))
+        if auto:
+            self.commit()
+
+    def record(self, edit, name="Edit"):
+        """Record a RegionEdit, ResizeEdit or other edit object"""
+        auto = self.pending is None
+        if auto:
+            self.begin(name)
+        self._flush_cells()
+        self.pending.edits.append(edit)
+        if auto:
+            self.commit()
+
+    def _flush_cells(self):
+        """Turn the single cells recorded so far into a packed CellEdit"""
+        xs, ys, olds, news = self.pending_cells
+        if not xs:
+            return
+        dtype = np.min_scalar_type(max(max(olds), max(news)))
+        self._add_cell_edit(np.array(xs, dtype=np.uint32), np.array(ys, dtype=np.uint32),
+                            np.array(olds, dtype=dtype), np.array(news, dtype=dtype))
+        self.pending_cells = ([], [], [], [])
+
+    def _add_cell_edit(self, xs, ys, old, new):
+        # Coalesce repeated changes to the same cell, then drop the ones that cancel out
+        keys = (ys.astype(np.uint64) << np.uint64(32)) | xs.astype(np.uint64)
+        _, first = np.unique(keys, return_index=True)
+        if len(first) < len(keys):
+            _, last = np.unique(keys[::-1], return_index=True)
+            last = len(keys) - 1 - last
+            xs, ys, old, new = xs[first], ys[first], old[first], new[last]
+        changed = old != new
+        if not changed.all():
+            xs, ys, old, new = xs[changed], ys[changed], old[changed], new[changed]
+        if len(xs):
+            self.pending.edits.append(CellEdit(xs.astype(np.uint32), ys.astype(np.uint32), old, new))
+
+    def commit(self):
+        """Close the open transaction and push it if it changed anything"""
+        if self.pending is None:
+            return
+        self._flush_cells()
+        transaction, self.pending, self.pending_cells = self.pending, None, None
+        if transaction.edits:
+            self.push(transaction)
+
+    def push(self, transaction):
+        # A new action makes the redo steps unreachable
+        self.used_bytes -= sum(t.nbytes for t in self.redo_stack)
+        self.redo_stack.clear()
+        self.undo_stack.append(transaction)
+        self.used_bytes += transaction.nbytes
+
+        # Over budget: forget the oldest steps (possibly including this one)
+        while self.used_bytes > self.max_bytes and self.undo_stack:
+            self.used_bytes -= self.undo_stack.popleft().nbytes
+
+    def undo(self):
+        """Pop the latest transaction for the caller to apply in reverse, or None"""
+        self.commit()
+        if not self.undo_stack:
+            return None
+        transaction = self.undo_stack.pop()
+        self.redo_stack.append(transaction)
+        return transaction
+
+    def redo(self):
+        self.commit()
+        if not self.redo_stack:
+            return None
+        transaction = self.redo_stack.pop()
+        self.undo_stack.append(transaction)
+        return transaction
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.used_bytes = 0
+        self.pending = None
+        self.pending_cells = None
@@ -0,0 +1,152 @@
+import os
+import struct
+import zlib
+import numpy as np
+from tilemap import SparseTileMap, MAP_DTYPE, SPARSE_MAP_CELLS
+
+# Edit journal: an append-only file next to a map ("map.csv.journal") holding
+# the changes saved since the map file was last written in full. A header ties
+# it to one version of the map file; each record is a resize or a block of cells.
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_MAGIC = b"TJNL"
+JOURNAL_VERSION = 1
+# magic, version, map file size, map file mtime (ns), dtype
+_JOURNAL_HEADER = struct.Struct("<4sHQq8s")
+# crc32 of the rest of the record, kind, x0, y0, width, height; cell records
+# are followed by width x height cells
+_RECORD_HEADER = struct.Struct("<IBIIII")
+_RESIZE = 1
+_CELLS = 2
+
+
+def journal_path(map_path):
+    return map_path + JOURNAL_SUFFIX
+
+
+def journal_size(map_path):
+    """Size in bytes of a map's journal, 0 if it has none"""
+    try:
+        return os.path.getsize(journal_path(map_path))
+    except OSError:
+        return 0
+
+
+def remove_journal(map_path):
+    """Delete a map's journal, once the map file holds everything in it"""
+    try:
+        os.remove(journal_path(map_path))
+    except FileNotFoundError:
+        pass
+
+
+def append_journal(map_path, records, dtype=MAP_DTYPE):
+    """Append records to the journal of the map file at map_path and flush them to
+    disk, returning the journal's new size. Records are ("resize", width, height)
+    or ("cells", x0, y0, block).
+
+    A journal written for another version of the map file is started over, and a
+    damaged tail (from a crash halfway through an append) is cut off first.
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    header = _pack_header(map_path, dtype)
+    path = journal_path(map_path)
+    mode = "r+b" if os.path.exists(path) else "w+b"
+    with open(path, mode) as file:
+        end = len(header)
+        if file.read(len(header)) == header:
+            for _, _, _, _, _, _, end in _iter_records(file, dtype):
+                pass
+        else:
+            file.seek(0)
+            file.write(header)
+        file.seek(end)
+        file.truncate()
+        for record in records:
+            file.write(_pack_record(record, dtype))
+        file.flush()
+        os.fsync(file.fileno())
+        return file.tell()
+
+
+def replay_journal(map_path, tile_map):
+    """Apply the journal of the map file at map_path to the map just read from it.
+
+    Returns (map, records applied, warning). A resize can switch a dense map to
+    sparse storage, so the returned map replaces the one passed in. Records
+    after a damaged one are skipped, and so is a journal that was written for
+    another version of the map file.
+    """
+    path = journal_path(map_path)
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return tile_map, 0, None
+    with file:
+        header = file.read(_JOURNAL_HEADER.size)
+        dtype = _journal_dtype(header)
+        if dtype is None or header != _pack_header(map_path, dtype):
+            return tile_map, 0, f"Ignored {os.path.basename(path)}, it doesn't match the map file"
+        applied = 0
+        end = len(header)
+        for kind, x0, y0, width, height, cells, end in _iter_records(file, dtype):
+            if kind == _RESIZE:
+                if not tile_map.is_sparse and width * height > SPARSE_MAP_CELLS:
+                    tile_map = SparseTileMap.from_tile_map(tile_map)
+                tile_map.resize(width, height)
+            else:
+                tile_map.set_region(x0, y0, cells.astype(tile_map.dtype, copy=False))
+            applied += 1
+        damaged = end != os.fstat(file.fileno()).st_size
+    warning = f"Skipped the damaged end of {os.path.basename(path)}" if damaged else None
+    return tile_map, applied, warning
+
+
+def _pack_header(map_path, dtype):
+    stat = os.stat(map_path)
+    return _JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, stat.st_size, stat.st_mtime_ns,
+                                dtype.str.encode("ascii"))
+
+
+def _journal_dtype(header):
+    """The cell dtype named in a journal header, or None if it isn't a usable header"""
+    if len(header) != _JOURNAL_HEADER.size:
+        return None
+    magic, version, _, _, dtype = _JOURNAL_HEADER.unpack(header)
+    if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION:
+        return None
+    try:
+        return np.dtype(dtype.rstrip(b"\0").decode("ascii"))
+    except (TypeError, UnicodeDecodeError):
+        return None
+
+
+def _pack_record(record, dtype):
+    if record[0] == "resize":
+        _, width, height = record
+        fields, payload = (_RESIZE, 0, 0, width, height), b""
+    else:
+        _, x0, y0, block = record
+        fields, payload = (_CELLS, x0, y0, block.shape[1], block.shape[0]), block.astype(dtype).tobytes()
+    body = _RECORD_HEADER.pack(0, *fields)[4:]
+    crc = zlib.crc32(payload, zlib.crc32(body))
+    return struct.pack("<I", crc) + body + payload
+
+
+def _iter_records(file, dtype):
+    """Yield (kind, x0, y0, width, height, cells, end offset) for each record from
+    the file position on, stopping at the first truncated or damaged one"""
+    total = os.fstat(file.fileno()).st_size
+    while True:
+        raw = file.read(_RECORD_HEADER.size)
+        if len(raw) < _RECORD_HEADER.size:
+            return
+        crc, kind, x0, y0, width, height = _RECORD_HEADER.unpack(raw)
+        size = width * height * dtype.itemsize if kind == _CELLS else 0
+        # A damaged size could be anything, so check it against what's left of the file
+        if kind not in (_RESIZE, _CELLS) or size > total - file.tell():
+            return
+        payload = file.read(size)
+        if zlib.crc32(payload, zlib.crc32(raw[4:])) != crc:
+            return
+        cells = np.frombuffer(payload, dtype=dtype).reshape(height, width) if kind == _CELLS else None
+        yield kind, x0, y0, width, height, cells, file.tell()
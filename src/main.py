@@ -1,14 +1,35 @@
+import time
+STARTUP_TIME = time.perf_counter()  # Before the other imports, for the startup report
 import os
-import csv
+import argparse
+import queue
+import itertools
+import threading
+from collections import OrderedDict
+import numpy as np
 import pygame as pg
-import tkinter as tk
-from tkinter import filedialog
+from tilemap import TileMap, SparseTileMap, LayerStack, MAP_DTYPE, SPARSE_MAP_CELLS
+from tile_types import TILE_TYPES
+from mipmap import MipPyramid
+from history import EditHistory, RegionEdit, MaskEdit, ResizeEdit, capture_cells
+from paint import polyline_cells, flood_fill_mask, stamp_block, pattern_tiles
+from profiler import FrameProfiler, StartupTimer
+from atlas import TileAtlas, placeholder_color
+from mapio import (read_csv_map, read_binary_map, write_map_file, is_binary_map_path, tile_table_hash,
+                   read_layer_manifest, write_layer_manifest, layer_file_path, BINARY_MAP_EXT)
+from journal import append_journal, replay_journal, remove_journal, journal_path, journal_size
+from stamps import save_stamp, load_stamp, stamp_names
+from export import export_png
+from session import SessionRecorder, decode_event, map_checksum
+IMPORTS_DONE_TIME = time.perf_counter()
 
 # Constants
 TILE_SIZE = 48  # Default size of tile on screen (actual tile size doesnt matter)
 GRID_WIDTH = 10  # Default width for new maps
 GRID_HEIGHT = 10  # Default height for new maps
 PALETTE_HEIGHT = 2
+# Name of the first layer of maps saved without layers
+DEFAULT_LAYER_NAME = "ground"
 # Constants for map size limits
 MIN_GRID_SIZE = 3
 MAX_GRID_WIDTH = float('inf')  # Unlimited width
@@ -24,156 +45,910 @@ WHITE = (255, 255, 255)
 GRAY = (128, 128, 128)
 LIGHT_GRAY = (200, 200, 200)
 RED = (255, 0, 0)
+YELLOW = (255, 220, 0)
 DARK_GRAY = (50, 50, 50)
 SEMI_TRANSPARENT = (0, 0, 0, 128) 
 
-'''
-This dictionary maps tile IDs to their names.
-You can add more tiles as needed.
-0: "empty" is a special tile that represents no tile. 
-    When you right click on a tile, it will be set to this ID.
-
-Tiles are loaded from the "assets" directory as PNG images.    
-'''
-TILE_TYPES = {
-    0: "empty",
-    1: "grass",
-    2: "water",
-    3: "dirt"
-}
+# Compress binary (.tmap) maps with zlib when saving (compressed maps can't be memory-mapped)
+COMPRESS_BINARY_MAPS = False
 
-class TileEditor:
+# Seconds between automatic saves of unsaved changes to the map's edit journal (0 disables autosave)
+AUTOSAVE_INTERVAL = 120
+# Past this size (in bytes) the edit journal is compacted: the next autosave writes the whole map instead
+JOURNAL_COMPACT_BYTES = 16 * 1024 * 1024
+
+# Events posted by the map saver, loader and exporter threads and the autosave timer
+SAVE_FINISHED_EVENT = pg.event.custom_type()
+AUTOSAVE_EVENT = pg.event.custom_type()
+LOAD_PROGRESS_EVENT = pg.event.custom_type()
+LOAD_FINISHED_EVENT = pg.event.custom_type()
+EXPORT_FINISHED_EVENT = pg.event.custom_type()
+# Minimum seconds between progress updates while a map loads
+LOAD_PROGRESS_INTERVAL = 0.05
+# Background results handled by the editor loop, by the names they have in session
+# recordings (replays wait for each one in the frame it was handled in)
+SESSION_MARKERS = {LOAD_PROGRESS_EVENT: "progress", LOAD_FINISHED_EVENT: "load", SAVE_FINISHED_EVENT: "save",
+                   EXPORT_FINISHED_EVENT: "export", AUTOSAVE_EVENT: "autosave"}
+# Seconds a replay waits for a background result before giving up on it
+REPLAY_WAIT_TIMEOUT = 60
+# Keys the editor loop polls (rather than handling their events), recorded with each frame
+SCROLL_KEYS = (pg.K_LEFT, pg.K_RIGHT, pg.K_UP, pg.K_DOWN)
+
+# File dialog filters for the supported map formats
+MAP_FILE_TYPES = (("Map files", f"*.csv *{BINARY_MAP_EXT}"), ("CSV files", "*.csv"),
+                  ("Binary maps", f"*{BINARY_MAP_EXT}"), ("All files", "*.*"))
+
+# Decoded tile images are cached here as atlas pages, so later starts skip PNG decoding (None disables)
+TILE_CACHE_DIR = os.path.join("assets", ".tile-cache")
+
+# Redraw and flip the whole window every frame instead of only what changed
+ALWAYS_REDRAW = False
+# Above this many dirty rectangles a frame updates their bounding box instead
+MAX_DIRTY_RECTS = 8
+# Speed of held-arrow scrolling, in screen pixels per second
+SCROLL_SPEED = 20 * TILE_SIZE
+# Longest frame time a scroll step covers (in ms), so the first step after idling doesn't jump
+MAX_SCROLL_STEP = 34
+
+# Memory budget for undo/redo history; the oldest steps are forgotten first
+UNDO_HISTORY_BYTES = 64 * 1024 * 1024
+
+# Cells smaller than this many pixels are drawn from the mip pyramid instead of tile images
+LOD_TILE_SIZE = 8
+# Largest side of the minimap overlay, in pixels
+MINIMAP_SIZE = 160
+
+# Tile palette grid: columns, gap between tiles, height of a row (tile and label),
+# where the grid starts below the title and its left margin
+PALETTE_COLUMNS = 2
+PALETTE_TILE_SPACING = 1
+PALETTE_ROW_HEIGHT = TILE_SIZE + 25
+PALETTE_TOP = 40
+PALETTE_MARGIN = 10
+# Pixels the palette scrolls per mouse wheel step
+PALETTE_SCROLL_STEP = PALETTE_ROW_HEIGHT
+
+# Maximum number of rendered text surfaces kept around by the text cache
+TEXT_CACHE_SIZE = 256
+# Color used for the transparent parts of cached UI layers
+UI_COLORKEY = (1, 2, 3)
+
+# The map is pre-rendered in square chunks of CHUNK_SIZE x CHUNK_SIZE cells
+CHUNK_SIZE = 16
+# Upper bound on the memory used by pre-rendered chunk surfaces (in bytes)
+CHUNK_CACHE_BYTES = 64 * 1024 * 1024
+
+# Time the phases of every frame from startup and show the profiler overlay (F3 toggles it)
+PROFILE = False
+# Minimum milliseconds between refreshes of the profiler overlay
+PROFILE_OVERLAY_INTERVAL = 250
+
+# Print how long each step of startup took (also turned on by the environment variable below)
+STARTUP_REPORT = False
+STARTUP_REPORT_ENV = "TILE_EDITOR_STARTUP_REPORT"
+# Time to first frame (in seconds) the startup report checks against
+STARTUP_TARGET = 0.5
+
+class TextCache:
+    """LRU cache of rendered text surfaces keyed by (text, font, color)"""
+    def __init__(self, max_entries=TEXT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def render(self, font, text, color):
+        key = (text, font, color)
+        surface = self.entries.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return surface
+        
+        self.misses += 1
+        surface = font.render(text, True, color)
+        self.entries[key] = surface
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)  # Evict least recently used
+        return surface
+    
+    def clear(self):
+        self.entries.clear()
+
+
+class MapChunkCache:
+    """LRU cache of pre-rendered map chunks for the current zoom level"""
+    def __init__(self, max_bytes=CHUNK_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.used_bytes = 0
+        self.tile_size = None
+        self.hits = 0
+        self.renders = 0
+    
+    def set_tile_size(self, tile_size):
+        # Chunks are rendered once per zoom level, so a new size drops them all
+        if tile_size != self.tile_size:
+            self.clear()
+            self.tile_size = tile_size
+    
+    def get(self, cx, cy):
+        surface = self.entries.get((cx, cy))
+        if surface is not None:
+            self.hits += 1
+            self.entries.move_to_end((cx, cy))
+        return surface
+    
+    def put(self, cx, cy, surface):
+        self.discard(cx, cy)
+        self.entries[(cx, cy)] = surface
+        self.used_bytes += surface.get_width() * surface.get_height() * surface.get_bytesize()
+        self.renders += 1
+        
+        # Evict least recently used chunks, but always keep the one just rendered
+        while self.used_bytes > self.max_bytes and len(self.entries) > 1:
+            _, old = self.entries.popitem(last=False)
+            self.used_bytes -= old.get_width() * old.get_height() * old.get_bytesize()
+    
+    def discard(self, cx, cy):
+        old = self.entries.pop((cx, cy), None)
+        if old is not None:
+            self.used_bytes -= old.get_width() * old.get_height() * old.get_bytesize()
+    
+    def invalidate_cells(self, x0, y0, x1, y1):
+        """Mark every chunk overlapping the cell rectangle [x0, x1) x [y0, y1) as dirty"""
+        if x1 <= x0 or y1 <= y0:
+            return
+        cx0, cx1 = max(0, x0) // CHUNK_SIZE, (x1 - 1) // CHUNK_SIZE
+        cy0, cy1 = max(0, y0) // CHUNK_SIZE, (y1 - 1) // CHUNK_SIZE
+        for cx, cy in list(self.entries):
+            if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                self.discard(cx, cy)
+    
+    def invalidate_cell(self, x, y):
+        self.discard(x // CHUNK_SIZE, y // CHUNK_SIZE)
+    
+    def clear(self):
+        self.entries.clear()
+        self.used_bytes = 0
+
+
+class MapLayer:
+    """One named layer of the map. Layers are drawn bottom (first) to top, each
+    covering the ones below except where it is empty."""
+    def __init__(self, name, tile_map, visible=True):
+        self.name = name
+        self.tile_map = tile_map
+        self.visible = visible
+        self.journal_chunks = set()  # Chunks changed since the last save
+
+
+class PaletteLayout:
+    """Slots of the tile palette grid, filled in tile ID order with the tiles whose
+    names start with a prefix. tile_ids maps a slot to its tile, so hit testing
+    and drawing only ever look at the slots on screen."""
+    def __init__(self, tile_types, prefix=""):
+        self.prefix = prefix
+        prefix = prefix.lower()
+        self.tile_ids = [tile_id for tile_id in sorted(tile_types)
+                         if tile_id != 0 and tile_types[tile_id].lower().startswith(prefix)]
+        self.slots = {tile_id: slot for slot, tile_id in enumerate(self.tile_ids)}
+    
+    @property
+    def rows(self):
+        return -(-len(self.tile_ids) // PALETTE_COLUMNS)
+    
+    @property
+    def content_height(self):
+        return self.rows * PALETTE_ROW_HEIGHT
+    
+    def slot_position(self, slot, scroll):
+        """Top-left corner of a slot's tile, in palette coordinates"""
+        row, col = divmod(slot, PALETTE_COLUMNS)
+        return (PALETTE_MARGIN + col * (TILE_SIZE + PALETTE_TILE_SPACING),
+                PALETTE_TOP + row * PALETTE_ROW_HEIGHT - scroll)
+    
+    def visible_slots(self, scroll, height):
+        """Slots in the rows that show in a palette height pixels high"""
+        first_row = scroll // PALETTE_ROW_HEIGHT
+        last_row = (scroll + height - PALETTE_TOP - 1) // PALETTE_ROW_HEIGHT
+        return range(first_row * PALETTE_COLUMNS, min(len(self.tile_ids), (last_row + 1) * PALETTE_COLUMNS))
+    
+    def tile_at(self, x, y, scroll):
+        """The tile under a point in palette coordinates, or None"""
+        if y < PALETTE_TOP:
+            return None
+        col = (x - PALETTE_MARGIN) // (TILE_SIZE + PALETTE_TILE_SPACING)
+        row, offset = divmod(y - PALETTE_TOP + scroll, PALETTE_ROW_HEIGHT)
+        if not 0 <= col < PALETTE_COLUMNS or offset >= TILE_SIZE:
+            return None
+        slot = row * PALETTE_COLUMNS + col
+        return self.tile_ids[slot] if slot < len(self.tile_ids) else None
+
+
+class MapSaver:
+    """Writes map snapshots and journal appends on a background thread, one at a time,
+    so saving never blocks the editor. Each result is reported by posting a SAVE_FINISHED_EVENT."""
     def __init__(self):
-        pg.init()
-        self.grid_width = GRID_WIDTH
-        self.grid_height = GRID_HEIGHT
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.pending = 0  # Saves not yet reported back to the main thread
+    
+    @property
+    def busy(self):
+        return self.pending > 0
+    
+    def save(self, path, layers, active, version, tile_hash, autosave=False, changes=None):
+        """Write whole layers, given as [(name, visible, tile map)], to the files of the map
+        at path, replacing them and dropping their edit journals"""
+        def write():
+            for i, (name, _, tile_map) in enumerate(layers):
+                layer_path = layer_file_path(path, i, name)
+                write_map_file(layer_path, tile_map, tile_hash, COMPRESS_BINARY_MAPS)
+                remove_journal(layer_path)
+            write_layer_manifest(path, [(name, visible) for name, visible, _ in layers], active)
+            return 0
+        self.queue(write, path, version, autosave, changes)
+    
+    def append(self, path, layer_records, version, changes):
+        """Append journal records (the changes since the last save), given as
+        [(layer file, records)], to the edit journals of the map at path"""
+        def write():
+            return sum(append_journal(layer_path, records, MAP_DTYPE) for layer_path, records in layer_records)
+        self.queue(write, journal_path(path), version, True, changes, journal=True)
+    
+    def queue(self, write, path, version, autosave, changes, journal=False):
+        self.pending += 1
+        self.jobs.put((write, path, version, autosave, changes, journal))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.work, name="map-saver", daemon=True)
+            self.thread.start()
+    
+    def work(self):
+        while True:
+            write, path, version, autosave, changes, journal = self.jobs.get()
+            error = journal_bytes = None
+            try:
+                journal_bytes = write()
+            except Exception as e:
+                error = str(e)
+            pg.event.post(pg.event.Event(SAVE_FINISHED_EVENT, path=path, version=version, autosave=autosave,
+                                         changes=changes, journal=journal, journal_bytes=journal_bytes,
+                                         error=error))
+            self.jobs.task_done()
+    
+    def finished(self):
+        """Called by the main thread for each SAVE_FINISHED_EVENT"""
+        self.pending -= 1
+    
+    def wait(self):
+        """Block until every queued save has been written"""
+        self.jobs.join()
+
+
+class LoadCancelled(Exception):
+    """Raised inside a map reader to stop a cancelled load"""
+
+
+class MapLoader:
+    """Reads one map file on a background thread. The map is handed to the main thread
+    (in a LOAD_PROGRESS_EVENT) as soon as it exists, so it can be shown while rows
+    stream into it; a LOAD_FINISHED_EVENT reports the result."""
+    def __init__(self, path, success_message, error_prefix):
+        self.path = path
+        self.success_message = success_message
+        self.error_prefix = error_prefix
+        self.rows_shown = 0  # Rows the main thread has already refreshed on screen
+        self.cancelled = threading.Event()
+        self.last_report = 0
+        self.reported_map = None
+        self.thread = threading.Thread(target=self.work, name="map-loader", daemon=True)
+    
+    def start(self):
+        self.thread.start()
+    
+    def cancel(self):
+        self.cancelled.set()
+    
+    def wait(self):
+        self.thread.join()
+    
+    def progress(self, tile_map, rows, done, total):
+        if self.cancelled.is_set():
+            raise LoadCancelled()
+        # Throttle updates, except the one that first hands over the map
+        now = time.perf_counter()
+        if now - self.last_report < LOAD_PROGRESS_INTERVAL and tile_map is self.reported_map:
+            return
+        self.last_report = now
+        self.reported_map = tile_map
+        pg.event.post(pg.event.Event(LOAD_PROGRESS_EVENT, loader=self, tile_map=tile_map,
+                                     rows=rows, done=done, total=total))
+    
+    def work(self):
+        layers = warning = error = None
+        active = replayed = 0
+        try:
+            layers, active, warning, replayed = read_map_layers(self.path, self.progress)
+        except LoadCancelled:
+            pass
+        except Exception as e:
+            error = str(e)
+        tile_map = layers[0].tile_map if layers else None
+        pg.event.post(pg.event.Event(LOAD_FINISHED_EVENT, loader=self, tile_map=tile_map, layers=layers,
+                                     active=active, warning=warning, replayed=replayed, error=error,
+                                     cancelled=self.cancelled.is_set()))
+
+
+def read_map_file(path, progress=None):
+    """Read a map file, picking the format from its extension, and replay its edit
+    journal. Returns the map (None for an empty file), a warning message if something
+    looks off, and the number of journal records replayed."""
+    if is_binary_map_path(path):
+        # Uncompressed binary maps are memory-mapped rather than read up front
+        tile_map, header = read_binary_map(path, MAP_DTYPE, progress=progress)
+        warning = None
+        if header["tile_hash"] != tile_table_hash(TILE_TYPES):
+            warning = "Map was saved with a different tile table"
+        tile_map.resize(max(MIN_GRID_SIZE, tile_map.width), max(MIN_GRID_SIZE, tile_map.height))
+    else:
+        # Parse the file straight into the map (padded to the minimum map size);
+        # very large maps come back with sparse storage
+        tile_map, file_width, file_height = read_csv_map(path, MAP_DTYPE, MIN_GRID_SIZE, MIN_GRID_SIZE,
+                                                         progress=progress)
+        if file_height == 0:
+            return None, "Empty map file, using default size", 0
+        warning = None
+    
+    # Changes autosaved since the file was last written in full
+    tile_map, replayed, journal_warning = replay_journal(path, tile_map)
+    return tile_map, warning or journal_warning, replayed
+
+
+def read_map_layers(path, progress=None):
+    """Read a map file with all of its layers (listed in its layer manifest, if any).
+    Returns the layers (None for an empty file), the active layer's index, a warning
+    and the number of journal records replayed. Only the first layer streams in
+    through progress."""
+    manifest = read_layer_manifest(path)
+    tile_map, warning, replayed = read_map_file(path, progress)
+    if tile_map is None:
+        return None, 0, warning, 0
+    if manifest is None:
+        return [MapLayer(DEFAULT_LAYER_NAME, tile_map)], 0, warning, replayed
+    
+    entries, active = manifest
+    name, _, visible = entries[0]
+    layers = [MapLayer(name, tile_map, visible)]
+    for name, layer_path, visible in entries[1:]:
+        layer_map, layer_warning, layer_replayed = read_map_file(layer_path)
+        if layer_map is None:
+            layer_map = TileMap(tile_map.width, tile_map.height, MAP_DTYPE)
+        # All layers share the first one's size and storage
+        if tile_map.is_sparse and not layer_map.is_sparse:
+            layer_map = SparseTileMap.from_tile_map(layer_map)
+        if (layer_map.width, layer_map.height) != (tile_map.width, tile_map.height):
+            layer_map.resize(tile_map.width, tile_map.height)
+            layer_warning = f"Layer {name} had a different size"
+        layers.append(MapLayer(name, layer_map, visible))
+        warning = warning or layer_warning
+        replayed += layer_replayed
+    return layers, active, warning, replayed
+
+
+class TileEditor:
+    def __init__(self, always_redraw=ALWAYS_REDRAW, undo_bytes=UNDO_HISTORY_BYTES,
+                 autosave_interval=AUTOSAVE_INTERVAL, profile=PROFILE, startup_report=STARTUP_REPORT):
+        # Time the steps up to the first frame and the initial map load, if asked to
+        self.startup = None
+        if startup_report or os.environ.get(STARTUP_REPORT_ENV, "0") not in ("", "0"):
+            self.startup = StartupTimer(STARTUP_TIME, STARTUP_TARGET)
+            self.startup.mark("imports", IMPORTS_DONE_TIME)
+        
+        # Only the display is needed up front; fonts and tkinter start when first used
+        pg.display.init()
+        
+        # Only redraw (and push to the display) the parts of the window that changed
+        self.always_redraw = always_redraw
+        self.full_redraw = True
+        self.dirty_rects = []
+        self.last_tick = 0
+        
+        # The map is drawn into its own framebuffer, so scrolling can shift what it
+        # shows and only draw the strips that come into view
+        self.map_frame = None
+        self.map_frame_key = None  # (cell size, camera in pixels) of what the framebuffer shows
+        self.scrolling = False
+        
+        # Frame profiling is off (and costs nothing) unless asked for or turned on with F3
+        self.profile = profile
+        self.profiler = None
+        self.profiler_overlay = None  # (surface, position) of the overlay's last refresh
+        self.profiler_overlay_tick = 0
+        self.tiles_blitted = 0  # Running totals, for the profiler
+        self.chunks_blitted = 0
+        if profile:
+            self.profiler = FrameProfiler()
+            self.profiler.overlay_visible = True
+        
+        # Initialize map, with a single layer; editing works on the active layer
+        self.layers = [MapLayer(DEFAULT_LAYER_NAME, TileMap(GRID_WIDTH, GRID_HEIGHT, MAP_DTYPE))]
+        self.active_layer = 0
+        
+        # Undo/redo records only the changed cells of each action (and the layer they were on)
+        self.history = EditHistory(undo_bytes)
+        self.history.layer = self.current_layer
+        
+        # Saves run in the background on a snapshot of the map
+        self.map_saver = MapSaver()
+        self.autosave_interval = autosave_interval
         
         # Fixed window size
         self.window_width = WINDOW_WIDTH
         self.window_height = WINDOW_HEIGHT
         self.screen = pg.display.set_mode((self.window_width, self.window_height))
         pg.display.set_caption("Tile Editor")
+        if self.startup:
+            self.startup.mark("display init")
         
-        # Camera/viewport variables
-        self.camera_x = 0
-        self.camera_y = 0
+        # Camera/viewport variables; the camera is in (fractional) map cells
+        self.camera_x = 0.0
+        self.camera_y = 0.0
         self.zoom_level = 1.0
         self.viewport_width = self.window_width
         self.viewport_height = self.grid_height * TILE_SIZE * 2
         
         self.clock = pg.time.Clock()
         
+        # Fonts are created once and rendered text is cached
+        self.fonts = {}
+        self.text_cache = TextCache()
+        
+        # Pre-rendered help panel and palette, rebuilt when their inputs change
+        self.ui_layers = None
+        self.ui_layers_key = None
+        
+        # Palette slots (for the current name filter) and how far it is scrolled, in pixels
+        self.palette_layout = PaletteLayout(TILE_TYPES)
+        self.palette_scroll = 0
+        
         # Load tiles
-        self.tiles = {}
+        self.atlas = None
+        self.tile_colors_ready = False
+        self.map_chunks = MapChunkCache()
+        self.mip_pyramid = MipPyramid(LayerStack(self.layers), np.zeros((1, 3), dtype=np.uint8))
+        self.map_version = 0  # Bumped on every map change, keys the LOD frame and minimap
+        self.lod_frame = None
+        self.lod_frame_key = None
+        self.show_minimap = True
+        self.minimap_surface = None
+        self.minimap_key = None
         self.load_tiles()
+        if self.startup:
+            self.startup.mark("assets")
         
-        # Initialize map
-        self.map_data = [[0 for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
-        
-        # Current selected tile
+        # Current selected tile and painting tool ("brush", "rectangle", "fill", "select",
+        # "paste" or "pattern")
         self.current_tile = 1
+        self.tool = "brush"
+        self.stroke_tile = None
+        self.stroke_cell = None  # Last cell of the brush stroke being dragged
+        self.rect_start = None  # Corners of the rectangle being dragged
+        self.rect_end = None
+        
+        # Selected cells ([x0, x1) x [y0, y1), or None) and the copied block of tiles, which
+        # the paste tool stamps and the pattern tool paints with
+        self.selection = None
+        self.clipboard = None
+        self.paste_cell = None  # Cell under the pointer while pasting, for the preview
         
         # Status message
         self.status_message = "Welcome to Tile Editor"
         self.status_timer = 0
         
-        # Initialize tkinter for file dialogs but hide the main window
-        self.tk_root = tk.Tk()
-        self.tk_root.withdraw()  # Hide the main tkinter window
+        # tkinter is only set up for the first file dialog, so the editor also runs without a display
+        self.tk_root = None
+        
+        # Map versions last written by a save and by an autosave
+        self.saved_version = self.autosaved_version = self.map_version
+        
+        # Changes since the last save, for the edit journal: besides each layer's changed
+        # chunks, the map size at the last save and the smallest size since (a shrink
+        # clears cells), and whether layers were added
+        self.journal_base_size = self.journal_min_size = (self.grid_width, self.grid_height)
+        self.layers_changed = False
+        self.journal_bytes = 0
+        self.journal_broken = False  # A failed append may have left a damaged journal
         
-        # Try to load existing map
+        # Maps load in the background; the map (layers and path) open before is kept until it's done
+        self.loading = None
+        self.map_before_loading = None
+        # PNG exports run on their own thread, one at a time, and read the map as they go
+        self.exporting = False
+        
+        # Session recording (run(record=...)) and replay (see replay.py): the replay
+        # stands in for the event queue, the polled input state, dialogs and the clock
+        self.recorder = None
+        self.replay = None
+        
+        # Try to load existing map (in the background, so the first frame doesn't wait for it)
+        if self.startup:
+            self.startup.mark("editor setup")
+            self.startup.map_started()
         self.map_path = os.path.join("assets", "map.csv")
         self.try_load_map()
     
+    @property
+    def current_layer(self):
+        return self.layers[self.active_layer]
+    
+    @property
+    def map_data(self):
+        """The active layer's tiles, which all editing works on"""
+        return self.current_layer.tile_map
+    
+    @map_data.setter
+    def map_data(self, tile_map):
+        self.current_layer.tile_map = tile_map
+    
+    @property
+    def grid_width(self):
+        return self.map_data.width
+    
+    @property
+    def grid_height(self):
+        return self.map_data.height
+    
     def load_tiles(self):
-        # Load tile images
-        for tile_id, tile_name in TILE_TYPES.items():
-            if tile_id == 0:  # Skip empty tile
-                self.tiles[0] = None
-                continue
-                
-            try:
-                # Construct path to tile image
-                tile_path = os.path.join("assets", f"{tile_name}.png")
-                # Load image and scale it to TILE_SIZE
-                tile_img = pg.image.load(tile_path).convert_alpha()
-                tile_img = pg.transform.scale(tile_img, (TILE_SIZE, TILE_SIZE))
-                self.tiles[tile_id] = tile_img
-            except Exception:
-                # Create a placeholder colored square
-                tile_surface = pg.Surface((TILE_SIZE, TILE_SIZE))
-                tile_surface.fill(self.get_color_for_tile(tile_id))
-                self.tiles[tile_id] = tile_surface
+        # Any previously rendered surfaces belong to the old tile images
+        self.map_chunks.clear()
+        self.ui_layers = None
+        
+        # Tiles are packed into atlas pages, each decoded from assets/<name>.png on first use
+        self.atlas = TileAtlas(TILE_TYPES, "assets", TILE_SIZE, self.get_color_for_tile, TILE_CACHE_DIR)
+        
+        # Zoomed-out views show each tile as its average color, worked out when first needed
+        self.tile_colors_ready = False
+        self.map_version += 1
+    
+    def ensure_tile_colors(self):
+        """Give the mip pyramid the tile colors before anything is drawn from it"""
+        if not self.tile_colors_ready:
+            self.mip_pyramid.set_source(LayerStack(self.layers), self.compute_tile_colors())
+            self.tile_colors_ready = True
+            # Working out the colors may have decoded every tile; keep them for next time
+            self.save_tile_cache()
+    
+    def save_tile_cache(self):
+        try:
+            self.atlas.save_cache()
+        except OSError as e:
+            self.set_status(f"Could not write the tile cache: {e}")
+    
+    def compute_tile_colors(self):
+        """Build a color lookup table (indexed by tile ID) from the average color of each tile.
+        Empty and unknown tiles are black, like on the grid."""
+        return self.atlas.color_table(max(TILE_TYPES) + 2)
     
     def get_color_for_tile(self, tile_id):
-        # Generate a color based on tile_id for placeholder
-        colors = {
-            1: (0, 255, 0),    # Green for grass
-            2: (0, 0, 255),    # Blue for water
-            3: (139, 69, 19),  # Brown for dirt
-            4: (128, 128, 128)  # Gray for stone
-        }
-        return colors.get(tile_id, (255, 0, 255))  # Default to magenta
+        return placeholder_color(tile_id)
     
     def try_load_map(self):
-        try:
-            self.load_map()
-            self.set_status("Map loaded successfully")
-        except Exception as e:
-            self.set_status(f"Could not load map: {str(e)}")
-            # Create directory if it doesn't exist
-            os.makedirs(os.path.dirname(self.map_path), exist_ok=True)
+        # Create directory if it doesn't exist
+        os.makedirs(os.path.dirname(self.map_path) or ".", exist_ok=True)
+        self.start_loading(self.map_path, "Map loaded successfully", "Could not load map")
     
     def load_map(self):
-        with open(self.map_path, 'r', newline='') as file:
-            # First pass: determine map dimensions
-            reader = csv.reader(file)
-            rows = list(reader)  # Convert to list to read it twice
-            
-            if not rows:
-                self.set_status("Empty map file, using default size")
-                return
-                
-            # Determine map dimensions from the file
-            map_height = len(rows)
-            map_width = max(len(row) for row in rows)
-            
-            # Ensure minimum dimensions
-            map_width = max(MIN_GRID_SIZE, map_width)
-            map_height = max(MIN_GRID_SIZE, map_height)
-            
-            # Resize map if needed
-            if map_width != self.grid_width or map_height != self.grid_height:
-                self.resize_map(map_width, map_height)
-                self.set_status(f"Map size detected: {map_width}x{map_height}")
-            
-            # Second pass: load the data
-            for y, row in enumerate(rows):
-                if y >= self.grid_height:
-                    break
-                for x, cell in enumerate(row):
-                    if x >= self.grid_width:
-                        break
-                    try:
-                        self.map_data[y][x] = int(cell)
-                    except ValueError:
-                        self.map_data[y][x] = 0
-    
-    def save_map(self):
+        """Load the map at map_path right away, picking the format from its extension.
+        Returns a warning message if the map loaded but something looks off."""
+        layers, active, warning, _ = read_map_layers(self.map_path)
+        if layers is not None:
+            self.set_layers(layers, active)
+        return warning
+    
+    def start_loading(self, path, success_message, error_prefix):
+        """Load a map file in the background. The map is drawn as it streams in, but
+        can't be edited until loading completes; ESC cancels."""
+        if self.loading is not None:
+            return
+        self.history.commit()
+        self.map_before_loading = (self.layers, self.active_layer, self.map_path)
+        self.map_path = path
+        self.loading = MapLoader(path, success_message, error_prefix)
+        self.loading.start()
+        self.set_status(f"Loading {os.path.basename(path)}... (ESC to cancel)")
+    
+    def cancel_loading(self):
+        if self.loading is not None:
+            self.loading.cancel()
+            self.set_status("Cancelling...")
+    
+    def handle_load_progress(self, event):
+        """Show the loading map and redraw the rows that arrived since the last update"""
+        loader = self.loading
+        if event.loader is not loader or loader.cancelled.is_set():
+            return
+        if event.tile_map is not None:
+            if event.tile_map is not self.map_data or event.rows is None:
+                # A new map, or one whose chunks may have changed anywhere
+                self.show_map(event.tile_map)
+            elif event.rows > loader.rows_shown:
+                self.refresh_cells(0, loader.rows_shown, self.grid_width, event.rows)
+            loader.rows_shown = event.rows or 0
+        phase = "Scanning" if event.tile_map is None else "Loading"
+        percent = 100 * event.done // max(1, event.total)
+        self.set_status(f"{phase} {os.path.basename(loader.path)}... {percent}% (ESC to cancel)")
+    
+    def handle_load_finished(self, event):
+        loader = self.loading
+        if event.loader is not loader:
+            return
+        self.loading = None
+        if self.startup:
+            loaded = event.tile_map is not None and not event.cancelled
+            self.startup.map_finished("loaded" if loaded else "cancelled" if event.cancelled else "not loaded")
+            self.report_startup()
+        previous_layers, previous_active, previous_path = self.map_before_loading
+        self.map_before_loading = None
+        
+        if event.tile_map is not None and not event.cancelled:
+            if event.tile_map is self.map_data and len(event.layers) == 1 and not event.tile_map.is_sparse \
+                    and not event.replayed:
+                # Already on screen: only the rows since the last progress update need redrawing
+                self.refresh_cells(0, loader.rows_shown, self.grid_width, self.grid_height)
+                self.history.clear()
+                self.saved_version = self.autosaved_version = self.map_version
+                self.reset_journal()
+            else:
+                self.set_layers(event.layers, event.active)
+            self.set_status(event.warning or loader.success_message)
+            return
+        
+        # Go back to the map that was open before
+        if self.layers is not previous_layers:
+            self.show_layers(previous_layers, previous_active)
+        if event.cancelled:
+            self.map_path = previous_path
+            self.set_status("Loading cancelled")
+        elif event.error is not None:
+            self.set_status(f"{loader.error_prefix}: {event.error}")
+        else:
+            self.set_status(event.warning)
+    
+    def report_startup(self):
+        """Print the startup report once the first frame is up and the map has loaded"""
+        if self.startup and self.startup.done:
+            print(self.startup.report())
+            self.startup = None
+    
+    def wait_for_loading(self):
+        """Block until a background load finishes and apply its result"""
+        while self.loading is not None:
+            self.loading.wait()
+            for event in pg.event.get((LOAD_PROGRESS_EVENT, LOAD_FINISHED_EVENT)):
+                if event.type == LOAD_PROGRESS_EVENT:
+                    self.handle_load_progress(event)
+                else:
+                    self.handle_load_finished(event)
+    
+    def set_map(self, tile_map):
+        """Replace the whole map with a single-layer one"""
+        self.set_layers([MapLayer(DEFAULT_LAYER_NAME, tile_map)])
+    
+    def set_layers(self, layers, active=0):
+        """Replace the whole map, dropping everything rendered from the old one and the edit history"""
+        self.history.clear()
+        self.show_layers(layers, active)
+        self.saved_version = self.autosaved_version = self.map_version
+        self.reset_journal()
+    
+    def show_map(self, tile_map):
+        """Display a single-layer map (possibly one still loading) without touching the edit history"""
+        self.show_layers([MapLayer(DEFAULT_LAYER_NAME, tile_map)])
+    
+    def show_layers(self, layers, active=0):
+        self.layers = layers
+        self.active_layer = active
+        self.history.layer = self.current_layer
+        self.map_chunks.clear()
+        self.mip_pyramid.set_source(LayerStack(layers))
+        self.map_version += 1
+        self.mark_dirty()
+    
+    def save_map(self, path=None, autosave=False):
+        """Start saving the map to path (the map path by default) on the saver thread.
+        Autosaves only append the changes since the last save to the layers' edit journals,
+        until they grow past JOURNAL_COMPACT_BYTES; other saves write a snapshot of every
+        layer and drop the journals. Editing can continue meanwhile; the result is
+        shown when it's done."""
+        path = path or self.map_path
+        # Saves to another file (e.g. benchmarks) leave the map's journal alone
+        changes = self.take_journal_changes() if path == self.map_path else None
         try:
-            os.makedirs(os.path.dirname(self.map_path), exist_ok=True)
-            with open(self.map_path, 'w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerows(self.map_data)
-            self.set_status(f"Map saved to {self.map_path}")
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            if autosave and changes is not None and self.can_append_journal(changes):
+                self.map_saver.append(path, self.journal_records(changes), self.map_version, changes)
+                return
+            if os.name == 'nt':
+                # Windows can't replace a file that is still memory-mapped
+                for layer in self.layers:
+                    layer.tile_map.load_into_memory()
+            snapshots = [(layer.name, layer.visible, layer.tile_map.copy()) for layer in self.layers]
         except Exception as e:
+            self.restore_journal_changes(changes)
             self.set_status(f"Error saving map: {str(e)}")
+            return
+        self.map_saver.save(path, snapshots, self.active_layer, self.map_version, tile_table_hash(TILE_TYPES),
+                            autosave, changes)
+        if not autosave:
+            self.set_status(f"Saving map to {path}...")
+    
+    def finish_save(self, event):
+        """Report a save completed by the saver thread"""
+        self.map_saver.finished()
+        if event.error is not None:
+            self.restore_journal_changes(event.changes)
+            self.journal_broken = self.journal_broken or event.journal
+            self.set_status(f"Error {'autosaving' if event.autosave else 'saving'} map: {event.error}")
+            return
+        if event.changes is not None:
+            self.journal_bytes = event.journal_bytes
+            self.journal_broken = self.journal_broken and event.journal
+        if event.autosave:
+            self.autosaved_version = event.version
+            self.set_status(f"Autosaved to {event.path}")
+        else:
+            self.saved_version = event.version
+            self.set_status(f"Map saved to {event.path}")
+    
+    def autosave(self):
+        """Save unsaved changes to the map's edit journal, unless a save is still running"""
+        if self.map_version in (self.saved_version, self.autosaved_version) or self.map_saver.busy:
+            return
+        if self.loading is not None:
+            return
+        self.save_map(autosave=True)
+    
+    def reset_journal(self):
+        """Start tracking changes afresh for a map that was just loaded or created"""
+        for layer in self.layers:
+            layer.journal_chunks = set()
+        self.journal_base_size = self.journal_min_size = (self.grid_width, self.grid_height)
+        self.journal_bytes = sum(journal_size(path) for path in self.layer_paths())
+        self.journal_broken = False
+        self.layers_changed = False
+    
+    def layer_paths(self):
+        """The files the layers are saved in"""
+        return [layer_file_path(self.map_path, i, layer.name) for i, layer in enumerate(self.layers)]
+    
+    def journal_cells(self, layer, x0, y0, x1, y1):
+        """Note that cells of a layer in [x0, x1) x [y0, y1) changed since the last save"""
+        if x1 > x0 and y1 > y0:
+            layer.journal_chunks.update(itertools.product(range(x0 // CHUNK_SIZE, (x1 - 1) // CHUNK_SIZE + 1),
+                                                          range(y0 // CHUNK_SIZE, (y1 - 1) // CHUNK_SIZE + 1)))
+    
+    def take_journal_changes(self):
+        """Hand over the changes since the last save, and start tracking from now"""
+        changes = ([(layer, layer.journal_chunks) for layer in self.layers],
+                   self.journal_min_size, self.journal_base_size, self.layers_changed)
+        for layer in self.layers:
+            layer.journal_chunks = set()
+        self.journal_base_size = self.journal_min_size = (self.grid_width, self.grid_height)
+        self.layers_changed = False
+        return changes
+    
+    def restore_journal_changes(self, changes):
+        """Put back changes whose save failed, so the next save covers them again"""
+        if changes is None:
+            return
+        layer_chunks, min_size, base_size, layers_changed = changes
+        for layer, chunks in layer_chunks:
+            layer.journal_chunks |= chunks
+        self.journal_min_size = (min(min_size[0], self.journal_min_size[0]), min(min_size[1], self.journal_min_size[1]))
+        self.journal_base_size = base_size
+        self.layers_changed = self.layers_changed or layers_changed
+    
+    def can_append_journal(self, changes):
+        """Whether an autosave can append to the edit journals instead of writing the whole map"""
+        layer_chunks, _, _, layers_changed = changes
+        if self.journal_broken or layers_changed:
+            return False
+        if not all(os.path.isfile(path) and os.path.getsize(path) > 0 for path in self.layer_paths()):
+            return False
+        estimate = sum(len(chunks) for _, chunks in layer_chunks) * CHUNK_SIZE * CHUNK_SIZE * self.map_data.dtype.itemsize
+        return self.journal_bytes + estimate <= JOURNAL_COMPACT_BYTES
+    
+    def journal_records(self, changes):
+        """Turn changes into journal records holding the changed cells' current values,
+        as [(layer file, records)]. Replayed on the layers as of the last save, they
+        give the layers as they are now."""
+        layer_chunks, min_size, base_size, _ = changes
+        width, height = self.grid_width, self.grid_height
+        resizes = []
+        # Cells a shrink cut off are empty if the map grew back since
+        if min_size != base_size:
+            resizes.append(("resize", *min_size))
+        if (width, height) != min_size:
+            resizes.append(("resize", width, height))
+        
+        layer_records = []
+        for path, (layer, chunks) in zip(self.layer_paths(), layer_chunks):
+            # Runs of changed chunks along each chunk row become one block of cells
+            records = list(resizes)
+            runs = []
+            for cy, cx in sorted((cy, cx) for cx, cy in chunks):
+                if runs and runs[-1][0] == cy and runs[-1][2] == cx:
+                    runs[-1][2] = cx + 1
+                else:
+                    runs.append([cy, cx, cx + 1])
+            for cy, cx0, cx1 in runs:
+                x0, y0 = cx0 * CHUNK_SIZE, cy * CHUNK_SIZE
+                x1, y1 = min(cx1 * CHUNK_SIZE, width), min(y0 + CHUNK_SIZE, height)
+                if x0 < x1 and y0 < y1:
+                    records.append(("cells", x0, y0, np.array(layer.tile_map.region(x0, y0, x1, y1))))
+            layer_records.append((path, records))
+        return layer_records
     
     def set_status(self, message, duration=3000):
         self.status_message = message
         self.status_timer = duration
+        self.mark_dirty(self.status_bar_rect())
+    
+    def status_bar_rect(self):
+        return pg.Rect(0, self.window_height - 25, self.window_width, 25)
+    
+    def palette_rect(self):
+        palette_width = TILE_SIZE * 3
+        return pg.Rect(self.window_width - palette_width, 0, palette_width, self.window_height - 25)
+    
+    def mark_dirty(self, rect=None):
+        """Schedule part of the window (or all of it when rect is None) for redrawing"""
+        if rect is None:
+            self.full_redraw = True
+        elif not self.full_redraw:
+            self.dirty_rects.append(pg.Rect(rect))
+    
+    def select_tile(self, tile_id):
+        self.current_tile = tile_id
+        self.set_status(f"Selected tile: {TILE_TYPES[tile_id]}")
+        self.reveal_palette_tile(tile_id)
+        self.mark_dirty(self.palette_rect())
+    
+    def scroll_palette(self, dy):
+        """Scroll the palette by dy pixels, keeping its rows in view"""
+        view_height = self.palette_rect().height - PALETTE_TOP
+        max_scroll = max(0, self.palette_layout.content_height - view_height)
+        scroll = max(0, min(self.palette_scroll + dy, max_scroll))
+        if scroll != self.palette_scroll:
+            self.palette_scroll = scroll
+            self.mark_dirty(self.palette_rect())
     
-    def resize_map(self, new_width, new_height):
+    def reveal_palette_tile(self, tile_id):
+        """Scroll the palette just enough to show a tile, if it is listed"""
+        slot = self.palette_layout.slots.get(tile_id)
+        if slot is None:
+            return
+        top = slot // PALETTE_COLUMNS * PALETTE_ROW_HEIGHT
+        view_height = self.palette_rect().height - PALETTE_TOP
+        if top < self.palette_scroll:
+            self.scroll_palette(top - self.palette_scroll)
+        elif top + PALETTE_ROW_HEIGHT > self.palette_scroll + view_height:
+            self.scroll_palette(top + PALETTE_ROW_HEIGHT - view_height - self.palette_scroll)
+    
+    def filter_palette(self):
+        """List only the tiles whose names start with a prefix typed in a dialog"""
+        prefix = self.show_text_input_dialog("Show tiles starting with (empty for all):")
+        self.mark_dirty()  # The dialog drew over the whole window
+        if prefix is None:
+            return
+        self.palette_layout = PaletteLayout(TILE_TYPES, prefix.strip())
+        self.palette_scroll = 0
+        self.reveal_palette_tile(self.current_tile)
+        count = len(self.palette_layout.tile_ids)
+        self.set_status(f"{count} tiles starting with '{prefix.strip()}'" if prefix.strip() else "Showing all tiles")
+    
+    def resize_map(self, new_width, new_height, record=True):
         # Ensure dimensions are within limits
         new_width = max(MIN_GRID_SIZE, min(new_width, MAX_GRID_WIDTH))
         new_height = max(MIN_GRID_SIZE, min(new_height, MAX_GRID_HEIGHT))
@@ -182,18 +957,39 @@ class TileEditor:
         if new_width == self.grid_width and new_height == self.grid_height:
             return
         
-        # Create new map data with new dimensions
-        new_map_data = [[0 for _ in range(new_width)] for _ in range(new_height)]
+        # Keep whatever a shrink cuts off (on every layer) so the resize can be undone
+        old_width, old_height = self.grid_width, self.grid_height
+        if record:
+            lost = []
+            for layer in self.layers:
+                cells = capture_cells(layer.tile_map, new_width, 0, old_width, old_height)
+                cells += capture_cells(layer.tile_map, 0, new_height, min(old_width, new_width), old_height)
+                lost += [(layer, x0, y0, block) for x0, y0, block in cells]
+            self.history.record(ResizeEdit((old_width, old_height), (new_width, new_height), lost), "Resize")
+        
+        # Only chunks along the moved right/bottom edges need re-rendering
+        self.map_chunks.invalidate_cells(min(old_width, new_width) - 1, 0,
+                                         max(old_width, new_width), max(old_height, new_height))
+        self.map_chunks.invalidate_cells(0, min(old_height, new_height) - 1,
+                                         max(old_width, new_width), max(old_height, new_height))
+        
+        # Switch to sparse storage before a dense map would grow too big
+        if not self.map_data.is_sparse and new_width * new_height > SPARSE_MAP_CELLS:
+            for layer in self.layers:
+                layer.tile_map = SparseTileMap.from_tile_map(layer.tile_map)
+            self.mip_pyramid.set_source(LayerStack(self.layers))
         
-        # Copy existing data that fits in the new dimensions
-        for y in range(min(self.grid_height, new_height)):
-            for x in range(min(self.grid_width, new_width)):
-                new_map_data[y][x] = self.map_data[y][x]
+        # Resize every layer, copying existing data that fits in the new dimensions
+        for layer in self.layers:
+            layer.tile_map.resize(new_width, new_height)
+        self.journal_min_size = (min(self.journal_min_size[0], new_width), min(self.journal_min_size[1], new_height))
+        self.map_version += 1
+        self.mark_dirty()
         
-        # Update dimensions and map data
-        self.grid_width = new_width
-        self.grid_height = new_height
-        self.map_data = new_map_data
+        # Refresh the zoomed-out views along the moved edges
+        self.mip_pyramid.resize()
+        self.mip_pyramid.update_cells(min(old_width, new_width) - 1, 0, new_width, new_height)
+        self.mip_pyramid.update_cells(0, min(old_height, new_height) - 1, new_width, new_height)
         
         # Update status
         self.set_status(f"Map resized to {new_width}x{new_height}")
@@ -202,210 +998,897 @@ class TileEditor:
         self.window_width = TILE_SIZE * self.grid_width * 2
         self.window_height = TILE_SIZE * (self.grid_height + PALETTE_HEIGHT) * 2
     
+    def render_chunk(self, cx, cy, tile_size_zoomed):
+        """Render one CHUNK_SIZE x CHUNK_SIZE block of the map into an offscreen surface,
+        compositing the visible layers bottom to top"""
+        x0 = cx * CHUNK_SIZE
+        y0 = cy * CHUNK_SIZE
+        cols = min(CHUNK_SIZE, self.grid_width - x0)
+        rows = min(CHUNK_SIZE, self.grid_height - y0)
+        
+        surface = pg.Surface((cols * tile_size_zoomed, rows * tile_size_zoomed)).convert()
+        surface.fill(BLACK)
+        
+        # Draw tiles, collecting the atlas blits of all layers to do them in one batch
+        blits = []
+        empty = [[True] * cols for _ in range(rows)]
+        for layer in self.layers:
+            if not layer.visible:
+                continue
+            block = layer.tile_map.region(x0, y0, x0 + cols, y0 + rows).tolist()
+            for y, row in enumerate(block):
+                for x, tile_id in enumerate(row):
+                    if tile_id != 0 and tile_id in self.atlas:
+                        page, area = self.atlas.scaled(tile_id, tile_size_zoomed)
+                        blits.append((page, (x * tile_size_zoomed, y * tile_size_zoomed), area))
+                        empty[y][x] = False
+        
+        # Draw empty tiles: cells no visible layer has a tile in
+        for y, row in enumerate(empty):
+            for x, is_empty in enumerate(row):
+                if is_empty:
+                    pg.draw.rect(surface, LIGHT_GRAY, 
+                               (x * tile_size_zoomed, y * tile_size_zoomed, tile_size_zoomed, tile_size_zoomed), 1)
+        surface.blits(blits, doreturn=False)
+        
+        # Draw grid lines along the left/top edge of every cell
+        for x in range(cols):
+            pg.draw.line(surface, GRAY, (x * tile_size_zoomed, 0), 
+                        (x * tile_size_zoomed, rows * tile_size_zoomed))
+        for y in range(rows):
+            pg.draw.line(surface, GRAY, (0, y * tile_size_zoomed), 
+                        (cols * tile_size_zoomed, y * tile_size_zoomed))
+        
+        self.tiles_blitted += len(blits)
+        return surface
+    
+    def cell_screen_size(self):
+        """On-screen size of one map cell; fractional when drawing from the mip pyramid"""
+        size = TILE_SIZE * self.zoom_level
+        return size if size < LOD_TILE_SIZE else int(size)
+    
+    def camera_origin(self):
+        """Camera position in screen pixels, which the map is drawn relative to; whole
+        pixels unless the map is drawn from the mip pyramid"""
+        size = self.cell_screen_size()
+        if size < LOD_TILE_SIZE:
+            return self.camera_x * size, self.camera_y * size
+        return round(self.camera_x * size), round(self.camera_y * size)
+    
     def draw_grid(self):
+        """Draw the map (within the screen's clip area) into the map framebuffer, and
+        copy that to the screen"""
+        if self.map_frame is None or self.map_frame.get_size() != self.screen.get_size():
+            self.map_frame = pg.Surface(self.screen.get_size()).convert()
+            self.map_frame_key = None
+        clip = self.screen.get_clip()
+        self.map_frame.set_clip(clip)
+        self.render_map(self.map_frame)
+        self.map_frame.set_clip(None)
+        self.screen.blit(self.map_frame, clip, clip)
+    
+    def scroll_map_frame(self):
+        """Bring the map framebuffer up to the current camera by shifting what it
+        shows and drawing the strips that came into view. Returns the shift in
+        pixels, or None when the whole map has to be drawn instead."""
+        size = self.cell_screen_size()
+        origin = self.camera_origin()
+        key, self.map_frame_key = self.map_frame_key, (size, origin)
+        if key is None or key[0] != size or self.map_frame is None:
+            return None
+        dx, dy = key[1][0] - origin[0], key[1][1] - origin[1]
+        if (dx, dy) == (0, 0):
+            return (0, 0)
+        # Drawn from the mip pyramid, or moved further than the view: draw it all
+        frame_rect = self.map_frame.get_rect()
+        if size < LOD_TILE_SIZE or abs(dx) >= frame_rect.width or abs(dy) >= frame_rect.height:
+            return None
+        
+        self.map_frame.scroll(dx, dy)
+        strips = []
+        if dx:
+            strips.append(pg.Rect(frame_rect.width + dx if dx < 0 else 0, 0, abs(dx), frame_rect.height))
+        if dy:
+            strips.append(pg.Rect(0, frame_rect.height + dy if dy < 0 else 0, frame_rect.width, abs(dy)))
+        for strip in strips:
+            self.map_frame.set_clip(strip)
+            self.render_map(self.map_frame)
+        self.map_frame.set_clip(None)
+        return dx, dy
+    
+    def render_map(self, surface):
+        """Draw the visible map onto surface (within its clip area)"""
         # Draw background
-        self.screen.fill(BLACK)
-        
-        # Calculate the visible tiles based on zoom and camera position
-        tile_size_zoomed = int(TILE_SIZE * self.zoom_level)
-        visible_width = self.viewport_width // tile_size_zoomed + 1
-        visible_height = self.viewport_height // tile_size_zoomed + 1
-        
-        # Calculate the range of tiles to draw
-        start_x = self.camera_x
-        start_y = self.camera_y
-        end_x = min(start_x + visible_width, self.grid_width)
-        end_y = min(start_y + visible_height, self.grid_height)
-        
-        # Draw visible tiles
-        for y in range(start_y, end_y):
-            for x in range(start_x, end_x):
-                # Calculate screen position
-                screen_x = int((x - self.camera_x) * tile_size_zoomed)
-                screen_y = int((y - self.camera_y) * tile_size_zoomed)
-                
-                tile_id = self.map_data[y][x]
-                if tile_id != 0 and tile_id in self.tiles:
-                    # Scale the tile to the current zoom level
-                    scaled_tile = pg.transform.scale(
-                        self.tiles[tile_id], 
-                        (tile_size_zoomed, tile_size_zoomed)
-                    )
-                    self.screen.blit(scaled_tile, (screen_x, screen_y))
-                else:
-                    # Draw empty tile
-                    pg.draw.rect(self.screen, LIGHT_GRAY, 
-                               (screen_x, screen_y, tile_size_zoomed, tile_size_zoomed), 1)
-        
-        # Draw grid lines
-        for x in range(start_x, end_x + 1):
-            screen_x = int((x - self.camera_x) * tile_size_zoomed)
-            pg.draw.line(self.screen, GRAY, 
-                        (screen_x, 0), 
-                        (screen_x, min(self.viewport_height, (end_y - start_y) * tile_size_zoomed)))
-                        
-        for y in range(start_y, end_y + 1):
-            screen_y = int((y - self.camera_y) * tile_size_zoomed)
-            pg.draw.line(self.screen, GRAY, 
-                        (0, screen_y), 
-                        (min(self.viewport_width, (end_x - start_x) * tile_size_zoomed), screen_y))
+        surface.fill(BLACK)
+        
+        # Far zoomed out, draw average tile colors from the mip pyramid instead
+        tile_size_zoomed = self.cell_screen_size()
+        if tile_size_zoomed < LOD_TILE_SIZE:
+            self.draw_grid_lod(surface, tile_size_zoomed)
+            return
+        
+        # Calculate the range of tiles to draw from the camera position (in pixels)
+        # and the clip area
+        origin_x, origin_y = self.camera_origin()
+        clip = surface.get_clip().clip(0, 0, self.viewport_width, self.viewport_height)
+        if clip.width <= 0 or clip.height <= 0:
+            return
+        start_x = (origin_x + clip.left) // tile_size_zoomed
+        start_y = (origin_y + clip.top) // tile_size_zoomed
+        end_x = min((origin_x + clip.right - 1) // tile_size_zoomed + 1, self.grid_width)
+        end_y = min((origin_y + clip.bottom - 1) // tile_size_zoomed + 1, self.grid_height)
+        if end_x <= start_x or end_y <= start_y:
+            return
+        
+        # Blit the visible chunks, rendering only those that are missing or dirty
+        self.map_chunks.set_tile_size(tile_size_zoomed)
+        for cy in range(start_y // CHUNK_SIZE, (end_y - 1) // CHUNK_SIZE + 1):
+            for cx in range(start_x // CHUNK_SIZE, (end_x - 1) // CHUNK_SIZE + 1):
+                chunk = self.map_chunks.get(cx, cy)
+                if chunk is None:
+                    chunk = self.render_chunk(cx, cy, tile_size_zoomed)
+                    self.map_chunks.put(cx, cy, chunk)
+                screen_x = cx * CHUNK_SIZE * tile_size_zoomed - origin_x
+                screen_y = cy * CHUNK_SIZE * tile_size_zoomed - origin_y
+                surface.blit(chunk, (screen_x, screen_y))
+                self.chunks_blitted += 1
+        
+        # Close the grid along the right and bottom edges of the map
+        right_x = self.grid_width * tile_size_zoomed - origin_x
+        bottom_y = self.grid_height * tile_size_zoomed - origin_y
+        pg.draw.line(surface, GRAY, 
+                    (right_x, 0), 
+                    (right_x, min(self.viewport_height, bottom_y)))
+        pg.draw.line(surface, GRAY, 
+                    (0, bottom_y), 
+                    (min(self.viewport_width, right_x), bottom_y))
             
+    def draw_grid_lod(self, surface, tile_size):
+        """Draw the visible map from the coarsest mip level that still has at least
+        one pixel per screen pixel"""
+        self.ensure_tile_colors()
+        level = 0
+        while tile_size * (2 << level) <= 1 and level < self.mip_pyramid.level_count() - 1:
+            level += 1
+        scale = 1 << level
+        view_width = self.viewport_width
+        view_height = min(self.viewport_height, self.window_height)
+        
+        key = (self.map_version, level, tile_size, self.camera_x, self.camera_y, view_width, view_height)
+        if key != self.lod_frame_key:
+            self.lod_frame_key = key
+            self.lod_frame = None
+            px0, py0 = int(self.camera_x // scale), int(self.camera_y // scale)
+            px1 = int((self.camera_x + view_width / tile_size) // scale) + 1
+            py1 = int((self.camera_y + view_height / tile_size) // scale) + 1
+            pixels = self.mip_pyramid.pixels(level, px0, py0, px1, py1)
+            if pixels.size:
+                pixel_size = tile_size * scale
+                image = pg.surfarray.make_surface(pixels.swapaxes(0, 1))
+                size = (max(1, round(pixels.shape[1] * pixel_size)), max(1, round(pixels.shape[0] * pixel_size)))
+                position = (round((px0 * scale - self.camera_x) * tile_size),
+                            round((py0 * scale - self.camera_y) * tile_size))
+                self.lod_frame = (pg.transform.scale(image, size), position)
+        
+        if self.lod_frame is not None:
+            surface.blit(*self.lod_frame)
+    
+    def minimap_scale(self):
+        """Minimap pixels per map cell"""
+        return MINIMAP_SIZE / max(self.grid_width, self.grid_height)
+    
+    def minimap_rect(self):
+        scale = self.minimap_scale()
+        width = max(1, round(self.grid_width * scale))
+        height = max(1, round(self.grid_height * scale))
+        palette_x = self.window_width - TILE_SIZE * 3
+        return pg.Rect(palette_x - width - 10, 10, width, height)
+    
+    def draw_minimap(self):
+        """Draw the whole map in a corner overlay, with the visible area outlined"""
+        if not self.show_minimap:
+            return
+        self.ensure_tile_colors()
+        rect = self.minimap_rect()
+        
+        key = (self.map_version, rect.size)
+        if key != self.minimap_key:
+            # Coarsest mip level that still has at least MINIMAP_SIZE pixels across
+            level = 0
+            while level < self.mip_pyramid.level_count() - 1 and \
+                    max(self.mip_pyramid.level_size(level + 1)) >= MINIMAP_SIZE:
+                level += 1
+            width, height = self.mip_pyramid.level_size(level)
+            pixels = self.mip_pyramid.pixels(level, 0, 0, width, height)
+            surface = pg.surfarray.make_surface(pixels.swapaxes(0, 1))
+            self.minimap_surface = pg.transform.smoothscale(surface.convert(), rect.size)
+            self.minimap_key = key
+        
+        self.screen.blit(self.minimap_surface, rect)
+        pg.draw.rect(self.screen, WHITE, rect.inflate(2, 2), 1)
+        
+        # Outline the part of the map that is on screen
+        scale = self.minimap_scale()
+        cell_size = TILE_SIZE * self.zoom_level
+        view = pg.Rect(rect.x + int(self.camera_x * scale), rect.y + int(self.camera_y * scale),
+                       max(2, int(self.viewport_width / cell_size * scale)),
+                       max(2, int(min(self.viewport_height, self.window_height) / cell_size * scale)))
+        pg.draw.rect(self.screen, RED, view.clip(rect), 1)
+    
+    def jump_camera_to(self, cell_x, cell_y):
+        """Center the view on a map cell"""
+        cell_size = TILE_SIZE * self.zoom_level
+        self.camera_x = int(cell_x - self.viewport_width / cell_size / 2)
+        self.camera_y = int(cell_y - min(self.viewport_height, self.window_height) / cell_size / 2)
+        self.camera_x = max(0, min(self.camera_x, max(0, self.grid_width - 1)))
+        self.camera_y = max(0, min(self.camera_y, max(0, self.grid_height - 1)))
+        self.mark_dirty()
+        self.show_camera_status()
+    
+    def show_camera_status(self):
+        self.set_status(f"Camera: ({int(self.camera_x)}, {int(self.camera_y)}) Zoom: {self.zoom_text()}x", 1000)
+    
+    def get_font(self, size, bold=False):
+        """Return the default font at the given size, creating it on first use"""
+        font = self.fonts.get((size, bold))
+        if font is None:
+            if not pg.font.get_init():
+                pg.font.init()
+            # The default font, without SysFont's scan of the system's fonts
+            font = pg.font.Font(None, size)
+            font.set_bold(bold)
+            self.fonts[(size, bold)] = font
+        return font
+    
+    def render_text(self, text, size, color, bold=False):
+        return self.text_cache.render(self.get_font(size, bold), text, color)
+    
     def draw_ui(self):
+        # Draw the rectangle being dragged
+        if self.rect_start is not None:
+            x0, y0, x1, y1 = self.rect_bounds()
+            tile_size_zoomed = self.cell_screen_size()
+            origin_x, origin_y = self.camera_origin()
+            pg.draw.rect(self.screen, RED, (int(x0 * tile_size_zoomed - origin_x),
+                                            int(y0 * tile_size_zoomed - origin_y),
+                                            int((x1 - x0) * tile_size_zoomed) + 1,
+                                            int((y1 - y0) * tile_size_zoomed) + 1), 2)
+        
+        # Outline the selection, and the block being pasted
+        for bounds, color in ((self.selection, YELLOW), (self.paste_bounds(), WHITE)):
+            if bounds is not None:
+                x0, y0, x1, y1 = bounds
+                tile_size_zoomed = self.cell_screen_size()
+                origin_x, origin_y = self.camera_origin()
+                pg.draw.rect(self.screen, color, (int(x0 * tile_size_zoomed - origin_x),
+                                                  int(y0 * tile_size_zoomed - origin_y),
+                                                  int((x1 - x0) * tile_size_zoomed) + 1,
+                                                  int((y1 - y0) * tile_size_zoomed) + 1), 2)
+        
         # Draw status bar
         status_y = self.window_height - 25
         pg.draw.rect(self.screen, BLACK, (0, status_y, self.window_width, 25))
         
         # Draw status message
         if self.status_timer > 0:
-            font = pg.font.SysFont(None, 20)
-            text = font.render(self.status_message, True, WHITE)
+            text = self.render_text(self.status_message, 20, WHITE)
             self.screen.blit(text, (10, status_y + 5))
         
+        # List the layers at the right of the status bar: the active one in brackets,
+        # hidden ones in parentheses
+        if len(self.layers) > 1:
+            names = []
+            for i, layer in enumerate(self.layers):
+                name = layer.name if layer.visible else f"({layer.name})"
+                names.append(f"[{name}]" if i == self.active_layer else name)
+            text = self.render_text("Layers: " + " ".join(names), 20, WHITE)
+            self.screen.blit(text, (self.window_width - text.get_width() - 10, status_y + 5))
+        
         # Draw map dimensions
         dimensions_text = f"Map Size: {self.grid_width}x{self.grid_height}"
-        font = pg.font.SysFont(None, 20)
-        dim_text = font.render(dimensions_text, True, WHITE)
+        dim_text = self.render_text(dimensions_text, 20, WHITE)
         self.screen.blit(dim_text, (10, status_y - 25))
         
         # Draw help panel
-        help_panel_height = 100  # Height of help panel
+        help_panel, help_y = self.get_ui_layers()[0]
+        self.screen.blit(help_panel, (0, help_y))
+        
+        # Draw palette on the right side
+        self.draw_palette()
+        
+        # Draw minimap overlay
+        self.draw_minimap()
+        
+        # Draw the profiler overlay as of its last refresh
+        if self.profiler is not None and self.profiler_overlay is not None:
+            self.screen.blit(*self.profiler_overlay)
+    
+    def frame_counters(self):
+        """Running totals of drawing work, which the profiler turns into per-frame counts"""
+        return {
+            "tiles_blitted": self.tiles_blitted,
+            "chunks_blitted": self.chunks_blitted,
+            "chunk_hits": self.map_chunks.hits,
+            "chunk_misses": self.map_chunks.renders,
+            "tile_cache_hits": self.atlas.hits,
+            "tile_cache_misses": self.atlas.misses,
+        }
+    
+    def refresh_profiler_overlay(self):
+        """Re-render the profiler overlay from the latest stats and schedule it for drawing"""
+        if self.profiler_overlay is not None:
+            self.mark_dirty(self.profiler_overlay[0].get_rect(topleft=self.profiler_overlay[1]))
+        if self.profiler is None or not self.profiler.overlay_visible:
+            self.profiler_overlay = None
+            return
+        font = self.get_font(18)
+        lines = [font.render(line, True, WHITE) for line in self.profiler.overlay_lines()]
+        line_height = font.get_linesize()
+        surface = pg.Surface((max(line.get_width() for line in lines) + 12, len(lines) * line_height + 8))
+        surface.set_alpha(210)
+        for i, line in enumerate(lines):
+            surface.blit(line, (6, 4 + i * line_height))
+        self.profiler_overlay = (surface, (10, 10))
+        self.profiler_overlay_tick = pg.time.get_ticks()
+        self.mark_dirty(surface.get_rect(topleft=(10, 10)))
+    
+    def toggle_profiler(self):
+        """Show or hide the profiler overlay. Profiling starts with it, and stops
+        when it's hidden unless the editor was started with profiling on."""
+        if self.profiler is not None and self.profiler.overlay_visible:
+            self.profiler.overlay_visible = False
+            if not self.profile:
+                self.profiler = None
+            self.refresh_profiler_overlay()
+            return
+        if self.profiler is None:
+            self.profiler = FrameProfiler()
+        self.profiler.overlay_visible = True
+        self.refresh_profiler_overlay()
+        self.set_status("Profiler on: F3 = hide, F4 = dump trace")
+    
+    def dump_profile_trace(self):
+        if self.profiler is None:
+            self.set_status("The profiler is off (F3 turns it on)")
+            return
+        path = time.strftime("profile-%Y%m%d-%H%M%S.json")
+        try:
+            frames = self.profiler.dump_trace(path)
+            self.set_status(f"Wrote a trace of {frames} frames to {path}")
+        except OSError as e:
+            self.set_status(f"Error writing trace: {e}")
+    
+    def get_ui_layers(self):
+        """Return the cached ((help panel, y), (palette, x)) layers, rebuilding
+        them if the selection, palette scroll or filter, or window size changed"""
+        key = (self.current_tile, self.palette_scroll, self.palette_layout, self.window_width, self.window_height)
+        if self.ui_layers is None or key != self.ui_layers_key:
+            self.ui_layers = (self.render_help_panel(), self.render_palette())
+            self.ui_layers_key = key
+        return self.ui_layers
+    
+    def render_help_panel(self):
+        """Render the controls help panel into a surface, returned with its y position"""
+        status_y = self.window_height - 25
+        help_panel_height = 160  # Height of help panel
         help_y = status_y - help_panel_height
+        panel = pg.Surface((self.window_width, help_panel_height)).convert()
         
         # Draw panel background
-        pg.draw.rect(self.screen, DARK_GRAY, (0, help_y, self.window_width, help_panel_height))
-        pg.draw.rect(self.screen, WHITE, (0, help_y, self.window_width, help_panel_height), 1)  # Border
+        pg.draw.rect(panel, DARK_GRAY, (0, 0, self.window_width, help_panel_height))
+        pg.draw.rect(panel, WHITE, (0, 0, self.window_width, help_panel_height), 1)  # Border
         
         # Draw help title
-        title_font = pg.font.SysFont(None, 24, bold=True)
-        title = title_font.render("CONTROLS:", True, WHITE)
-        self.screen.blit(title, (10, help_y + 5))
+        title = self.render_text("CONTROLS:", 24, WHITE, bold=True)
+        panel.blit(title, (10, 5))
         
         # Draw help text in multiple lines with larger font
-        help_font = pg.font.SysFont(None, 22)
         help_lines = [
-            "Mouse: Left click = place tile | Right click = remove tile | Wheel = zoom",
-            "Map: CTRL+Arrows = resize map | Arrows = scroll map | +/- = zoom in/out",
-            "Files: S = save map | L = load map | CTRL+O = open map | CTRL+N = new map | ESC = quit"
+            "Mouse: Left click/drag = place tiles | Right click/drag = remove tiles | Wheel = zoom (scroll on palette) | "
+            "PageUp/PageDown = scroll palette | / = filter tiles",
+            "Edit: B = brush | R = rectangle | F = flood fill | CTRL+Z = undo | CTRL+Y = redo | [ ] = layer | "
+            "V = show/hide layer | N = new layer",
+            "Select: E = select tool | CTRL+C/X/V = copy/cut/paste | DEL = clear selection | P = pattern brush | "
+            "K = save stamp | J = use stamp",
+            "Map: CTRL+Arrows = resize map | Arrows = scroll map | +/- = zoom in/out | M = minimap",
+            "Files: S = save | CTRL+S = save as | L = load | CTRL+O = open | CTRL+N = new map | CTRL+E = export PNG | "
+            "ESC = quit (or cancel loading)",
+            "Profiling: F3 = profiler overlay | F4 = dump trace"
         ]
         
-        line_y = help_y + 25
+        line_y = 25
         for line in help_lines:
-            help_text = help_font.render(line, True, WHITE)
-            self.screen.blit(help_text, (20, line_y))
+            help_text = self.render_text(line, 22, WHITE)
+            panel.blit(help_text, (20, line_y))
             line_y += 20
         
-        # Draw palette on the right side
-        self.draw_palette()
+        return panel, help_y
     
     def draw_palette(self):
-        """Draw the tile palette on the right side of the screen in a grid layout"""
+        """Draw the tile palette on the right side of the screen"""
+        palette, palette_x = self.get_ui_layers()[1]
+        self.screen.blit(palette, (palette_x, 0))
+    
+    def render_palette(self):
+        """Render the tile palette into a surface in a grid layout, returned with its x position"""
         # Palette area dimensions
         palette_width = TILE_SIZE * 3  # Width for tiles and labels
         palette_x = self.window_width - palette_width
         palette_height = self.window_height - 25  # Leave space for status bar
         
+        # One extra row for the end of the border line; it is otherwise transparent
+        palette = pg.Surface((palette_width, palette_height + 1)).convert()
+        palette.fill(UI_COLORKEY)
+        palette.set_colorkey(UI_COLORKEY)
+        
         # Draw palette background
-        pg.draw.rect(self.screen, LIGHT_GRAY, (palette_x, 0, palette_width, palette_height))
-        pg.draw.line(self.screen, WHITE, (palette_x, 0), (palette_x, palette_height), 2)
+        pg.draw.rect(palette, LIGHT_GRAY, (0, 0, palette_width, palette_height))
+        pg.draw.line(palette, WHITE, (0, 0), (0, palette_height), 2)
         
         # Draw palette title
-        title_font = pg.font.SysFont(None, 24, bold=True)
-        title = title_font.render("TILES", True, BLACK)
+        title = self.render_text("TILES", 24, BLACK, bold=True)
         title_width = title.get_width()
-        self.screen.blit(title, (palette_x + (palette_width - title_width) // 2, 10))
+        palette.blit(title, ((palette_width - title_width) // 2, 10))
         
-        # Calculate grid layout - 2 columns
-        tiles_per_row = 2
-        row_height = TILE_SIZE + 25  # Tile height + space for label
-        tile_spacing = 1  # 1px gap between tiles
+        # Show the name filter under the title
+        layout = self.palette_layout
+        if layout.prefix:
+            text = self.render_text(f"{layout.prefix}*", 18, BLACK)
+            palette.blit(text, ((palette_width - text.get_width()) // 2, 27))
         
-        # Start position for the first tile
-        start_y = 40  # Below the title
+        # Only the tiles in the visible rows are drawn (and decoded); rows scrolled
+        # partly out of view are clipped below the title
+        palette.set_clip(pg.Rect(0, PALETTE_TOP, palette_width, palette_height + 1 - PALETTE_TOP))
+        for slot in layout.visible_slots(self.palette_scroll, palette_height):
+            tile_id = layout.tile_ids[slot]
+            x, y = layout.slot_position(slot, self.palette_scroll)
+            
+            # Draw tile
+            page, area = self.atlas.tile(tile_id)
+            palette.blit(page, (x, y), area)
+            
+            # Draw selection indicator
+            if tile_id == self.current_tile:
+                pg.draw.rect(palette, RED, (x, y, TILE_SIZE, TILE_SIZE), 2)
+            
+            # Draw tile name below the tile
+            text = self.render_text(f"{tile_id}: {TILE_TYPES[tile_id]}", 18, BLACK)
+            text_width = text.get_width()
+            # Center text under the tile
+            palette.blit(text, (x + (TILE_SIZE - text_width) // 2, y + TILE_SIZE + 5))
+        palette.set_clip(None)
         
-        # Organize tiles in a grid
-        row, col = 0, 0
-        for tile_id, tile_name in TILE_TYPES.items():
-            if tile_id == 0:  # Skip empty tile
-                continue
-                
-            if tile_id in self.tiles and self.tiles[tile_id] is not None:
-                # Calculate position in the grid
-                x = palette_x + col * (TILE_SIZE + tile_spacing) + 10
-                y = start_y + row * row_height
-                
-                # Draw tile
-                self.screen.blit(self.tiles[tile_id], (x, y))
-                
-                # Draw selection indicator
-                if tile_id == self.current_tile:
-                    pg.draw.rect(self.screen, RED, (x, y, TILE_SIZE, TILE_SIZE), 2)
-                
-                # Draw tile name below the tile
-                font = pg.font.SysFont(None, 18)
-                text = font.render(f"{tile_id}: {tile_name}", True, BLACK)
-                text_width = text.get_width()
-                # Center text under the tile
-                self.screen.blit(text, (x + (TILE_SIZE - text_width) // 2, y + TILE_SIZE + 5))
-                
-                # Update grid position for next tile
-                col += 1
-                if col >= tiles_per_row:
-                    col = 0
-                    row += 1
+        # Scroll bar, when the tiles don't all fit
+        view_height = palette_height - PALETTE_TOP
+        if layout.content_height > view_height:
+            bar_height = max(10, view_height * view_height // layout.content_height)
+            bar_y = PALETTE_TOP + (view_height - bar_height) * self.palette_scroll // (layout.content_height - view_height)
+            pg.draw.rect(palette, GRAY, (palette_width - 5, bar_y, 4, bar_height))
+        
+        return palette, palette_x
     
     def handle_mouse_click(self, pos, button):
         x, y = pos
         
+        # Clicking the minimap moves the view there
+        if self.show_minimap and self.minimap_rect().collidepoint(pos):
+            if button == 1:
+                rect = self.minimap_rect()
+                scale = self.minimap_scale()
+                self.jump_camera_to((x - rect.x) / scale, (y - rect.y) / scale)
+            return
+        
         # Check if click is in the palette area (right side)
         palette_width = TILE_SIZE * 3
         palette_x = self.window_width - palette_width
         
         if x >= palette_x:
-            # Click is in the palette area
-            # Calculate grid position
-            tiles_per_row = 2
-            row_height = TILE_SIZE + 25
-            tile_spacing = 1
-            start_y = 40
-            
-            # Adjust x and y relative to palette start
-            rel_x = x - palette_x - 10
-            rel_y = y - start_y
-            
-            # Calculate grid cell
-            col = rel_x // (TILE_SIZE + tile_spacing)
-            row = rel_y // row_height
-            
-            # Validate click is on a tile
-            if 0 <= col < tiles_per_row and 0 <= rel_y % row_height < TILE_SIZE:
-                # Calculate tile ID from position
-                index = row * tiles_per_row + col
-                # Skip the empty tile (0)
-                tile_id = index + 1
-                
-                if tile_id in TILE_TYPES:
-                    self.current_tile = tile_id
-                    self.set_status(f"Selected tile: {TILE_TYPES[tile_id]}")
-            
+            # Click is in the palette area: the layout maps it straight to a tile slot
+            if y < self.palette_rect().bottom:
+                tile_id = self.palette_layout.tile_at(x - palette_x, y, self.palette_scroll)
+                if tile_id is not None:
+                    self.select_tile(tile_id)
             return
             
         # Check if click is in the map area
-        if y < self.viewport_height:
-            # Convert screen coordinates to grid coordinates considering zoom and camera
-            tile_size_zoomed = int(TILE_SIZE * self.zoom_level)
-            grid_x = int(x / tile_size_zoomed) + self.camera_x
-            grid_y = int(y / tile_size_zoomed) + self.camera_y
+        if y < self.viewport_height and button in (1, 3):
+            grid_x, grid_y = self.screen_to_cell(pos)
+            if not (0 <= grid_x < self.grid_width and 0 <= grid_y < self.grid_height):
+                return
+            if self.editing_blocked():
+                return
             
-            if 0 <= grid_x < self.grid_width and 0 <= grid_y < self.grid_height:
-                if button == 1:  # Left click
-                    self.map_data[grid_y][grid_x] = self.current_tile
-                elif button == 3:  # Right click
-                    self.map_data[grid_y][grid_x] = 0  # Clear tile
+            tile_id = self.current_tile if button == 1 else 0  # Right click clears
+            if self.tool == "select":
+                # Drag to select; right click drops the selection
+                if button == 1:
+                    self.rect_start = self.rect_end = (grid_x, grid_y)
+                    self.mark_cells_dirty(grid_x, grid_y, grid_x + 1, grid_y + 1)
+                else:
+                    self.set_selection(None)
+            elif self.tool == "paste":
+                # Click to stamp the clipboard; right click stops pasting
+                if button == 1:
+                    self.paste_clipboard(grid_x, grid_y)
+                else:
+                    self.set_tool("select")
+            elif self.tool == "fill":
+                self.flood_fill(grid_x, grid_y, tile_id)
+            elif self.tool == "rectangle":
+                self.stroke_tile = tile_id
+                self.rect_start = self.rect_end = (grid_x, grid_y)
+                self.mark_cells_dirty(grid_x, grid_y, grid_x + 1, grid_y + 1)
+            else:
+                # Everything painted until the button is released is undone together
+                self.history.begin("Paint" if button == 1 else "Erase")
+                self.stroke_tile = tile_id
+                self.stroke_cell = (grid_x, grid_y)
+                self.paint_stroke(np.array([grid_x]), np.array([grid_y]))
+    
+    def screen_to_cell(self, pos):
+        """Convert screen coordinates to grid coordinates considering zoom and camera"""
+        tile_size_zoomed = self.cell_screen_size()
+        origin_x, origin_y = self.camera_origin()
+        return int((pos[0] + origin_x) // tile_size_zoomed), int((pos[1] + origin_y) // tile_size_zoomed)
+    
+    def handle_mouse_drag(self, positions):
+        """Continue the current stroke or rectangle through the pointer positions seen
+        this frame. Consecutive samples are joined with lines so fast drags leave no gaps."""
+        cells = [self.screen_to_cell(pos) for pos in positions]
+        if self.rect_start is not None:
+            x = max(0, min(cells[-1][0], self.grid_width - 1))
+            y = max(0, min(cells[-1][1], self.grid_height - 1))
+            if (x, y) != self.rect_end:
+                self.mark_cells_dirty(*self.rect_bounds())
+                self.rect_end = (x, y)
+                self.mark_cells_dirty(*self.rect_bounds())
+        elif self.stroke_cell is not None:
+            points = [self.stroke_cell]
+            for cell in cells:
+                if cell != points[-1]:
+                    points.append(cell)
+            if len(points) > 1:
+                self.paint_stroke(*polyline_cells(points))
+                self.stroke_cell = points[-1]
+    
+    def end_mouse_drag(self):
+        """Finish the stroke or rectangle when the mouse button is released"""
+        if self.rect_start is not None:
+            self.mark_cells_dirty(*self.rect_bounds())
+            if self.tool == "select":
+                self.set_selection(self.rect_bounds())
+            else:
+                self.fill_rect(*self.rect_bounds(), self.stroke_tile)
+            self.rect_start = self.rect_end = None
+        self.stroke_cell = None
+        self.history.commit()
+    
+    def paste_bounds(self):
+        """Cells the clipboard would be pasted on, while pasting"""
+        if self.tool != "paste" or self.paste_cell is None:
+            return None
+        (x, y), (height, width) = self.paste_cell, self.clipboard.shape
+        return x, y, x + width, y + height
+    
+    def rect_bounds(self):
+        """Cell rectangle [x0, x1) x [y0, y1) spanned by the dragged corners"""
+        (ax, ay), (bx, by) = self.rect_start, self.rect_end
+        return min(ax, bx), min(ay, by), max(ax, bx) + 1, max(ay, by) + 1
+    
+    def set_tool(self, tool):
+        if self.tool == "paste":
+            self.move_paste_preview(None)
+        self.tool = tool
+        self.set_status(f"Tool: {tool}")
+    
+    def paint_stroke(self, xs, ys):
+        """Paint the cells of a brush stroke with the stroke's tile, or with the
+        clipboard's pattern when using the pattern tool"""
+        if self.tool == "pattern" and self.stroke_tile != 0:
+            self.paint_cells(xs, ys, pattern_tiles(self.clipboard, xs, ys))
+        elif len(xs) == 1:
+            if 0 <= xs[0] < self.grid_width and 0 <= ys[0] < self.grid_height:
+                self.paint_cell(int(xs[0]), int(ys[0]), self.stroke_tile)
+        else:
+            self.paint_cells(xs, ys, self.stroke_tile)
+    
+    def paint_cell(self, x, y, tile_id):
+        """Set one map cell and invalidate everything that shows it"""
+        old_id = self.map_data.get(x, y)
+        if old_id == tile_id:
+            return
+        self.history.record_cell(x, y, old_id, tile_id)
+        self.map_data.set(x, y, tile_id)
+        self.current_layer.journal_chunks.add((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        self.map_chunks.invalidate_cell(x, y)
+        self.mip_pyramid.update_cells(x, y, x + 1, y + 1)
+        self.map_version += 1
+        self.mark_cells_dirty(x, y, x + 1, y + 1)
+    
+    def paint_cells(self, xs, ys, tile_ids):
+        """Set many cells (coordinate arrays) to one tile, or to an array of tiles,
+        as a single map update"""
+        inside = (xs >= 0) & (ys >= 0) & (xs < self.grid_width) & (ys < self.grid_height)
+        new = np.broadcast_to(np.asarray(tile_ids, dtype=self.map_data.dtype), xs.shape)[inside]
+        xs, ys = xs[inside], ys[inside]
+        old = self.map_data.get_cells(xs, ys)
+        changed = old != new
+        if not changed.any():
+            return
+        xs, ys, old, new = xs[changed], ys[changed], old[changed], new[changed]
+        self.history.record_cells(xs, ys, old, new)
+        self.write_cells(xs, ys, new)
+    
+    def fill_rect(self, x0, y0, x1, y1, tile_id):
+        """Set every cell in [x0, x1) x [y0, y1) to one tile"""
+        x0, y0 = max(0, x0), max(0, y0)
+        x1, y1 = min(x1, self.grid_width), min(y1, self.grid_height)
+        old = self.map_data.region(x0, y0, x1, y1)
+        if old.size == 0 or (old == tile_id).all():
+            return
+        new = np.full(old.shape, tile_id, dtype=self.map_data.dtype)
+        self.history.record(RegionEdit(x0, y0, old.copy(), new), "Rectangle")
+        self.write_region(x0, y0, new)
+        self.set_status(f"Filled {x1 - x0}x{y1 - y0} rectangle")
+    
+    def flood_fill(self, x, y, tile_id):
+        """Replace the connected area of same tiles around (x, y) with another tile"""
+        old_id = self.map_data.get(x, y)
+        if old_id == tile_id:
+            return
+        x0, y0, mask = flood_fill_mask(self.map_data, x, y)
+        self.history.record(MaskEdit(x0, y0, mask, old_id, tile_id), "Fill")
+        self.write_mask(x0, y0, mask, tile_id)
+        self.set_status(f"Filled {int(mask.sum())} cells")
+    
+    def write_cells(self, xs, ys, tile_ids):
+        """Set scattered cells (coordinate arrays) without recording them, e.g. for undo"""
+        if len(xs) == 0:
+            return
+        self.map_data.set_cells(xs, ys, np.asarray(tile_ids, dtype=self.map_data.dtype))
+        chunks = set(zip((xs // CHUNK_SIZE).tolist(), (ys // CHUNK_SIZE).tolist()))
+        for cx, cy in chunks:
+            self.map_chunks.discard(cx, cy)
+        self.current_layer.journal_chunks |= chunks
+        self.mip_pyramid.update_cell_list(xs, ys)
+        self.map_version += 1
+        self.mark_cells_dirty(int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1)
+    
+    def write_mask(self, x0, y0, mask, tile_id):
+        """Set the cells under a boolean mask to one tile without recording it"""
+        block = self.map_data.region(x0, y0, x0 + mask.shape[1], y0 + mask.shape[0]).copy()
+        block[mask] = tile_id
+        self.write_region(x0, y0, block)
+    
+    def write_region(self, x0, y0, block, layer=None):
+        """Copy a block of tile IDs into a layer (the active one by default) without
+        recording it, e.g. for undo"""
+        layer = layer or self.current_layer
+        layer.tile_map.set_region(x0, y0, np.asarray(block, dtype=layer.tile_map.dtype))
+        self.journal_cells(layer, x0, y0, x0 + block.shape[1], y0 + block.shape[0])
+        self.refresh_cells(x0, y0, x0 + block.shape[1], y0 + block.shape[0])
+    
+    def refresh_cells(self, x0, y0, x1, y1):
+        """Invalidate everything that shows the cells in [x0, x1) x [y0, y1)"""
+        self.map_chunks.invalidate_cells(x0, y0, x1, y1)
+        self.mip_pyramid.update_cells(x0, y0, min(x1, self.grid_width), min(y1, self.grid_height))
+        self.map_version += 1
+        self.mark_cells_dirty(x0, y0, x1, y1)
+    
+    def mark_cells_dirty(self, x0, y0, x1, y1):
+        """Schedule the screen area (and minimap) showing [x0, x1) x [y0, y1) for redrawing"""
+        # Include the grid lines along the right/bottom edges
+        tile_size_zoomed = self.cell_screen_size()
+        origin_x, origin_y = self.camera_origin()
+        rect = pg.Rect(int(x0 * tile_size_zoomed - origin_x), int(y0 * tile_size_zoomed - origin_y),
+                       int((x1 - x0) * tile_size_zoomed) + 2, int((y1 - y0) * tile_size_zoomed) + 2)
+        rect = rect.clip(self.screen.get_rect())
+        if rect.width and rect.height:
+            self.mark_dirty(rect)
+        if self.show_minimap:
+            self.mark_dirty(self.minimap_rect().inflate(2, 2))
+    
+    def undo(self):
+        transaction = self.history.undo()
+        if transaction is None:
+            self.set_status("Nothing to undo")
+            return
+        self.show_transaction_layer(transaction)
+        transaction.apply(self, undo=True)
+        self.set_status(f"Undo: {transaction.name}")
+    
+    def redo(self):
+        transaction = self.history.redo()
+        if transaction is None:
+            self.set_status("Nothing to redo")
+            return
+        self.show_transaction_layer(transaction)
+        transaction.apply(self, undo=False)
+        self.set_status(f"Redo: {transaction.name}")
+    
+    def set_selection(self, bounds):
+        """Select the cells [x0, x1) x [y0, y1) given as bounds, or nothing"""
+        if self.selection is not None:
+            self.mark_cells_dirty(*self.selection)
+        self.selection = bounds
+        if bounds is not None:
+            x0, y0, x1, y1 = bounds
+            self.mark_cells_dirty(*bounds)
+            self.set_status(f"Selected {x1 - x0}x{y1 - y0} cells (CTRL+C = copy, CTRL+X = cut)")
+    
+    def selected_bounds(self):
+        """The selection clipped to the map, or None if nothing (on the map) is selected"""
+        if self.selection is None:
+            self.set_status("Select an area first (E = select tool)")
+            return None
+        x0, y0, x1, y1 = self.selection
+        x1, y1 = min(x1, self.grid_width), min(y1, self.grid_height)
+        if x1 <= x0 or y1 <= y0:
+            self.set_status("The selection is outside the map")
+            return None
+        return x0, y0, x1, y1
+    
+    def copy_selection(self, cut=False):
+        """Copy the selected cells of the active layer to the clipboard, clearing them when cutting"""
+        bounds = self.selected_bounds()
+        if bounds is None:
+            return
+        x0, y0, x1, y1 = bounds
+        self.set_clipboard(np.array(self.map_data.region(x0, y0, x1, y1)))
+        if cut:
+            self.clear_selection("Cut")
+        self.set_status(f"{'Cut' if cut else 'Copied'} {x1 - x0}x{y1 - y0} cells (CTRL+V = paste)")
+    
+    def set_clipboard(self, block):
+        # The paste preview has the size of the old block
+        self.move_paste_preview(None)
+        self.clipboard = block
+    
+    def clear_selection(self, name="Delete"):
+        """Empty the selected cells of the active layer"""
+        bounds = self.selected_bounds()
+        if bounds is None:
+            return
+        x0, y0, x1, y1 = bounds
+        old = self.map_data.region(x0, y0, x1, y1)
+        if not old.any():
+            return
+        new = np.zeros(old.shape, dtype=self.map_data.dtype)
+        self.history.record(RegionEdit(x0, y0, old.copy(), new), name)
+        self.write_region(x0, y0, new)
+        self.set_status(f"Cleared {x1 - x0}x{y1 - y0} cells")
+    
+    def start_pasting(self):
+        """Switch to the paste tool, which stamps the clipboard where clicked"""
+        if self.clipboard is None:
+            self.set_status("Nothing to paste (CTRL+C copies the selection, J picks a stamp)")
+            return
+        self.set_tool("paste")
+        self.move_paste_preview(self.mouse_pos())
+        height, width = self.clipboard.shape
+        self.set_status(f"Click to paste {width}x{height} cells, right click to stop")
+    
+    def move_paste_preview(self, pos):
+        """Move the outline of the block being pasted to the cell under pos (None hides it)"""
+        cell = self.screen_to_cell(pos) if pos is not None else None
+        if cell == self.paste_cell:
+            return
+        for corner in (self.paste_cell, cell):
+            if corner is not None:
+                height, width = self.clipboard.shape
+                self.mark_cells_dirty(corner[0], corner[1], corner[0] + width, corner[1] + height)
+        self.paste_cell = cell
+    
+    def paste_clipboard(self, x, y):
+        """Stamp the clipboard onto the active layer with its top-left corner at (x, y),
+        as one block update; its empty cells leave the map's tiles showing through"""
+        block = self.clipboard[:max(0, self.grid_height - y), :max(0, self.grid_width - x)]
+        if block.size == 0:
+            return
+        old = self.map_data.region(x, y, x + block.shape[1], y + block.shape[0])
+        new = stamp_block(old, block)
+        if np.array_equal(old, new):
+            return
+        self.history.record(RegionEdit(x, y, old.copy(), new), "Paste")
+        self.write_region(x, y, new)
+        self.set_status(f"Pasted {block.shape[1]}x{block.shape[0]} cells")
+    
+    def use_pattern_brush(self):
+        """Switch to the pattern tool, which paints with the clipboard repeated across the map"""
+        if self.clipboard is None:
+            self.set_status("Copy a selection (CTRL+C) or pick a stamp (J) to paint with first")
+            return
+        self.set_tool("pattern")
+    
+    def save_clipboard_stamp(self):
+        """Save the clipboard as a named stamp"""
+        if self.clipboard is None:
+            self.set_status("Copy a selection (CTRL+C) to save as a stamp first")
+            return
+        name = self.show_text_input_dialog("Enter stamp name:")
+        self.mark_dirty()  # The dialog drew over the whole window
+        name = ''.join(c for c in (name or "") if c.isalnum() or c in ' _-').strip().replace(' ', '_')
+        if not name:
+            return
+        try:
+            save_stamp(name, self.clipboard, tile_table_hash(TILE_TYPES))
+            self.set_status(f"Saved stamp {name}")
+        except OSError as e:
+            self.set_status(f"Error saving stamp: {e}")
+    
+    def pick_stamp(self):
+        """Load a saved stamp into the clipboard and start pasting it"""
+        names = stamp_names()
+        if not names:
+            self.set_status("No saved stamps yet (K saves the clipboard as one)")
+            return
+        name = self.show_text_input_dialog(f"Stamp ({', '.join(names)}):")
+        self.mark_dirty()  # The dialog drew over the whole window
+        if not name:
+            return
+        if name.strip() not in names:
+            self.set_status(f"There is no stamp named {name.strip()}")
+            return
+        try:
+            block, tile_hash = load_stamp(name.strip())
+        except (OSError, ValueError) as e:
+            self.set_status(f"Error loading stamp: {e}")
+            return
+        self.set_clipboard(block)
+        self.start_pasting()
+        if tile_hash != tile_table_hash(TILE_TYPES):
+            self.set_status("Stamp was saved with a different tile table")
+    
+    def show_transaction_layer(self, transaction):
+        """Make the layer an undo step was recorded on active, so it undoes there"""
+        if transaction.layer in self.layers and transaction.layer is not self.current_layer:
+            self.select_layer(self.layers.index(transaction.layer))
+    
+    def select_layer(self, index):
+        """Make another layer the one that editing works on"""
+        self.active_layer = index % len(self.layers)
+        self.history.commit()
+        self.history.layer = self.current_layer
+        self.mark_dirty()
+        self.set_status(f"Layer: {self.current_layer.name}")
+    
+    def toggle_layer_visibility(self):
+        """Show or hide the active layer"""
+        layer = self.current_layer
+        layer.visible = not layer.visible
+        self.layers_changed = True
+        self.map_chunks.clear()
+        self.mip_pyramid.set_source(LayerStack(self.layers))
+        self.map_version += 1
+        self.mark_dirty()
+        self.set_status(f"Layer {layer.name} {'shown' if layer.visible else 'hidden'}")
+    
+    def add_layer(self):
+        """Add an empty layer above the active one, with a name from the user"""
+        name = self.show_text_input_dialog("Enter layer name:")
+        self.mark_dirty()  # The dialog drew over the whole window
+        name = ''.join(c for c in (name or "") if c.isalnum() or c in ' _-').strip().replace(' ', '_')
+        if not name:
+            return
+        if any(layer.name == name for layer in self.layers):
+            self.set_status(f"There already is a layer named {name}")
+            return
+        
+        # New layers use the same storage as the others
+        if self.map_data.is_sparse:
+            tile_map = SparseTileMap(self.grid_width, self.grid_height, MAP_DTYPE)
+        else:
+            tile_map = TileMap(self.grid_width, self.grid_height, MAP_DTYPE)
+        self.layers.insert(self.active_layer + 1, MapLayer(name, tile_map))
+        self.map_version += 1
+        self.select_layer(self.active_layer + 1)
+        self.set_status(f"Added layer {name}")
     
     def create_new_map(self):
         """Create a new map with a user-defined name"""
         # Get map name from user
         map_name = self.show_text_input_dialog("Enter map name (without extension):")
+        self.mark_dirty()  # The dialog drew over the whole window
         
         if not map_name:  # User cancelled
             return
@@ -422,9 +1905,7 @@ class TileEditor:
         self.map_path = os.path.join("assets", f"{map_name}.csv")
         
         # Reset the map to default size with empty tiles
-        self.grid_width = GRID_WIDTH
-        self.grid_height = GRID_HEIGHT
-        self.map_data = [[0 for _ in range(self.grid_width)] for _ in range(self.grid_height)]
+        self.set_map(TileMap(GRID_WIDTH, GRID_HEIGHT, MAP_DTYPE))
         
         # Reset camera position and update status
         self.camera_x = 0
@@ -432,7 +1913,10 @@ class TileEditor:
         self.set_status(f"Created new map: {map_name}")
     
     def show_text_input_dialog(self, prompt):
-        """Show a text input dialog and return the entered text"""
+        """Show a text input dialog and return the entered text ("" if cancelled, None on quit)"""
+        return self.session_answer(lambda: self.run_text_input_dialog(prompt))
+    
+    def run_text_input_dialog(self, prompt):
         input_text = ""
         dialog_active = True
         
@@ -487,16 +1971,14 @@ class TileEditor:
             pg.draw.rect(self.screen, WHITE, (dialog_x, dialog_y, dialog_width, dialog_height), 2)
             
             # Draw prompt
-            prompt_font = pg.font.SysFont(None, 24)
-            prompt_text = prompt_font.render(prompt, True, WHITE)
+            prompt_text = self.render_text(prompt, 24, WHITE)
             self.screen.blit(prompt_text, (dialog_x + 20, dialog_y + 20))
             
             # Draw input text with cursor
-            input_font = pg.font.SysFont(None, 28)
             display_text = input_text
             if cursor_visible:
                 display_text += "|"
-            text_surface = input_font.render(display_text, True, WHITE)
+            text_surface = self.get_font(28).render(display_text, True, WHITE)
             
             # Draw text box
             text_box_rect = (dialog_x + 20, dialog_y + 60, dialog_width - 40, 30)
@@ -511,9 +1993,8 @@ class TileEditor:
             pg.draw.rect(self.screen, GRAY, ok_button_rect)
             pg.draw.rect(self.screen, GRAY, cancel_button_rect)
             
-            button_font = pg.font.SysFont(None, 20)
-            ok_text = button_font.render("OK", True, WHITE)
-            cancel_text = button_font.render("Cancel", True, WHITE)
+            ok_text = self.render_text("OK", 20, WHITE)
+            cancel_text = self.render_text("Cancel", 20, WHITE)
             
             # Center text on buttons
             self.screen.blit(ok_text, (ok_button_rect[0] + (ok_button_rect[2] - ok_text.get_width()) // 2,
@@ -526,44 +2007,167 @@ class TileEditor:
         
         return input_text
     
+    def file_dialogs(self):
+        """Return tkinter's filedialog module, importing tkinter and creating its
+        hidden main window the first time a dialog is needed"""
+        import tkinter as tk
+        from tkinter import filedialog
+        if self.tk_root is None:
+            self.tk_root = tk.Tk()
+            self.tk_root.withdraw()  # Hide the main tkinter window
+        return filedialog
+    
     def open_map_file(self):
         """Open a map file using a file dialog"""
         # Use tkinter's file dialog to get the file path
-        file_path = filedialog.askopenfilename(
+        file_path = self.session_answer(lambda: self.file_dialogs().askopenfilename(
             initialdir=os.path.dirname(self.map_path),
             title="Open Map File",
-            filetypes=(("CSV files", "*.csv"), ("All files", "*.*"))
-        )
+            filetypes=MAP_FILE_TYPES
+        ))
+        
+        # The dialog may have covered the window
+        self.mark_dirty()
+        
+        # If user canceled the dialog, return without doing anything
+        if not file_path:
+            return
+        
+        # Load the map in the background
+        self.start_loading(file_path, f"Opened map: {os.path.basename(file_path)}", "Error loading map")
+    
+    def save_map_as(self):
+        """Save the map under a new name; the extension picks CSV or binary format"""
+        file_path = self.session_answer(lambda: self.file_dialogs().asksaveasfilename(
+            initialdir=os.path.dirname(self.map_path),
+            title="Save Map As",
+            defaultextension=".csv",
+            filetypes=MAP_FILE_TYPES
+        ))
+        
+        # The dialog may have covered the window
+        self.mark_dirty()
         
         # If user canceled the dialog, return without doing anything
         if not file_path:
             return
         
-        # Update the map path and try to load the map
         self.map_path = file_path
+        self.save_map()
+    
+    def export_image(self):
+        """Render the visible layers to a PNG next to the map, at a tile size asked for.
+        The export runs in worker processes, reading the layers a strip at a time, so
+        the map can be viewed but not edited until an EXPORT_FINISHED_EVENT reports
+        the result."""
+        if self.exporting:
+            self.set_status("An export is already running")
+            return
+        text = self.show_text_input_dialog(f"Export tile size in pixels (e.g. {TILE_SIZE}):")
+        self.mark_dirty()  # The dialog drew over the whole window
+        text = (text or "").strip()
+        if not text:
+            return
+        if not text.isdigit() or int(text) == 0:
+            self.set_status(f"Invalid tile size: {text}")
+            return
+        tile_size = int(text)
+        
+        # Finish any stroke first: the map has to stay as it is while it's exported
+        self.end_mouse_drag()
+        layers = [layer.tile_map for layer in self.layers if layer.visible]
+        if not layers:
+            self.set_status("There are no visible layers to export")
+            return
+        tables = self.atlas.pixel_tables(tile_size)
+        path = os.path.splitext(self.map_path)[0] + ".png"
+        self.exporting = True
+        thread = threading.Thread(target=self.export_worker, args=(path, layers, tile_size, tables),
+                                  name="map-exporter", daemon=True)
+        thread.start()
+        self.set_status(f"Exporting {path}...")
+    
+    def export_worker(self, path, layers, tile_size, tables):
+        """Runs on the exporter thread"""
+        start = time.perf_counter()
         try:
-            self.load_map()
-            self.set_status(f"Opened map: {os.path.basename(file_path)}")
+            size, error = export_png(path, layers, tile_size, tables, os.cpu_count() or 1), None
         except Exception as e:
-            self.set_status(f"Error loading map: {str(e)}")
+            size, error = None, e
+        pg.event.post(pg.event.Event(EXPORT_FINISHED_EVENT, path=path, size=size, error=error,
+                                     seconds=time.perf_counter() - start))
+    
+    def finish_export(self, event):
+        self.exporting = False
+        if event.error is not None:
+            self.set_status(f"Error exporting map: {event.error}")
+        else:
+            width, height = event.size
+            self.set_status(f"Exported {width}x{height} {event.path} in {event.seconds:.1f}s")
+    
+    def editing_blocked(self):
+        """Whether the map can't be edited right now (saying why in the status bar)"""
+        if self.loading is not None:
+            self.set_status("The map is still loading (ESC to cancel)")
+        elif self.exporting:
+            self.set_status("The map is being exported")
+        return self.loading is not None or self.exporting
     
     def handle_key_event(self, key, mods):
+        # While a map loads or is exported, only viewing controls work
+        layer_keys = (pg.K_n, pg.K_v, pg.K_LEFTBRACKET, pg.K_RIGHTBRACKET)
+        if (key in (pg.K_s, pg.K_l, pg.K_DELETE) + layer_keys or mods & pg.KMOD_CTRL) and self.editing_blocked():
+            return
+        
         # Handle tile selection with number keys
         if pg.K_0 <= key <= pg.K_9:
             tile_id = key - pg.K_0
             if tile_id in TILE_TYPES:
-                self.current_tile = tile_id
-                self.set_status(f"Selected tile: {TILE_TYPES[tile_id]}")
+                self.select_tile(tile_id)
         
         # Save, load, and new map
         elif key == pg.K_s and not (mods & pg.KMOD_CTRL):
             self.save_map()
+        elif key == pg.K_s and (mods & pg.KMOD_CTRL):
+            self.save_map_as()
         elif key == pg.K_l and not (mods & pg.KMOD_CTRL):
             self.try_load_map()
         elif key == pg.K_n and (mods & pg.KMOD_CTRL):
             self.create_new_map()
         elif key == pg.K_o and (mods & pg.KMOD_CTRL):
             self.open_map_file()
+        elif key == pg.K_e and (mods & pg.KMOD_CTRL):
+            self.export_image()
+        
+        # Undo and redo
+        elif key == pg.K_z and (mods & pg.KMOD_CTRL) and not (mods & pg.KMOD_SHIFT):
+            self.undo()
+        elif (key == pg.K_y and (mods & pg.KMOD_CTRL)) or (key == pg.K_z and (mods & pg.KMOD_CTRL)):
+            self.redo()
+        
+        # Selection, clipboard and stamps
+        elif key == pg.K_c and (mods & pg.KMOD_CTRL):
+            self.copy_selection()
+        elif key == pg.K_x and (mods & pg.KMOD_CTRL):
+            self.copy_selection(cut=True)
+        elif key == pg.K_v and (mods & pg.KMOD_CTRL):
+            self.start_pasting()
+        elif key == pg.K_DELETE:
+            self.clear_selection()
+        elif key == pg.K_k and not mods:
+            self.save_clipboard_stamp()
+        elif key == pg.K_j and not mods:
+            self.pick_stamp()
+        
+        # Map layers
+        elif key == pg.K_LEFTBRACKET:
+            self.select_layer(self.active_layer - 1)
+        elif key == pg.K_RIGHTBRACKET:
+            self.select_layer(self.active_layer + 1)
+        elif key == pg.K_v and not mods:
+            self.toggle_layer_visibility()
+        elif key == pg.K_n and not mods:
+            self.add_layer()
             
         # Map resizing controls
         elif key == pg.K_RIGHT and (mods & pg.KMOD_CTRL):
@@ -580,90 +2184,377 @@ class TileEditor:
             self.zoom_in()
         elif key == pg.K_MINUS:
             self.zoom_out()        
-            
-        # Scroll controls (without modifier keys)
-        elif key == pg.K_RIGHT and not mods:
-            self.scroll(1, 0)
-        elif key == pg.K_LEFT and not mods:
-            self.scroll(-1, 0)
-        elif key == pg.K_DOWN and not mods:
-            self.scroll(0, 1)
-        elif key == pg.K_UP and not mods:
-            self.scroll(0, -1)
+        elif key == pg.K_m:
+            self.show_minimap = not self.show_minimap
+            self.mark_dirty()
+        
+        # Palette scrolling and filtering
+        elif key == pg.K_PAGEDOWN:
+            self.scroll_palette(self.palette_rect().height - PALETTE_TOP)
+        elif key == pg.K_PAGEUP:
+            self.scroll_palette(PALETTE_TOP - self.palette_rect().height)
+        elif key == pg.K_SLASH:
+            self.filter_palette()
+        
+        # Frame profiler
+        elif key == pg.K_F3:
+            self.toggle_profiler()
+        elif key == pg.K_F4:
+            self.dump_profile_trace()
+        
+        # Painting tools
+        elif key == pg.K_b and not mods:
+            self.set_tool("brush")
+        elif key == pg.K_r and not mods:
+            self.set_tool("rectangle")
+        elif key == pg.K_f and not mods:
+            self.set_tool("fill")
+        elif key == pg.K_e and not mods:
+            self.set_tool("select")
+        elif key == pg.K_p and not mods:
+            self.use_pattern_brush()
+
+    
+    def zoom_text(self):
+        return f"{self.zoom_level:.1f}" if self.zoom_level >= 0.1 else f"{self.zoom_level:.3f}"
+    
+    def min_zoom(self):
+        """Zoom level at which the whole map fits in the view (never above 0.5)"""
+        fit = min(self.viewport_width / (self.grid_width * TILE_SIZE),
+                  min(self.viewport_height, self.window_height) / (self.grid_height * TILE_SIZE))
+        return min(0.5, fit)
     
     def zoom_in(self):
-        if self.zoom_level < 2.0:  # Limit max zoom
+        if self.zoom_level < 0.5 - 1e-6:  # Zoomed far out: double
+            self.zoom_level = min(0.5, self.zoom_level * 2)
+        elif self.zoom_level < 2.0:  # Limit max zoom
             self.zoom_level += 0.1
-            self.set_status(f"Zoom level: {self.zoom_level:.1f}x")
+        else:
+            return
+        self.mark_dirty()
+        self.set_status(f"Zoom level: {self.zoom_text()}x")
     
     def zoom_out(self):
-        if self.zoom_level > 0.5:  # Limit min zoom
+        if self.zoom_level > 0.5 + 1e-6:
             self.zoom_level -= 0.1
-            self.set_status(f"Zoom level: {self.zoom_level:.1f}x")
+        elif self.zoom_level > self.min_zoom():  # Below 0.5, halve until the whole map fits
+            self.zoom_level = max(self.min_zoom(), self.zoom_level / 2)
+        else:
+            return
+        self.mark_dirty()
+        self.set_status(f"Zoom level: {self.zoom_text()}x")
     
     def scroll(self, dx, dy):
-        # Adjust scroll speed based on zoom level
-        scroll_speed = max(1, int(3 / self.zoom_level))
-        dx *= scroll_speed
-        dy *= scroll_speed
-        
-        # Update camera position
-        self.camera_x += dx
-        self.camera_y += dy
-        
-        # Ensure camera doesn't go out of bounds
-        max_x = max(0, self.grid_width - int(self.viewport_width / (TILE_SIZE * self.zoom_level)))
-        max_y = max(0, self.grid_height - int(self.viewport_height / (TILE_SIZE * self.zoom_level)))
+        """Move the camera by (dx, dy) screen pixels. Nothing is marked dirty: the next
+        redraw shifts the map on screen and draws only the strips that came into view."""
+        cell_size = TILE_SIZE * self.zoom_level
         
         # Always allow scrolling if the map is bigger than the viewport
-        self.camera_x = max(0, min(self.camera_x, max(0, self.grid_width - 1)))
-        self.camera_y = max(0, min(self.camera_y, max(0, self.grid_height - 1)))
+        self.camera_x = max(0.0, min(self.camera_x + dx / cell_size, max(0, self.grid_width - 1)))
+        self.camera_y = max(0.0, min(self.camera_y + dy / cell_size, max(0, self.grid_height - 1)))
+    
+    def scroll_held_keys(self, elapsed):
+        """Scroll smoothly while arrow keys are held; elapsed is the frame time in ms.
+        The camera position is shown once scrolling stops."""
+        keys = self.pressed_keys()
+        dx = keys[pg.K_RIGHT] - keys[pg.K_LEFT]
+        dy = keys[pg.K_DOWN] - keys[pg.K_UP]
+        if (dx or dy) and not (self.key_mods() & pg.KMOD_CTRL):
+            step = SCROLL_SPEED * min(elapsed, MAX_SCROLL_STEP) / 1000
+            self.scroll(dx * step, dy * step)
+            self.scrolling = True
+        elif self.scrolling:
+            self.scrolling = False
+            self.show_camera_status()
+    
+    def scroll_keys_held(self):
+        keys = self.pressed_keys()
+        if self.key_mods() & pg.KMOD_CTRL:
+            return False
+        return keys[pg.K_RIGHT] or keys[pg.K_LEFT] or keys[pg.K_DOWN] or keys[pg.K_UP]
+    
+    def ticks(self):
+        """Milliseconds since pygame started, or the replayed frame's time"""
+        return self.replay.ticks if self.replay is not None else pg.time.get_ticks()
+    
+    def key_mods(self):
+        return self.replay.frame["mods"] if self.replay is not None else pg.key.get_mods()
+    
+    def pressed_keys(self):
+        """The held state of SCROLL_KEYS, indexed by key"""
+        if self.replay is not None:
+            return {key: key in self.replay.frame["keys"] for key in SCROLL_KEYS}
+        return pg.key.get_pressed()
+    
+    def mouse_pos(self):
+        return tuple(self.replay.frame["mouse"]) if self.replay is not None else pg.mouse.get_pos()
+    
+    def session_answer(self, ask):
+        """Run a dialog (ask() shows it and returns the answer). Recordings store the
+        answer and replays give it back without showing the dialog."""
+        if self.replay is not None:
+            return self.replay.answer()
+        answer = ask()
+        if self.recorder is not None:
+            self.recorder.answer(answer)
+        return answer
+    
+    def replayed_events(self):
+        """The next frame's events from the replay (a QUIT at its end). Background
+        results are waited for, so they are handled in the same frame as when recorded."""
+        frame = self.replay.next_frame()
+        if frame is None:
+            return [pg.event.Event(pg.QUIT)]
+        markers = {name: event_type for event_type, name in SESSION_MARKERS.items()}
+        events = []
+        for record in frame["events"]:
+            event_type = markers.get(record[0])
+            if event_type is None:
+                events.append(decode_event(record))
+            elif event_type == AUTOSAVE_EVENT:
+                # The autosave timer is off in replays, so its ticks come from the recording
+                events.append(pg.event.Event(AUTOSAVE_EVENT))
+            else:
+                events.append(self.wait_for_background_event(event_type))
+        return events
+    
+    def wait_for_background_event(self, event_type):
+        """Wait for the next event of event_type posted by a background thread. For
+        loading progress, the latest update that hands over a map is used."""
+        deadline = time.perf_counter() + REPLAY_WAIT_TIMEOUT
+        while time.perf_counter() < deadline:
+            events = pg.event.get(event_type)
+            if event_type == LOAD_PROGRESS_EVENT:
+                events = [event for event in events if event.tile_map is not None][-1:]
+            elif event_type == LOAD_FINISHED_EVENT:
+                # Updates of the finished load are out of date
+                pg.event.get(LOAD_PROGRESS_EVENT)
+            if events:
+                for event in events[1:]:
+                    pg.event.post(event)
+                return events[0]
+            pg.time.wait(1)
+        raise RuntimeError(f"The replay waited {REPLAY_WAIT_TIMEOUT}s for a {SESSION_MARKERS[event_type]} "
+                           "result that never came (it diverged from the recording)")
+    
+    def map_checksum(self):
+        return map_checksum([(layer.name, layer.visible, layer.tile_map) for layer in self.layers])
+    
+    def wait_for_events(self):
+        """Return pending events, blocking while there is nothing to animate"""
+        if self.replay is not None:
+            return self.replayed_events()
+        if self.always_redraw or self.full_redraw or self.dirty_rects or self.scroll_keys_held():
+            return pg.event.get()
         
-        # Update status for debugging
-        self.set_status(f"Camera: ({self.camera_x}, {self.camera_y}) Zoom: {self.zoom_level:.1f}x", 1000)
+        # Idle: sleep until an event arrives, or until the status message expires
+        timeout = max(1, int(self.status_timer)) if self.status_timer > 0 else 0
+        event = pg.event.wait(timeout)
+        events = [] if event.type == pg.NOEVENT else [event]
+        return events + pg.event.get()
     
-    def run(self):
+    def redraw(self, profiler=None):
+        """Draw the frame and push the changed parts of it to the display"""
+        shift = None if self.always_redraw or self.full_redraw else self.scroll_map_frame()
+        if shift is None:
+            self.draw_grid()
+            self.map_frame_key = (self.cell_screen_size(), self.camera_origin())
+            if profiler:
+                profiler.mark("draw_grid")
+            self.draw_ui()
+            if profiler:
+                profiler.mark("draw_ui")
+            pg.display.flip()
+            if profiler:
+                profiler.mark("flip")
+        elif shift != (0, 0):
+            # The map moved: areas marked dirty before that moved with it
+            for rect in self.dirty_rects + [rect.move(shift) for rect in self.dirty_rects]:
+                self.map_frame.set_clip(rect)
+                self.render_map(self.map_frame)
+            self.map_frame.set_clip(None)
+            self.screen.blit(self.map_frame, (0, 0))
+            if profiler:
+                profiler.mark("draw_grid")
+            self.draw_ui()
+            if profiler:
+                profiler.mark("draw_ui")
+            pg.display.flip()
+            if profiler:
+                profiler.mark("flip")
+        elif self.dirty_rects:
+            rects = self.dirty_rects
+            if len(rects) > MAX_DIRTY_RECTS:
+                rects = [rects[0].unionall(rects[1:])]
+            for rect in rects:
+                self.screen.set_clip(rect)
+                self.draw_grid()
+                if profiler:
+                    profiler.mark("draw_grid")
+                self.draw_ui()
+                if profiler:
+                    profiler.mark("draw_ui")
+            self.screen.set_clip(None)
+            pg.display.update(rects)
+            if profiler:
+                profiler.mark("flip")
+        self.full_redraw = False
+        self.dirty_rects = []
+    
+    def run(self, record=None):
+        """Run the editor until it quits. With record (a file path), the session is
+        recorded frame by frame for replay.py to play back."""
         running = True
+        self.last_tick = self.ticks()
+        self.mark_dirty()
+        if self.autosave_interval > 0 and self.replay is None:
+            pg.time.set_timer(AUTOSAVE_EVENT, int(self.autosave_interval * 1000))
+        if record is not None:
+            settings = {"always_redraw": self.always_redraw, "undo_bytes": self.history.max_bytes,
+                        "autosave": self.autosave_interval, "map_path": self.map_path}
+            self.recorder = SessionRecorder(record, self.last_tick, settings, SESSION_MARKERS)
         while running:
-            for event in pg.event.get():
+            # The profiler (if on) times each phase of the frame
+            profiler = self.profiler
+            if profiler:
+                profiler.begin_frame()
+            events = self.wait_for_events()
+            if profiler:
+                profiler.mark("idle")
+            frame_start = time.perf_counter()
+            if self.recorder is not None:
+                # Loading progress only matters once it hands over the map to show
+                recorded = [event for event in events if event.type != LOAD_PROGRESS_EVENT or event.tile_map]
+                keys = pg.key.get_pressed()
+                self.recorder.begin_frame(recorded, pg.key.get_mods(), [key for key in SCROLL_KEYS if keys[key]],
+                                          pg.mouse.get_pos())
+            
+            # Pointer positions while dragging, handled together once per frame
+            drag_positions = []
+            for event in events:
                 if event.type == pg.QUIT:
                     running = False
                 elif event.type == pg.MOUSEBUTTONDOWN:
-                    # Handle mouse wheel for zooming
-                    if event.button == 4:  # Scroll up
+                    # Handle mouse wheel for zooming (or scrolling, over the palette)
+                    if event.button in (4, 5) and self.palette_rect().collidepoint(event.pos):
+                        self.scroll_palette(PALETTE_SCROLL_STEP if event.button == 5 else -PALETTE_SCROLL_STEP)
+                    elif event.button == 4:  # Scroll up
                         self.zoom_in()
                     elif event.button == 5:  # Scroll down
                         self.zoom_out()
                     else:
                         self.handle_mouse_click(event.pos, event.button)
+                elif event.type == pg.MOUSEMOTION:
+                    if self.stroke_cell is not None or self.rect_start is not None:
+                        drag_positions.append(event.pos)
+                    elif self.tool == "paste":
+                        self.move_paste_preview(event.pos)
+                elif event.type == pg.MOUSEBUTTONUP and event.button in (1, 3):
+                    # Releasing the button ends the stroke
+                    if drag_positions:
+                        self.handle_mouse_drag(drag_positions)
+                        drag_positions = []
+                    self.end_mouse_drag()
                 elif event.type == pg.KEYDOWN:
-                    self.handle_key_event(event.key, pg.key.get_mods())
+                    if event.key == pg.K_ESCAPE:
+                        # ESC cancels loading, pasting or the selection, otherwise quits
+                        if self.loading is not None:
+                            self.cancel_loading()
+                        elif self.tool == "paste":
+                            self.set_tool("select")
+                        elif self.selection is not None:
+                            self.set_selection(None)
+                        else:
+                            running = False
+                    else:
+                        self.handle_key_event(event.key, self.key_mods())
+                elif event.type == LOAD_PROGRESS_EVENT:
+                    self.handle_load_progress(event)
+                elif event.type == LOAD_FINISHED_EVENT:
+                    self.handle_load_finished(event)
+                elif event.type == SAVE_FINISHED_EVENT:
+                    self.finish_save(event)
+                elif event.type == EXPORT_FINISHED_EVENT:
+                    self.finish_export(event)
+                elif event.type == AUTOSAVE_EVENT:
+                    self.autosave()
+                elif event.type in (pg.VIDEOEXPOSE, pg.WINDOWEXPOSED, pg.WINDOWRESTORED):
+                    # The window contents were lost or uncovered
+                    self.mark_dirty()
                 
+            if drag_positions:
+                self.handle_mouse_drag(drag_positions)
+            if profiler:
+                profiler.mark("events")
+            
+            # Frame time (wall time, since the loop may have slept)
+            now = self.ticks()
+            elapsed = now - self.last_tick
+            self.last_tick = now
+            
             # Check held keys for smooth scrolling
-            keys = pg.key.get_pressed()
-            if keys[pg.K_ESCAPE]:
-                running = False
-            if keys[pg.K_RIGHT] and not (pg.key.get_mods() & pg.KMOD_CTRL):                self.scroll(1, 0)
-            if keys[pg.K_LEFT] and not (pg.key.get_mods() & pg.KMOD_CTRL):
-                self.scroll(-1, 0)
-            if keys[pg.K_DOWN] and not (pg.key.get_mods() & pg.KMOD_CTRL):
-                self.scroll(0, 1)
-            if keys[pg.K_UP] and not (pg.key.get_mods() & pg.KMOD_CTRL):
-                self.scroll(0, -1)
+            self.scroll_held_keys(elapsed)
             
             # Update status timer
             if self.status_timer > 0:
-                self.status_timer -= self.clock.get_time()
+                self.status_timer -= elapsed
+                if self.status_timer <= 0:
+                    self.mark_dirty(self.status_bar_rect())
+            if profiler:
+                profiler.mark("scroll")
             
-            # Draw everything
-            self.draw_grid()
-            self.draw_ui()
-            
-            pg.display.flip()
-            self.clock.tick(60)
+            # Draw whatever changed
+            self.redraw(profiler)
+            if self.startup and self.startup.first_frame is None:
+                self.startup.frame_shown()
+                self.report_startup()
+            if self.recorder is not None:
+                self.recorder.end_frame(now, time.perf_counter() - frame_start)
+            if self.replay is not None:
+                # Replays run flat out, timing each frame
+                self.replay.frame_done(time.perf_counter() - frame_start)
+            else:
+                self.clock.tick(60)
+            if profiler:
+                profiler.mark("sleep")
+                profiler.end_frame(self.frame_counters())
+                if profiler.overlay_visible and now - self.profiler_overlay_tick >= PROFILE_OVERLAY_INTERVAL:
+                    self.refresh_profiler_overlay()
         
+        # Don't quit halfway through writing a map
+        if self.loading is not None:
+            self.loading.cancel()
+            self.loading.wait()
+        self.map_saver.wait()
+        if self.recorder is not None:
+            self.recorder.close(self.map_checksum())
+            self.recorder = None
+        self.save_tile_cache()
+        if self.startup:
+            print(self.startup.report())
         pg.quit()
 
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tile editor for CSV and binary map files")
+    parser.add_argument("--always-redraw", action="store_true", default=ALWAYS_REDRAW,
+                        help="redraw the whole window every frame instead of only what changed")
+    parser.add_argument("--undo-memory", type=int, default=UNDO_HISTORY_BYTES // (1024 * 1024), metavar="MB",
+                        help="memory budget for the undo/redo history (default: %(default)s MB)")
+    parser.add_argument("--autosave", type=float, default=AUTOSAVE_INTERVAL, metavar="SECONDS",
+                        help="seconds between autosaves of unsaved changes, 0 to disable (default: %(default)s)")
+    parser.add_argument("--profile", action="store_true", default=PROFILE,
+                        help="time every frame from startup and show the profiler overlay (F3 toggles it)")
+    parser.add_argument("--startup-report", action="store_true", default=STARTUP_REPORT,
+                        help=f"print how long each step of startup took (or set {STARTUP_REPORT_ENV}=1)")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record the session's input to FILE, to play back with src/replay.py")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    editor = TileEditor()
-    editor.run()
\ No newline at end of file
+    args = parse_args()
+    editor = TileEditor(always_redraw=args.always_redraw, undo_bytes=args.undo_memory * 1024 * 1024,
+                        autosave_interval=args.autosave, profile=args.profile,
+                        startup_report=args.startup_report)
+    editor.run(record=args.record)
\ No newline at end of file
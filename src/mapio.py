@@ -0,0 +1,509 @@
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import os
+import struct
+import zlib
+import numpy as np
+
+from tilemap import MAP_DTYPE, SPARSE_CHUNK_SIZE, TileMap, SparseTileMap, new_tile_map
+
+# Size of the raw byte blocks the CSV codec works on
+CSV_BLOCK_SIZE = 1024 * 1024
+# Target number of cells formatted at once when writing
+CSV_WRITE_CELLS = 1 << 20
+# Fields with more digits than this take the slow path (float64 sums stay exact)
+_MAX_FAST_DIGITS = 15
+
+_NEWLINE = ord('\n')
+_CARRIAGE = ord('\r')
+_COMMA = ord(',')
+_ZERO = ord('0')
+
+def _iter_line_blocks(file, block_size=CSV_BLOCK_SIZE):
+    """Yield raw byte blocks from a binary file, each ending on a line boundary"""
+    carry = b""
+    first = True
+    while True:
+        chunk = file.read(block_size)
+        if first:
+            first = False
+            if chunk.startswith(b"\xef\xbb\xbf"):  # UTF-8 byte order mark
+                chunk = chunk[3:]
+        if not chunk:
+            break
+        chunk = carry + chunk
+        cut = chunk.rfind(b"\n") + 1
+        if cut == 0:
+            carry = chunk
+            continue
+        carry = chunk[cut:]
+        yield chunk[:cut]
+    if carry:
+        yield carry + b"\n"
+
+
+def _crlf_only(block):
+    """True if every carriage return in the block is part of a CRLF line ending"""
+    carriages = block.count(b"\r")
+    return carriages == 0 or carriages == block.count(b"\r\n")
+
+
+def _fast_bytes(block):
+    """Return the block as a uint8 array with CRLF line endings removed, or None
+    when it contains anything the vectorized parser can't handle exactly"""
+    if not _crlf_only(block):
+        return None
+    arr = np.frombuffer(block, dtype=np.uint8)
+    if b"\r" in block:
+        arr = arr[arr != _CARRIAGE]
+    # Only digits, commas and newlines; anything else goes through the csv module
+    is_digit = (arr >= _ZERO) & (arr <= _ZERO + 9)
+    if not (is_digit | (arr == _COMMA) | (arr == _NEWLINE)).all():
+        return None
+    return arr
+
+
+def _slow_rows(block):
+    """Parse a block with the csv module, mapping malformed cells to None"""
+    text = block.decode("utf-8", errors="replace")
+    for row in csv.reader(io.StringIO(text, newline="")):
+        values = []
+        for cell in row:
+            try:
+                values.append(int(cell))
+            except ValueError:
+                values.append(None)
+        yield values
+
+
+def _block_shape(block):
+    """Return (number of rows, widest row) of a block"""
+    if b'"' in block or not _crlf_only(block):
+        # Quoted fields and bare CR line breaks need the real csv parser
+        rows = list(_slow_rows(block))
+        return len(rows), max((len(row) for row in rows), default=0)
+
+    arr = np.frombuffer(block, dtype=np.uint8)
+    newlines = np.flatnonzero(arr == _NEWLINE)
+    commas = np.searchsorted(np.flatnonzero(arr == _COMMA), newlines)
+    commas_per_line = np.diff(commas, prepend=0)
+    line_lengths = np.diff(newlines, prepend=-1) - 1
+    if b"\r" in block:
+        line_lengths -= arr[newlines - 1] == _CARRIAGE
+    # An empty line has no fields, otherwise there is one more field than commas
+    fields = np.where(line_lengths > 0, commas_per_line + 1, 0)
+    return len(newlines), int(fields.max(initial=0))
+
+
+def _parse_block(arr, out, row0, max_value):
+    """Parse a normalized block into the rows of the map out starting at row0,
+    returning the number of rows written or None if a field is too long to be
+    parsed exactly"""
+    is_digit = (arr >= _ZERO) & (arr <= _ZERO + 9)
+    sep_pos = np.flatnonzero(~is_digit)  # Every comma and newline ends a field
+    starts = np.empty_like(sep_pos)
+    starts[0] = 0
+    starts[1:] = sep_pos[:-1] + 1
+    digits_per_field = sep_pos - starts
+    max_digits = int(digits_per_field.max())
+    if max_digits > _MAX_FAST_DIGITS:
+        return None
+
+    # Accumulate the digits of every field in parallel, one digit position at a time
+    values = arr[starts].astype(np.int64) - _ZERO
+    for k in range(1, max_digits):
+        longer = np.flatnonzero(digits_per_field > k)
+        values[longer] = values[longer] * 10 + (arr[starts[longer] + k] - _ZERO)
+    # Empty fields are malformed (int('') fails) and large IDs don't fit: both become 0
+    values[(digits_per_field == 0) | (values > max_value)] = 0
+
+    # Group the fields into lines
+    line_ends = np.flatnonzero(arr[sep_pos] == _NEWLINE)  # Index of each line's last field
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+    field_counts = line_ends - line_starts + 1
+    # A line that is just a newline has no fields at all
+    field_counts[(field_counts == 1) & (digits_per_field[line_ends] == 0)] = 0
+
+    n_lines = len(line_ends)
+    if n_lines and (field_counts == field_counts[0]).all() and field_counts[0] > 0:
+        # Rectangular block: one reshape and a single slice assignment
+        width = field_counts[0]
+        out.set_region(0, row0, values.reshape(n_lines, width))
+    else:
+        for i in range(n_lines):
+            count = field_counts[i]
+            if count:
+                out.set_region(0, row0 + i, values[None, line_starts[i]:line_starts[i] + count])
+    return n_lines
+
+
+def read_csv_map(path, dtype=MAP_DTYPE, min_width=0, min_height=0, factory=new_tile_map, progress=None):
+    """Read a CSV map into a tile map created by factory(width, height, dtype).
+
+    The file is streamed twice in blocks: a cheap scan sizes the map, then
+    every block is parsed straight into it. Cells that are not valid
+    integers, or don't fit in dtype, are stored as 0. Rows shorter than the
+    widest row are padded with 0. The map is at least min_width x min_height,
+    and the number of rows and columns actually present in the file is
+    returned alongside it.
+
+    If given, progress(tile_map, rows, done, total) is called after each block
+    of either pass, with the map (None while scanning), the number of rows
+    filled in so far, and the bytes read of the file's total. Exceptions it
+    raises abort the read.
+    """
+    max_value = int(np.iinfo(dtype).max)
+    with open(path, "rb") as file:
+        total = os.fstat(file.fileno()).st_size
+        height, width = 0, 0
+        for block in _iter_line_blocks(file):
+            rows, cols = _block_shape(block)
+            height += rows
+            width = max(width, cols)
+            if progress is not None:
+                progress(None, 0, file.tell(), total)
+
+        out = factory(max(width, min_width), max(height, min_height), dtype)
+        if progress is not None:
+            progress(out, 0, 0, total)
+
+        file.seek(0)
+        row = 0
+        for block in _iter_line_blocks(file):
+            arr = _fast_bytes(block)
+            parsed = _parse_block(arr, out, row, max_value) if arr is not None else None
+            if parsed is not None:
+                row += parsed
+            else:
+                for values in _slow_rows(block):
+                    if values:
+                        out.set_region(0, row, [[v if v is not None and 0 <= v <= max_value else 0
+                                                 for v in values]])
+                    row += 1
+            if progress is not None:
+                progress(out, row, file.tell(), total)
+    return out, width, height
+
+
+def _digit_table(top):
+    """Return the ASCII digits of 0..top-1 left-aligned in a uint8 table, and their lengths"""
+    strings = np.array([str(i).encode() for i in range(top)])
+    table = np.frombuffer(strings.tobytes(), dtype=np.uint8).reshape(top, strings.dtype.itemsize)
+    return table, np.char.str_len(strings)
+
+
+def _row_blocks(source, block_cells):
+    """Yield (y, block) bands of a tile map or 2D array holding about block_cells cells"""
+    if isinstance(source, np.ndarray):
+        source = TileMap.from_array(source, source.dtype)
+    rows_per_block = max(1, block_cells // max(1, source.width))
+    return source.iter_row_blocks(rows_per_block)
+
+
+def write_csv_map(file, source, block_cells=CSV_WRITE_CELLS):
+    """Write a tile map (or 2D array) of non-negative tile IDs to a binary file as CSV.
+
+    Output matches csv.writer: comma separated with CRLF line endings. Cells
+    are formatted in blocks by scattering digits from a lookup table into a
+    byte buffer, without converting them to Python objects.
+    """
+    table, lengths = _digit_table(1)
+    for _, block in _row_blocks(source, block_cells):
+        rows, width = block.shape
+        if width == 0:
+            file.write(b"\r\n" * rows)
+            continue
+        top = int(block.max()) + 1
+        if top > len(lengths):
+            table, lengths = _digit_table(top)
+        cells = block.ravel()
+        cell_lengths = lengths[cells]
+
+        # Every cell is followed by ',' except the last of a row, which gets '\r\n'
+        field_lengths = cell_lengths + 1
+        field_lengths[width - 1::width] += 1
+        ends = np.cumsum(field_lengths)
+        starts = ends - field_lengths
+
+        out = np.full(ends[-1], _COMMA, dtype=np.uint8)
+        out[ends[width - 1::width] - 2] = _CARRIAGE
+        out[ends[width - 1::width] - 1] = _NEWLINE
+        out[starts] = table[cells, 0]
+        for k in range(1, table.shape[1]):
+            longer = np.flatnonzero(cell_lengths > k)
+            out[starts[longer] + k] = table[cells[longer], k]
+        file.write(out.tobytes())
+
+
+# Binary map format: a fixed little-endian header followed by the cell payload
+@contextlib.contextmanager
+def replacing_file(path):
+    """Open a temporary file next to path for binary writing, and move it over path
+    once it is fully written and flushed to disk. If writing fails, path is left
+    untouched, so a crash never leaves a truncated map behind."""
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_csv_map_file(path, source, block_cells=CSV_WRITE_CELLS):
+    """Write a tile map as a CSV file, replacing path atomically"""
+    with replacing_file(path) as file:
+        write_csv_map(file, source, block_cells)
+
+
+BINARY_MAP_EXT = ".tmap"
+BINARY_MAGIC = b"TMAP"
+BINARY_VERSION = 2
+BINARY_FLAG_ZLIB = 1
+BINARY_FLAG_SPARSE = 2  # Payload is a list of non-empty chunks (version 2)
+# magic, version, header size, width, height, dtype, flags, tile table hash, payload bytes
+_BINARY_HEADER = struct.Struct("<4sHHII8sI8sQ")
+# Sparse payloads start with the chunk size and count, then each chunk is its
+# (chunk_x, chunk_y) followed by chunk_size x chunk_size cells
+_SPARSE_PREFIX = struct.Struct("<IQ")
+_SPARSE_CHUNK = struct.Struct("<II")
+
+
+def is_binary_map_path(path):
+    return os.path.splitext(path)[1].lower() == BINARY_MAP_EXT
+
+
+def tile_table_hash(tile_types):
+    """Return an 8 byte fingerprint of a {tile_id: name} table"""
+    text = "\n".join(f"{tile_id}:{name}" for tile_id, name in sorted(tile_types.items()))
+    return hashlib.sha1(text.encode("utf-8")).digest()[:8]
+
+
+def _binary_payload(source, dtype, block_cells):
+    """Yield the payload bytes of a tile map (or 2D array) in the binary format"""
+    if getattr(source, "is_sparse", False):
+        chunks = sorted(source.iter_chunks())
+        yield _SPARSE_PREFIX.pack(source.chunk_size, len(chunks))
+        for (cx, cy), chunk in chunks:
+            yield _SPARSE_CHUNK.pack(cx, cy) + chunk.astype(dtype, copy=False).tobytes()
+        return
+    for _, block in _row_blocks(source, block_cells):
+        yield np.ascontiguousarray(block, dtype=dtype).tobytes()
+
+
+def write_binary_map(path, source, tile_hash=b"\0" * 8, compress=False, block_cells=CSV_WRITE_CELLS):
+    """Write a tile map (or 2D array) in the binary format, replacing path atomically.
+
+    Sparse maps are written as a list of their non-empty chunks. Replacing the
+    file (instead of rewriting it in place) keeps any memory mapping of the
+    previous version valid while it is still in use.
+    """
+    if isinstance(source, np.ndarray):
+        height, width = source.shape
+    else:
+        width, height = source.width, source.height
+    dtype = np.dtype(source.dtype).newbyteorder("<")
+    sparse = getattr(source, "is_sparse", False)
+    flags = (BINARY_FLAG_ZLIB if compress else 0) | (BINARY_FLAG_SPARSE if sparse else 0)
+    # Dense maps keep writing version 1 so older readers can still open them
+    version = BINARY_VERSION if sparse else 1
+
+    with replacing_file(path) as file:
+        file.write(b"\0" * _BINARY_HEADER.size)  # Filled in once the payload size is known
+        compressor = zlib.compressobj() if compress else None
+        payload = 0
+        for block in _binary_payload(source, dtype, block_cells):
+            if compressor is not None:
+                block = compressor.compress(block)
+            file.write(block)
+            payload += len(block)
+        if compressor is not None:
+            block = compressor.flush()
+            file.write(block)
+            payload += len(block)
+
+        file.seek(0)
+        file.write(_BINARY_HEADER.pack(BINARY_MAGIC, version, _BINARY_HEADER.size,
+                                       width, height, dtype.str.encode("ascii"), flags,
+                                       tile_hash, payload))
+
+
+def write_map_file(path, source, tile_hash=b"\0" * 8, compress=False):
+    """Write a map in the format picked by the file extension, replacing path atomically"""
+    if is_binary_map_path(path):
+        write_binary_map(path, source, tile_hash, compress)
+    else:
+        write_csv_map_file(path, source)
+
+
+# Maps with several layers keep the first layer in the map file, every other layer
+# in a file named after it ("map.decoration.csv") and the list of layers in a
+# manifest next to the map ("map.csv.layers.json")
+LAYER_MANIFEST_SUFFIX = ".layers.json"
+
+
+def layer_manifest_path(map_path):
+    return map_path + LAYER_MANIFEST_SUFFIX
+
+
+def layer_file_path(map_path, index, name):
+    """Path of the file holding a layer of the map at map_path"""
+    if index == 0:
+        return map_path
+    root, ext = os.path.splitext(map_path)
+    return f"{root}.{name}{ext}"
+
+
+def read_layer_manifest(map_path):
+    """Return the layers of a map as ([(name, path, visible)], active layer index),
+    or None for a map with a single layer (no manifest)"""
+    try:
+        with open(layer_manifest_path(map_path)) as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return None
+    try:
+        folder = os.path.dirname(map_path)
+        layers = [(str(layer["name"]), map_path if i == 0 else os.path.join(folder, layer["file"]),
+                   bool(layer.get("visible", True))) for i, layer in enumerate(manifest["layers"])]
+        active = int(manifest.get("active", 0))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Damaged layer manifest")
+    if not layers:
+        raise ValueError("Layer manifest lists no layers")
+    return layers, max(0, min(active, len(layers) - 1))
+
+
+def write_layer_manifest(map_path, layers, active):
+    """Write the manifest for layers given as [(name, visible)], replacing it
+    atomically; a single layer needs none, so any old manifest is deleted"""
+    if len(layers) == 1:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(layer_manifest_path(map_path))
+        return
+    entries = [{"name": name, "file": os.path.basename(layer_file_path(map_path, i, name)), "visible": visible}
+               for i, (name, visible) in enumerate(layers)]
+    with replacing_file(layer_manifest_path(map_path)) as file:
+        file.write(json.dumps({"layers": entries, "active": active}, indent=2).encode("utf-8"))
+
+
+def read_binary_header(file):
+    """Read and validate the header of a binary map, returning it as a dict"""
+    raw = file.read(_BINARY_HEADER.size)
+    if len(raw) < _BINARY_HEADER.size:
+        raise ValueError("Truncated map header")
+    magic, version, header_size, width, height, dtype, flags, tile_hash, payload = \
+        _BINARY_HEADER.unpack(raw)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Not a binary map file")
+    if version > BINARY_VERSION:
+        raise ValueError(f"Unsupported map format version {version}")
+    return {
+        "version": version,
+        "header_size": header_size,
+        "width": width,
+        "height": height,
+        "dtype": np.dtype(dtype.rstrip(b"\0").decode("ascii")),
+        "compressed": bool(flags & BINARY_FLAG_ZLIB),
+        "sparse": bool(flags & BINARY_FLAG_SPARSE),
+        "tile_hash": tile_hash,
+        "payload": payload,
+    }
+
+
+class _PayloadReader:
+    """Reads exact byte counts from a (possibly zlib-compressed) map payload"""
+    def __init__(self, file, compressed):
+        self.file = file
+        self.decompressor = zlib.decompressobj() if compressed else None
+        self.pending = b""
+
+    def read(self, size):
+        if self.decompressor is None:
+            data = self.file.read(size)
+        else:
+            parts = [self.pending]
+            have = len(self.pending)
+            while have < size:
+                tail = self.decompressor.unconsumed_tail
+                chunk = tail if tail else self.file.read(CSV_BLOCK_SIZE)
+                if not chunk:
+                    parts.append(self.decompressor.flush())
+                    break
+                # Bound each step's output so a corrupt payload can't balloon in memory
+                raw = self.decompressor.decompress(chunk, max(size - have, CSV_BLOCK_SIZE))
+                parts.append(raw)
+                have += len(raw)
+            data = b"".join(parts)
+            data, self.pending = data[:size], data[size:]
+        if len(data) != size:
+            raise ValueError("Map payload is shorter than its dimensions")
+        return data
+
+
+def _to_dtype(block, dtype):
+    """Convert tile IDs to the editor's storage type; IDs that don't fit become 0"""
+    if block.dtype == np.dtype(dtype):
+        return block
+    limit = np.iinfo(dtype).max
+    return np.where((block >= 0) & (block <= limit), block, 0).astype(dtype)
+
+
+def read_binary_map(path, dtype=MAP_DTYPE, mmap=True, factory=new_tile_map, block_cells=CSV_WRITE_CELLS,
+                    progress=None):
+    """Read a binary map, returning the tile map and the header dict.
+
+    Uncompressed dense maps stored with the requested dtype are memory-mapped
+    copy-on-write, so pages are only read when touched and edits never reach
+    the file until it is saved. Sparse maps load as a SparseTileMap; anything
+    else is streamed into a map created by factory(width, height, dtype).
+
+    progress is called like for read_csv_map while a map is streamed in; rows
+    is None for sparse maps, whose chunks can arrive in any order.
+    """
+    with open(path, "rb") as file:
+        total = os.fstat(file.fileno()).st_size
+        header = read_binary_header(file)
+        width, height = header["width"], header["height"]
+        stored = header["dtype"]
+        file.seek(header["header_size"])
+        reader = _PayloadReader(file, header["compressed"])
+
+        if header["sparse"]:
+            chunk_size, count = _SPARSE_PREFIX.unpack(reader.read(_SPARSE_PREFIX.size))
+            tile_map = SparseTileMap(width, height, dtype, chunk_size or SPARSE_CHUNK_SIZE)
+            cells = chunk_size * chunk_size
+            chunks_per_report = max(1, block_cells // cells)
+            for i in range(count):
+                cx, cy = _SPARSE_CHUNK.unpack(reader.read(_SPARSE_CHUNK.size))
+                chunk = np.frombuffer(reader.read(cells * stored.itemsize), dtype=stored)
+                tile_map.set_region(cx * chunk_size, cy * chunk_size,
+                                    _to_dtype(chunk.reshape(chunk_size, chunk_size), dtype))
+                if progress is not None and (i % chunks_per_report == 0 or i == count - 1):
+                    progress(tile_map, None, file.tell(), total)
+            return tile_map, header
+
+        expected = width * height * stored.itemsize
+        if not header["compressed"] and header["payload"] != expected:
+            raise ValueError("Map payload size does not match its dimensions")
+        if mmap and not header["compressed"] and stored == np.dtype(dtype).newbyteorder("<") and expected > 0:
+            data = np.memmap(path, dtype=stored, mode="c", offset=header["header_size"],
+                             shape=(height, width))
+            return TileMap.from_array(data, data.dtype), header
+
+        tile_map = factory(width, height, dtype)
+        rows_per_block = max(1, block_cells // max(1, width))
+        for y0 in range(0, height, rows_per_block):
+            rows = min(rows_per_block, height - y0)
+            band = np.frombuffer(reader.read(rows * width * stored.itemsize), dtype=stored)
+            tile_map.set_region(0, y0, _to_dtype(band.reshape(rows, width), dtype))
+            if progress is not None:
+                progress(tile_map, y0 + rows, file.tell(), total)
+    return tile_map, header
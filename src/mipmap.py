@@ -0,0 +1,190 @@
+import numpy as np
+
+# Side length (in pixels) of the square blocks each mip level is stored in
+MIP_BLOCK_SIZE = 64
+
+
+class MipPyramid:
+    """Downsampled color images of a tile map for level-of-detail rendering.
+
+    Level 0 has one pixel per cell (the average color of its tile) and is
+    computed straight from the map. Level k has one pixel per 2**k x 2**k
+    cells and is stored sparsely in MIP_BLOCK_SIZE square blocks; blocks
+    that would be entirely black (empty) are not stored.
+    """
+    def __init__(self, tile_map, colors):
+        self.tile_map = tile_map
+        self.colors = colors  # (max tile id + 1, 3) uint8 lookup table
+        self.packed_colors = _pack_colors(colors)
+        self.levels = [{}]  # levels[k] maps (block_x, block_y) -> block pixels
+        self.built = False
+
+    def set_source(self, tile_map, colors=None):
+        """Point the pyramid at a different map (or tile colors); it is rebuilt on next use"""
+        self.tile_map = tile_map
+        if colors is not None:
+            self.colors = colors
+            self.packed_colors = _pack_colors(colors)
+        self.invalidate()
+
+    def invalidate(self):
+        self.levels = [{}]
+        self.built = False
+
+    def level_count(self):
+        """Number of levels, the last one being a single block"""
+        size = max(self.tile_map.width, self.tile_map.height)
+        count = 1
+        while size > MIP_BLOCK_SIZE:
+            size = (size + 1) // 2
+            count += 1
+        return max(2, count)
+
+    def level_size(self, level):
+        return (-(-self.tile_map.width // (1 << level)), -(-self.tile_map.height // (1 << level)))
+
+    def ensure_built(self):
+        if not self.built:
+            self.rebuild()
+
+    def rebuild(self):
+        """Recompute every stored level from the map"""
+        self.levels = [{} for _ in range(self.level_count())]
+        self.built = True
+        size = MIP_BLOCK_SIZE
+
+        # Level 1 blocks that may contain anything: all of them for dense maps,
+        # only those over allocated chunks for sparse ones
+        if self.tile_map.is_sparse:
+            cells = self.tile_map.chunk_size
+            candidates = set()
+            # (a copy of the keys, as the map may still be loading on another thread)
+            for cx, cy in list(self.tile_map.chunks):
+                for bx in range(cx * cells // (2 * size), ((cx + 1) * cells - 1) // (2 * size) + 1):
+                    for by in range(cy * cells // (2 * size), ((cy + 1) * cells - 1) // (2 * size) + 1):
+                        candidates.add((bx, by))
+        else:
+            # Dense maps are built a whole band of blocks at a time
+            for level in range(1, len(self.levels)):
+                width, height = self.level_size(level)
+                for py in range(0, height, size):
+                    self._update_pixels(level, 0, py, width, py + size)
+            return
+
+        for level in range(1, len(self.levels)):
+            for bx, by in candidates:
+                self._update_pixels(level, bx * size, by * size, (bx + 1) * size, (by + 1) * size)
+            candidates = {(bx // 2, by // 2) for bx, by in self.levels[level]}
+
+    def update_cells(self, x0, y0, x1, y1):
+        """Refresh every level after the cells in [x0, x1) x [y0, y1) changed"""
+        if not self.built or x1 <= x0 or y1 <= y0:
+            return
+        for level in range(1, len(self.levels)):
+            self._update_pixels(level, x0 >> level, y0 >> level,
+                                ((x1 - 1) >> level) + 1, ((y1 - 1) >> level) + 1)
+
+    def update_cell_list(self, xs, ys):
+        """Refresh every level after the scattered cells at the coordinate arrays changed"""
+        if not self.built or len(xs) == 0:
+            return
+        # One update per block of cells touched, rather than per cell or over the bounding box
+        size = MIP_BLOCK_SIZE
+        for bx, by in set(zip((xs // size).tolist(), (ys // size).tolist())):
+            self.update_cells(bx * size, by * size, min((bx + 1) * size, self.tile_map.width),
+                              min((by + 1) * size, self.tile_map.height))
+
+    def resize(self):
+        """Follow a map resize, dropping blocks outside it and refreshing its edges"""
+        if not self.built:
+            return
+        old_count = len(self.levels)
+        count = self.level_count()
+        if count != old_count:
+            self.invalidate()
+            return
+        for level in range(1, count):
+            width, height = self.level_size(level)
+            for key in list(self.levels[level]):
+                bx, by = key
+                if bx * MIP_BLOCK_SIZE >= width or by * MIP_BLOCK_SIZE >= height:
+                    del self.levels[level][key]
+
+    def _update_pixels(self, level, px0, py0, px1, py1):
+        """Recompute the level pixels in [px0, px1) x [py0, py1) from the level below"""
+        width, height = self.level_size(level)
+        px1, py1 = min(px1, width), min(py1, height)
+        if px1 <= px0 or py1 <= py0:
+            return
+        below_width, below_height = self.level_size(level - 1)
+
+        # Average each 2x2 group of in-bounds children (the map's right and bottom
+        # edges may leave a group incomplete)
+        if level == 1:
+            # Straight from the map: look up each cell's color packed into one integer
+            # (10 bits per channel, enough for the sum of four) and add those up
+            cells = self.tile_map.region(2 * px0, 2 * py0, 2 * px1, 2 * py1)
+            padded = np.zeros((2 * (py1 - py0), 2 * (px1 - px0)), dtype=np.uint32)
+            padded[:cells.shape[0], :cells.shape[1]] = \
+                self.packed_colors[np.minimum(cells, len(self.packed_colors) - 1)]
+            packed = padded[0::2, 0::2] + padded[1::2, 0::2] + padded[0::2, 1::2] + padded[1::2, 1::2]
+            sums = np.stack([packed & 1023, (packed >> 10) & 1023, packed >> 20], axis=-1)
+        else:
+            children = self.pixels(level - 1, 2 * px0, 2 * py0, 2 * px1, 2 * py1)
+            padded = np.zeros((2 * (py1 - py0), 2 * (px1 - px0), 3), dtype=np.uint16)
+            padded[:children.shape[0], :children.shape[1]] = children
+            sums = padded[0::2, 0::2] + padded[1::2, 0::2] + padded[0::2, 1::2] + padded[1::2, 1::2]
+        cols = np.minimum(2, below_width - 2 * np.arange(px0, px1))
+        rows = np.minimum(2, below_height - 2 * np.arange(py0, py1))
+        counts = rows[:, None] * cols[None, :]
+        self._store(level, px0, py0, (sums // counts[..., None]).astype(np.uint8))
+
+    def _store(self, level, px0, py0, pixels):
+        blocks = self.levels[level]
+        size = MIP_BLOCK_SIZE
+        py1, px1 = py0 + pixels.shape[0], px0 + pixels.shape[1]
+        for by in range(py0 // size, (py1 - 1) // size + 1):
+            top, bottom = max(py0, by * size), min(py1, (by + 1) * size)
+            for bx in range(px0 // size, (px1 - 1) // size + 1):
+                left, right = max(px0, bx * size), min(px1, (bx + 1) * size)
+                part = pixels[top - py0:bottom - py0, left - px0:right - px0]
+                block = blocks.get((bx, by))
+                if block is None:
+                    if not part.any():
+                        continue
+                    block = blocks[(bx, by)] = np.zeros((size, size, 3), dtype=np.uint8)
+                block[top - by * size:bottom - by * size, left - bx * size:right - bx * size] = part
+                if not block.any():
+                    del blocks[(bx, by)]
+
+    def pixels(self, level, px0, py0, px1, py1):
+        """Return the (rows, columns, RGB) pixels of a level within [px0, px1) x [py0, py1)"""
+        width, height = self.level_size(level)
+        px0, py0 = max(0, px0), max(0, py0)
+        px1, py1 = min(px1, width), min(py1, height)
+        if level == 0:
+            cells = self.tile_map.region(px0, py0, px1, py1)
+            return self.colors[np.minimum(cells, len(self.colors) - 1)]
+
+        self.ensure_built()
+        out = np.zeros((max(0, py1 - py0), max(0, px1 - px0), 3), dtype=np.uint8)
+        if out.size == 0:
+            return out
+        blocks = self.levels[level]
+        size = MIP_BLOCK_SIZE
+        for by in range(py0 // size, (py1 - 1) // size + 1):
+            top, bottom = max(py0, by * size), min(py1, (by + 1) * size)
+            for bx in range(px0 // size, (px1 - 1) // size + 1):
+                block = blocks.get((bx, by))
+                if block is None:
+                    continue
+                left, right = max(px0, bx * size), min(px1, (bx + 1) * size)
+                out[top - py0:bottom - py0, left - px0:right - px0] = \
+                    block[top - by * size:bottom - by * size, left - bx * size:right - bx * size]
+        return out
+
+
+def _pack_colors(colors):
+    """Pack an (n, 3) color table into integers holding each channel in 10 bits"""
+    colors = colors.astype(np.uint32)
+    return colors[:, 0] | (colors[:, 1] << 10) | (colors[:, 2] << 20)
@@ -0,0 +1,159 @@
+import numpy as np
+
+# Flood fills with more row spans than this switch from a scanline fill to labelling
+SCANLINE_MAX_SPANS = 1000
+
+
+def line_cells(x0, y0, x1, y1):
+    """Return the (xs, ys) arrays of the cells on the line from (x0, y0) to (x1, y1),
+    one per step along the longer axis so fast strokes have no gaps"""
+    steps = max(abs(x1 - x0), abs(y1 - y0))
+    if steps == 0:
+        return np.array([x0], dtype=np.int64), np.array([y0], dtype=np.int64)
+    t = np.arange(steps + 1)
+    xs = x0 + np.floor((x1 - x0) * t / steps + 0.5).astype(np.int64)
+    ys = y0 + np.floor((y1 - y0) * t / steps + 0.5).astype(np.int64)
+    return xs, ys
+
+
+def polyline_cells(points):
+    """Return the (xs, ys) cells of the connected lines through a list of (x, y) cells"""
+    if len(points) == 1:
+        return line_cells(*points[0], *points[0])
+    parts = [line_cells(*a, *b) for a, b in zip(points, points[1:])]
+    return np.concatenate([xs for xs, _ in parts]), np.concatenate([ys for _, ys in parts])
+
+
+def stamp_block(old, block):
+    """Return the cells old (a block of the map) with block stamped over them;
+    empty cells of block leave the map's tiles showing through"""
+    return np.where(block != 0, block, old).astype(old.dtype, copy=False)
+
+
+def pattern_tiles(pattern, xs, ys):
+    """Tile IDs for painting the cells (xs, ys) with a pattern block, repeated
+    across the map from its top-left corner"""
+    height, width = pattern.shape
+    return pattern[ys % height, xs % width]
+
+
+def flood_fill_mask(tile_map, x, y, max_spans=SCANLINE_MAX_SPANS):
+    """Flood fill from (x, y) over 4-connected cells with the same tile ID.
+
+    Returns (x0, y0, mask) where mask is a boolean array covering the bounding box
+    of the filled cells with its top-left corner at (x0, y0). Small areas use a
+    scanline fill; areas with more than max_spans row spans (big or ragged ones)
+    are labelled as a whole with array operations instead.
+    """
+    target = tile_map.get(x, y)
+    spans = _scanline_spans(tile_map, x, y, target, max_spans)
+    if spans is None:
+        return _run_fill_mask(tile_map, x, y, target)
+
+    top = min(sy for sy, _, _ in spans)
+    bottom = max(sy for sy, _, _ in spans) + 1
+    left = min(x0 for _, x0, _ in spans)
+    right = max(x1 for _, _, x1 in spans)
+    mask = np.zeros((bottom - top, right - left), dtype=bool)
+    for sy, x0, x1 in spans:
+        mask[sy - top, x0 - left:x1 - left] = True
+    return left, top, mask
+
+
+def _scanline_spans(tile_map, x, y, target, max_spans):
+    """Return the (y, x0, x1) row spans of the area, or None once there are too many"""
+    width, height = tile_map.width, tile_map.height
+    rows = {}  # y -> boolean row of cells still to fill
+
+    def row_mask(row_y):
+        row = rows.get(row_y)
+        if row is None:
+            row = rows[row_y] = tile_map.region(0, row_y, width, row_y + 1)[0] == target
+        return row
+
+    spans = []
+    stack = [(x, y)]
+    while stack:
+        sx, sy = stack.pop()
+        row = row_mask(sy)
+        if not row[sx]:
+            continue
+        if len(spans) >= max_spans:
+            return None
+
+        # Extend the span to the first non-matching cell on each side
+        right = row[sx:]
+        k = int(right.argmin())
+        x1 = sx + k if not right[k] else width
+        left = row[sx::-1]
+        k = int(left.argmin())
+        x0 = sx - k + 1 if not left[k] else 0
+        row[x0:x1] = False
+        spans.append((sy, x0, x1))
+
+        # Seed one point per run of matching cells in the rows above and below
+        for ny in (sy - 1, sy + 1):
+            if 0 <= ny < height:
+                part = row_mask(ny)[x0:x1]
+                if part.any():
+                    starts = np.flatnonzero(np.diff(part, prepend=False) & part)
+                    stack.extend((x0 + int(s), ny) for s in starts)
+    return spans
+
+
+def _run_fill_mask(tile_map, x, y, target):
+    """Flood fill by labelling the runs of matching cells in every row: runs that
+    overlap in neighbouring rows are joined, and the runs joined to the run under
+    (x, y) form the filled area."""
+    width, height = tile_map.width, tile_map.height
+    stride = width + 1
+
+    # A zero column after each row keeps runs from wrapping onto the next row, so
+    # runs can be found in the flattened map and keyed by row * stride + column
+    cells = np.zeros((height, stride), dtype=np.int8)
+    cells[:, :width] = tile_map.region(0, 0, width, height) == target
+    edges = np.diff(cells.ravel(), prepend=np.int8(0))
+    del cells
+    start_keys = np.flatnonzero(edges == 1)
+    end_keys = np.flatnonzero(edges == -1)
+    del edges
+
+    # The runs of the row above that overlap each run form a contiguous range
+    lo = np.searchsorted(end_keys, start_keys - stride, side="right")
+    hi = np.searchsorted(start_keys, end_keys - stride, side="left")
+    counts = np.maximum(hi - lo, 0)
+    run_b = np.repeat(np.arange(len(start_keys)), counts)
+    run_a = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(len(run_b))
+
+    # Connected components: hook roots onto smaller neighbouring roots, then shorten
+    # the label chains by pointer jumping, until no two joined runs differ. Runs that
+    # share a label keep sharing it, so their pairs drop out as the labels merge.
+    labels = np.arange(len(start_keys))
+    while True:
+        label_a, label_b = labels[run_a], labels[run_b]
+        joined = label_a != label_b
+        if not joined.any():
+            break
+        run_a, run_b = run_a[joined], run_b[joined]
+        label_a, label_b = label_a[joined], label_b[joined]
+        labels[np.maximum(label_a, label_b)] = np.minimum(label_a, label_b)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+    seed = np.searchsorted(start_keys, y * stride + x, side="right") - 1
+    selected = np.flatnonzero(labels == labels[seed])
+    start_keys, end_keys = start_keys[selected], end_keys[selected]
+
+    # Rasterize the selected runs into a mask of their bounding box (runs in a row
+    # never touch, so start and end marks never land on the same cell)
+    rows, starts, ends = start_keys // stride, start_keys % stride, end_keys % stride
+    top, left = int(rows[0]), int(starts.min())
+    mask_height, mask_width = int(rows[-1]) + 1 - top, int(ends.max()) - left
+    marks = np.zeros(mask_height * (mask_width + 1), dtype=np.int8)
+    marks[(rows - top) * (mask_width + 1) + starts - left] = 1
+    marks[(rows - top) * (mask_width + 1) + ends - left] = -1
+    mask = np.cumsum(marks, dtype=np.int8).reshape(mask_height, mask_width + 1)[:, :-1] > 0
+    return left, top, mask
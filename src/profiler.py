@@ -0,0 +1,186 @@
+import json
+import time
+from collections import deque
+import numpy as np
+
+# Frames kept for the rolling percentiles
+PROFILE_WINDOW = 300
+# Frames kept for trace dumps
+PROFILE_TRACE_FRAMES = 1200
+# Phases of a frame, in the order they usually run. "idle" (waiting for events)
+# and "sleep" (frame rate limiting) are timed but don't count as frame time.
+PROFILE_PHASES = ("idle", "events", "scroll", "draw_grid", "draw_ui", "flip", "sleep")
+PROFILE_IDLE_PHASES = ("idle", "sleep")
+# Per-frame counters, taken as differences between the editor's running totals
+PROFILE_COUNTERS = ("tiles_blitted", "chunks_blitted", "chunk_hits", "chunk_misses",
+                    "tile_cache_hits", "tile_cache_misses")
+
+
+class FrameProfiler:
+    """Times the phases of each frame of the editor loop.
+
+    The loop calls begin_frame(), then mark(phase) as each phase ends (a phase
+    may run several times per frame, e.g. once per dirty rectangle; its times
+    add up), then end_frame(). The last PROFILE_WINDOW frames are kept for
+    percentiles and the last PROFILE_TRACE_FRAMES as a trace that can be dumped
+    in the Chrome trace event format (chrome://tracing, Perfetto).
+    """
+    def __init__(self, window=PROFILE_WINDOW, trace_frames=PROFILE_TRACE_FRAMES):
+        self.phase_index = {phase: i for i, phase in enumerate(PROFILE_PHASES)}
+        busy = [phase not in PROFILE_IDLE_PHASES for phase in PROFILE_PHASES]
+        self.busy_phases = np.array(busy)
+        self.times = np.zeros((window, len(PROFILE_PHASES)))  # seconds, ring buffer
+        self.counts = np.zeros((window, len(PROFILE_COUNTERS)), dtype=np.int64)
+        self.starts = np.zeros(window)  # frame start times, for the frame rate
+        self.frames = 0
+        self.trace = deque(maxlen=trace_frames)  # (frame start, [(phase, start, duration)])
+        self.origin = time.perf_counter()
+        self.frame_start = None
+        self.last_mark = None
+        self.segments = None
+        self.frame_times = None
+        self.last_counters = None
+        self.overlay_visible = False
+
+    def begin_frame(self):
+        self.frame_start = self.last_mark = time.perf_counter()
+        self.segments = []
+        self.frame_times = [0.0] * len(PROFILE_PHASES)
+
+    def mark(self, phase):
+        """End the current phase: the time since the last mark is charged to it"""
+        now = time.perf_counter()
+        self.frame_times[self.phase_index[phase]] += now - self.last_mark
+        self.segments.append((phase, self.last_mark, now - self.last_mark))
+        self.last_mark = now
+
+    def end_frame(self, counters):
+        """Store the frame's phase times. counters holds the editor's running totals
+        of PROFILE_COUNTERS; the frame is charged with their change since last frame."""
+        totals = [counters[name] for name in PROFILE_COUNTERS]
+        if self.last_counters is None:
+            self.last_counters = totals
+        slot = self.frames % len(self.times)
+        self.times[slot] = self.frame_times
+        self.counts[slot] = [total - last for total, last in zip(totals, self.last_counters)]
+        self.starts[slot] = self.frame_start
+        self.last_counters = totals
+        self.frames += 1
+        self.trace.append((self.frame_start, self.segments))
+
+    def window(self):
+        """Return the (phase times, counts, start times) of the frames in the window"""
+        n = min(self.frames, len(self.times))
+        return self.times[:n], self.counts[:n], self.starts[:n]
+
+    def summary(self):
+        """Percentiles and totals over the rolling window, as a dict (None before any frame)"""
+        times, counts, starts = self.window()
+        if len(times) == 0:
+            return None
+        frame_times = times[:, self.busy_phases].sum(axis=1)
+        span = starts.max() - starts.min()
+        totals = dict(zip(PROFILE_COUNTERS, counts.sum(axis=0).tolist()))
+        p50, p99 = np.percentile(frame_times, [50, 99])
+        return {
+            "frames": len(times),
+            "fps": (len(times) - 1) / span if span > 0 else 0.0,
+            "frame_p50": p50,
+            "frame_p99": p99,
+            "frame_max": frame_times.max(),
+            "phases": {phase: tuple(np.percentile(times[:, i], [50, 99]))
+                       for i, phase in enumerate(PROFILE_PHASES) if self.busy_phases[i]},
+            "counters": {name: total / len(times) for name, total in totals.items()},
+            "chunk_hit_rate": _rate(totals["chunk_hits"], totals["chunk_misses"]),
+            "tile_cache_hit_rate": _rate(totals["tile_cache_hits"], totals["tile_cache_misses"]),
+        }
+
+    def overlay_lines(self):
+        """Text lines for the on-screen overlay"""
+        stats = self.summary()
+        if stats is None:
+            return ["Profiler: no frames yet"]
+        counters = stats["counters"]
+        lines = [
+            f"FPS {stats['fps']:.1f}  frame p50 {stats['frame_p50'] * 1000:.2f} ms  "
+            f"p99 {stats['frame_p99'] * 1000:.2f} ms  max {stats['frame_max'] * 1000:.2f} ms",
+        ]
+        for phase, (p50, p99) in stats["phases"].items():
+            lines.append(f"{phase:<10} p50 {p50 * 1000:7.2f} ms  p99 {p99 * 1000:7.2f} ms")
+        lines.append(f"tiles blitted {counters['tiles_blitted']:.0f}/frame  "
+                     f"chunks blitted {counters['chunks_blitted']:.0f}/frame")
+        lines.append(f"chunk cache hits {_percent(stats['chunk_hit_rate'])}  "
+                     f"tile cache hits {_percent(stats['tile_cache_hit_rate'])}")
+        return lines
+
+    def dump_trace(self, path):
+        """Write the recorded frames as a Chrome trace event file"""
+        events = []
+        for frame, (start, segments) in enumerate(self.trace):
+            events.append({"name": "frame", "ph": "i", "s": "t", "pid": 1, "tid": 1,
+                           "ts": (start - self.origin) * 1e6, "args": {"frame": frame}})
+            for phase, phase_start, duration in segments:
+                events.append({"name": phase, "ph": "X", "pid": 1, "tid": 1,
+                               "ts": (phase_start - self.origin) * 1e6, "dur": duration * 1e6})
+        stats = self.summary()
+        if stats is not None:
+            stats["phases"] = {phase: list(values) for phase, values in stats["phases"].items()}
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"summary": stats}}, file)
+        return len(self.trace)
+
+
+class StartupTimer:
+    """Times the steps of startup up to the first frame, and the initial map load
+    that runs alongside them"""
+    def __init__(self, start, target):
+        self.start = start  # perf_counter() at the start of the process's imports
+        self.target = target  # seconds to first frame
+        self.last = start
+        self.phases = []  # (name, seconds)
+        self.first_frame = None
+        self.map_start = None
+        self.map_load = None  # (seconds, status)
+
+    def mark(self, phase, now=None):
+        """End a phase: the time since the last mark is charged to it"""
+        now = time.perf_counter() if now is None else now
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def frame_shown(self):
+        self.mark("first frame")
+        self.first_frame = self.last - self.start
+
+    def map_started(self):
+        self.map_start = time.perf_counter()
+
+    def map_finished(self, status):
+        if self.map_start is not None and self.map_load is None:
+            self.map_load = (time.perf_counter() - self.map_start, status)
+
+    @property
+    def done(self):
+        return self.first_frame is not None and (self.map_start is None or self.map_load is not None)
+
+    def report(self):
+        lines = ["Startup times:"]
+        lines += [f"  {phase:<20}{seconds * 1000:9.1f} ms" for phase, seconds in self.phases]
+        if self.first_frame is not None:
+            verdict = "OK" if self.first_frame <= self.target else "OVER TARGET"
+            lines.append(f"  {'time to first frame':<20}{self.first_frame * 1000:9.1f} ms "
+                         f"(target {self.target * 1000:.0f} ms: {verdict})")
+        if self.map_load is not None:
+            seconds, status = self.map_load
+            lines.append(f"  {'map load':<20}{seconds * 1000:9.1f} ms ({status}, in the background)")
+        elif self.map_start is not None:
+            lines.append("  map load            still running")
+        return "\n".join(lines)
+
+
+def _rate(hits, misses):
+    return hits / (hits + misses) if hits + misses else None
+
+
+def _percent(rate):
+    return "-" if rate is None else f"{rate:.0%}"
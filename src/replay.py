@@ -0,0 +1,97 @@
+"""Headless replay of editor sessions recorded with "main.py --record FILE".
+
+Plays the recorded input back frame by frame on SDL's dummy video driver, as
+fast as it will go, and prints the frame time distribution and a checksum of
+the final map, checked against the one the recorded session ended with:
+
+    python src/main.py --record session.jsonl
+    ... edit, then quit ...
+    python src/replay.py session.jsonl
+
+Each frame gets the same events, held keys, mouse position, dialog answers and
+clock as when it was recorded, and waits for the loads and saves that finished
+during it, so a replay ends on the same map. Replays read and write the files
+the session did (relative to the current directory), so replay checked-in
+sessions on a fresh copy of their maps. The exit status is 1 if the final map
+differs from the recording's, or if the p99 frame time is over --max-p99.
+"""
+import os
+import sys
+import json
+import argparse
+
+# Draw into memory instead of a window (set before pygame is imported)
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from main import TileEditor
+from session import SessionPlayer, frame_time_stats
+
+
+def replay_session(path):
+    """Replay the recording at path, returning the results as a dict"""
+    player = SessionPlayer(path)
+    settings = player.settings
+    editor = TileEditor(always_redraw=settings["always_redraw"], undo_bytes=settings["undo_bytes"],
+                        autosave_interval=settings["autosave"])
+    editor.replay = player
+    editor.run()
+    checksum = editor.map_checksum()
+    unplayed = player.finish()
+    expected = player.end["checksum"]
+    return {
+        "session": path,
+        "frames": frame_time_stats(player.times),
+        "recorded_frames": frame_time_stats(player.recorded_times),
+        "checksum": checksum,
+        "expected_checksum": expected,
+        "checksum_ok": checksum == expected,
+        "unplayed_frames": unplayed,
+    }
+
+
+def report_lines(result):
+    lines = [f"Replayed {result['session']}"]
+    for label, key in (("replay", "frames"), ("recorded", "recorded_frames")):
+        stats = result[key]
+        if stats["frames"]:
+            lines.append(f"  {label:<9}{stats['frames']:6d} frames  p50 {stats['p50'] * 1000:7.2f} ms  "
+                         f"p90 {stats['p90'] * 1000:7.2f} ms  p99 {stats['p99'] * 1000:7.2f} ms  "
+                         f"max {stats['max'] * 1000:7.2f} ms  total {stats['total']:.2f}s")
+    if result["unplayed_frames"]:
+        lines.append(f"  the replay quit {result['unplayed_frames']} frames before the recording ended")
+    lines.append(f"  map checksum {result['checksum']}")
+    if result["expected_checksum"] is None:
+        lines.append("  the recording has no final checksum (it didn't end cleanly)")
+    elif not result["checksum_ok"]:
+        lines.append(f"  MISMATCH: the recorded session ended with {result['expected_checksum']}")
+    return lines
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded editor session headlessly")
+    parser.add_argument("session", help="recording made with main.py --record")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--max-p99", type=float, metavar="MS",
+                        help="fail if the replay's p99 frame time is over this many milliseconds")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = replay_session(args.session)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print("\n".join(report_lines(result)))
+
+    failed = not result["checksum_ok"] or result["unplayed_frames"] > 0
+    stats = result["frames"]
+    if args.max_p99 is not None and stats["frames"] and stats["p99"] * 1000 > args.max_p99:
+        print(f"p99 frame time {stats['p99'] * 1000:.2f} ms is over the {args.max_p99:g} ms limit")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import json
+import hashlib
+import numpy as np
+import pygame as pg
+
+# Session recordings: a JSON lines file with a header, one line per frame of the
+# editor loop and an end line. A frame holds the input events handled in it, the
+# key and mouse state polled during it, the answers of any dialogs it opened and
+# the background results it picked up, so replaying the frames in order repeats
+# the session exactly.
+SESSION_VERSION = 1
+# Input events that are recorded, with the attributes the editor reads
+RECORDED_EVENTS = {
+    pg.QUIT: (),
+    pg.KEYDOWN: ("key", "mod", "unicode", "scancode"),
+    pg.KEYUP: ("key", "mod", "unicode", "scancode"),
+    pg.MOUSEBUTTONDOWN: ("pos", "button"),
+    pg.MOUSEBUTTONUP: ("pos", "button"),
+    pg.MOUSEMOTION: ("pos", "rel", "buttons"),
+    pg.VIDEOEXPOSE: (),
+    pg.WINDOWEXPOSED: (),
+    pg.WINDOWRESTORED: (),
+}
+_EVENT_TYPES = {pg.event.event_name(event_type): event_type for event_type in RECORDED_EVENTS}
+# Cells hashed at a time by map_checksum
+CHECKSUM_BAND_CELLS = 1 << 22
+
+
+class SessionRecorder:
+    """Writes the frames of an editor session to a recording file.
+
+    The editor loop calls begin_frame() with the frame's events and polled input
+    state, answer() for each dialog answer and end_frame() once the frame is
+    drawn. markers maps the event types of background results (loads, saves, ...)
+    to the names they are recorded under.
+    """
+    def __init__(self, path, ticks, settings, markers):
+        self.file = open(path, "w")
+        self.markers = markers
+        self.frames = 0
+        self.frame = None
+        self._write({"version": SESSION_VERSION, "ticks": ticks, "settings": settings})
+
+    def begin_frame(self, events, mods, keys, mouse):
+        recorded = []
+        for event in events:
+            if event.type in self.markers:
+                recorded.append([self.markers[event.type]])
+            elif event.type in RECORDED_EVENTS:
+                recorded.append(encode_event(event))
+        self.frame = {"events": recorded, "mods": mods, "keys": keys, "mouse": list(mouse), "answers": []}
+
+    def answer(self, value):
+        self.frame["answers"].append(value)
+
+    def end_frame(self, ticks, seconds):
+        """Write the frame; ticks is its time (pg.time.get_ticks()), seconds how long it took"""
+        self.frame["ticks"] = ticks
+        self.frame["ms"] = round(seconds * 1000, 3)
+        self._write(self.frame)
+        self.frames += 1
+        self.frame = None
+
+    def close(self, checksum):
+        self._write({"end": True, "frames": self.frames, "checksum": checksum})
+        self.file.close()
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+class SessionPlayer:
+    """Reads a recording back a frame at a time, and collects the replay's frame times"""
+    def __init__(self, path):
+        self.file = open(path)
+        header = json.loads(self.file.readline() or "null")
+        if not isinstance(header, dict) or header.get("version") != SESSION_VERSION:
+            raise ValueError(f"{path} is not a version {SESSION_VERSION} session recording")
+        self.ticks = header["ticks"]
+        self.settings = header["settings"]
+        self.frame = _idle_frame()
+        self.end = None  # The recording's end line, once reached
+        self.recorded_times = []  # Seconds, of the frames replayed so far
+        self.times = []
+
+    def next_frame(self):
+        """Return the next frame, or None at the end of the recording. Answers are
+        taken from it in order by answer()."""
+        line = self.file.readline()
+        record = json.loads(line) if line.strip() else {"end": True, "frames": None, "checksum": None}
+        if record.get("end"):
+            self.end = record
+            self.file.close()
+            self.frame = _idle_frame()
+            return None
+        self.frame = record
+        self.ticks = record["ticks"]
+        self.recorded_times.append(record["ms"] / 1000)
+        return record
+
+    def finish(self):
+        """Read up to the end of the recording once the replay has quit, returning
+        how many recorded frames were left unplayed (0 unless the replay diverged)"""
+        left = 0
+        while self.end is None:
+            left += self.next_frame() is not None
+        if left:
+            del self.recorded_times[-left:]
+        return left
+
+    def answer(self):
+        if not self.frame["answers"]:
+            raise ValueError("The replay opened a dialog the recording has no answer for")
+        return self.frame["answers"].pop(0)
+
+    def frame_done(self, seconds):
+        self.times.append(seconds)
+
+
+def encode_event(event):
+    record = [pg.event.event_name(event.type)]
+    attributes = {}
+    for name in RECORDED_EVENTS[event.type]:
+        value = getattr(event, name, None)
+        attributes[name] = list(value) if isinstance(value, tuple) else value
+    if attributes:
+        record.append(attributes)
+    return record
+
+
+def decode_event(record):
+    """The pygame event of a recorded input event"""
+    attributes = record[1] if len(record) > 1 else {}
+    attributes = {name: tuple(value) if isinstance(value, list) else value for name, value in attributes.items()}
+    return pg.event.Event(_EVENT_TYPES[record[0]], attributes)
+
+
+def map_checksum(layers):
+    """SHA-256 (hex) of the contents of layers, given as (name, visible, tile map).
+    Dense and sparse maps with the same cells hash the same."""
+    digest = hashlib.sha256()
+    for name, visible, tile_map in layers:
+        digest.update(json.dumps([name, bool(visible), tile_map.width, tile_map.height]).encode("utf-8"))
+        rows = max(1, CHECKSUM_BAND_CELLS // max(1, tile_map.width))
+        for y0 in range(0, tile_map.height, rows):
+            band = tile_map.region(0, y0, tile_map.width, min(y0 + rows, tile_map.height))
+            digest.update(np.ascontiguousarray(band, dtype="<u2").tobytes())
+    return digest.hexdigest()
+
+
+def frame_time_stats(times):
+    """Frame count and p50/p90/p99/max/mean/total frame times (in seconds) of times"""
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) == 0:
+        return {"frames": 0}
+    p50, p90, p99 = np.percentile(times, [50, 90, 99])
+    return {"frames": len(times), "p50": p50, "p90": p90, "p99": p99, "max": times.max(),
+            "mean": times.mean(), "total": times.sum()}
+
+
+def _idle_frame():
+    """Input state outside the recorded frames: nothing held or answered"""
+    return {"events": [], "mods": 0, "keys": [], "mouse": [0, 0], "answers": []}
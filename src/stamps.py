@@ -0,0 +1,33 @@
+import os
+import numpy as np
+from tilemap import TileMap, MAP_DTYPE
+from mapio import read_binary_map, write_map_file, BINARY_MAP_EXT
+
+# Saved stamps (reusable blocks of tiles, like a building or a room), one
+# compressed binary map file per stamp
+STAMP_DIR = os.path.join("assets", "stamps")
+
+
+def stamp_path(name, stamp_dir=STAMP_DIR):
+    return os.path.join(stamp_dir, name + BINARY_MAP_EXT)
+
+
+def stamp_names(stamp_dir=STAMP_DIR):
+    """Names of the saved stamps, sorted"""
+    try:
+        files = os.listdir(stamp_dir)
+    except FileNotFoundError:
+        return []
+    return sorted(file[:-len(BINARY_MAP_EXT)] for file in files if file.endswith(BINARY_MAP_EXT))
+
+
+def save_stamp(name, block, tile_hash, stamp_dir=STAMP_DIR):
+    """Save a 2D block of tile IDs as a stamp, replacing any stamp of that name"""
+    os.makedirs(stamp_dir, exist_ok=True)
+    write_map_file(stamp_path(name, stamp_dir), TileMap.from_array(block, MAP_DTYPE), tile_hash, compress=True)
+
+
+def load_stamp(name, stamp_dir=STAMP_DIR):
+    """Return a saved stamp as (block of tile IDs, tile table hash it was saved with)"""
+    tile_map, header = read_binary_map(stamp_path(name, stamp_dir), MAP_DTYPE, mmap=False)
+    return np.array(tile_map.region(0, 0, tile_map.width, tile_map.height)), header["tile_hash"]
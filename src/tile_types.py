@@ -0,0 +1,14 @@
+'''
+This dictionary maps tile IDs to their names.
+You can add more tiles as needed.
+0: "empty" is a special tile that represents no tile. 
+    When you right click on a tile, it will be set to this ID.
+
+Tiles are loaded from the "assets" directory as PNG images.    
+'''
+TILE_TYPES = {
+    0: "empty",
+    1: "grass",
+    2: "water",
+    3: "dirt"
+}
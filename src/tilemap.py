@@ -0,0 +1,352 @@
+import numpy as np
+
+# Default storage type for tile IDs (supports up to 65535 tile types)
+MAP_DTYPE = np.uint16
+# Maps with more cells than this are stored sparsely (only painted chunks take memory)
+SPARSE_MAP_CELLS = 64 * 1024 * 1024
+# Side length of the square chunks a sparse map is made of
+SPARSE_CHUNK_SIZE = 64
+
+
+class TileMap:
+    """Compact 2D grid of tile IDs stored in a typed NumPy array (indexed [y, x])"""
+    is_sparse = False
+
+    def __init__(self, width, height, dtype=MAP_DTYPE):
+        self.data = np.zeros((height, width), dtype=dtype)
+
+    @classmethod
+    def from_array(cls, array, dtype=None):
+        """Wrap an existing 2D array (rows of tile IDs) without copying it if possible"""
+        tile_map = cls.__new__(cls)
+        tile_map.data = np.asarray(array, dtype=dtype if dtype is not None else MAP_DTYPE)
+        if tile_map.data.ndim != 2:
+            raise ValueError("Map data must be two dimensional")
+        return tile_map
+
+    @property
+    def width(self):
+        return self.data.shape[1]
+
+    @property
+    def height(self):
+        return self.data.shape[0]
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get(self, x, y):
+        return int(self.data[y, x])
+
+    def set(self, x, y, tile_id):
+        self.data[y, x] = tile_id
+
+    def get_cells(self, xs, ys):
+        """Return the tile IDs at the given coordinate arrays"""
+        return self.data[ys, xs]
+
+    def set_cells(self, xs, ys, tile_ids):
+        """Set the cells at the given coordinate arrays (later duplicates win)"""
+        self.data[ys, xs] = tile_ids
+
+    def region(self, x0, y0, x1, y1):
+        """Return a view of the cells in [x0, x1) x [y0, y1)"""
+        return self.data[y0:y1, x0:x1]
+
+    def set_region(self, x0, y0, block):
+        """Copy a 2D block of tile IDs into the map with its top-left corner at (x0, y0)"""
+        block = np.asarray(block)
+        self.data[y0:y0 + block.shape[0], x0:x0 + block.shape[1]] = block
+
+    def rows(self):
+        """Iterate over the map rows as lists of ints"""
+        for row in self.data:
+            yield row.tolist()
+
+    def iter_row_blocks(self, rows_per_block):
+        """Yield (y, block) pairs covering the map in horizontal bands"""
+        for y0 in range(0, self.height, rows_per_block):
+            yield y0, self.data[y0:y0 + rows_per_block]
+
+    def clear(self, tile_id=0):
+        self.data.fill(tile_id)
+
+    def resize(self, new_width, new_height):
+        """Resize in place, keeping the overlapping top-left region"""
+        if new_width == self.width and new_height == self.height:
+            return
+        new_data = np.zeros((new_height, new_width), dtype=self.data.dtype)
+        keep_h = min(self.height, new_height)
+        keep_w = min(self.width, new_width)
+        new_data[:keep_h, :keep_w] = self.data[:keep_h, :keep_w]
+        self.data = new_data
+
+    def is_memory_mapped(self):
+        return isinstance(self.data, np.memmap) or isinstance(self.data.base, np.memmap)
+
+    def load_into_memory(self):
+        """Replace a memory-mapped array with an in-memory copy"""
+        if self.is_memory_mapped():
+            self.data = np.array(self.data)
+
+    def copy(self):
+        return TileMap.from_array(self.data.copy(), self.data.dtype)
+
+    def max_tile_id(self):
+        """Largest tile ID that fits in the storage type"""
+        return int(np.iinfo(self.data.dtype).max)
+
+
+class SparseTileMap:
+    """Tile map that only stores the SPARSE_CHUNK_SIZE square chunks containing
+    non-empty tiles. Unallocated chunks read as 0 and chunks that become
+    entirely empty are freed, so memory scales with the painted area."""
+    is_sparse = True
+
+    def __init__(self, width, height, dtype=MAP_DTYPE, chunk_size=SPARSE_CHUNK_SIZE):
+        self.width = width
+        self.height = height
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.chunks = {}  # (chunk_x, chunk_y) -> chunk_size x chunk_size array
+
+    @classmethod
+    def from_tile_map(cls, tile_map, chunk_size=SPARSE_CHUNK_SIZE):
+        """Build a sparse copy of any tile map, skipping empty chunks"""
+        sparse = cls(tile_map.width, tile_map.height, tile_map.dtype, chunk_size)
+        for y0 in range(0, tile_map.height, chunk_size):
+            band = tile_map.region(0, y0, tile_map.width, y0 + chunk_size)
+            for x0 in range(0, tile_map.width, chunk_size):
+                block = band[:, x0:x0 + chunk_size]
+                if block.any():
+                    sparse.set_region(x0, y0, block)
+        return sparse
+
+    @property
+    def nbytes(self):
+        return len(self.chunks) * self.chunk_size * self.chunk_size * self.dtype.itemsize
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def _new_chunk(self):
+        return np.zeros((self.chunk_size, self.chunk_size), dtype=self.dtype)
+
+    def get(self, x, y):
+        size = self.chunk_size
+        chunk = self.chunks.get((x // size, y // size))
+        return 0 if chunk is None else int(chunk[y % size, x % size])
+
+    def set(self, x, y, tile_id):
+        size = self.chunk_size
+        key = (x // size, y // size)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            if tile_id == 0:
+                return
+            chunk = self.chunks[key] = self._new_chunk()
+        chunk[y % size, x % size] = tile_id
+        if tile_id == 0 and not chunk.any():
+            del self.chunks[key]
+
+    def _group_by_chunk(self, xs, ys):
+        """Yield (key, indices) for the coordinates falling in each chunk"""
+        size = self.chunk_size
+        xs, ys = np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+        keys = (ys // size) * (-(-self.width // size)) + xs // size
+        order = np.argsort(keys, kind="stable")
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+        for indices in np.split(order, bounds):
+            if len(indices):
+                yield (int(xs[indices[0]]) // size, int(ys[indices[0]]) // size), indices
+
+    def get_cells(self, xs, ys):
+        """Return the tile IDs at the given coordinate arrays"""
+        size = self.chunk_size
+        xs, ys = np.asarray(xs), np.asarray(ys)
+        out = np.zeros(len(xs), dtype=self.dtype)
+        for key, indices in self._group_by_chunk(xs, ys):
+            chunk = self.chunks.get(key)
+            if chunk is not None:
+                out[indices] = chunk[ys[indices] % size, xs[indices] % size]
+        return out
+
+    def set_cells(self, xs, ys, tile_ids):
+        """Set the cells at the given coordinate arrays (later duplicates win)"""
+        size = self.chunk_size
+        xs, ys = np.asarray(xs), np.asarray(ys)
+        tile_ids = np.broadcast_to(np.asarray(tile_ids, dtype=self.dtype), (len(xs),))
+        for key, indices in self._group_by_chunk(xs, ys):
+            values = tile_ids[indices]
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                if not values.any():
+                    continue
+                chunk = self.chunks[key] = self._new_chunk()
+            chunk[ys[indices] % size, xs[indices] % size] = values
+            if not chunk.any():
+                del self.chunks[key]
+
+    def _overlapping_chunks(self, x0, y0, x1, y1):
+        """Yield (key, chunk slice, region slice) for each chunk overlapping [x0, x1) x [y0, y1)"""
+        size = self.chunk_size
+        for cy in range(y0 // size, (y1 - 1) // size + 1):
+            top, bottom = max(y0, cy * size), min(y1, (cy + 1) * size)
+            for cx in range(x0 // size, (x1 - 1) // size + 1):
+                left, right = max(x0, cx * size), min(x1, (cx + 1) * size)
+                yield ((cx, cy),
+                       (slice(top - cy * size, bottom - cy * size), slice(left - cx * size, right - cx * size)),
+                       (slice(top - y0, bottom - y0), slice(left - x0, right - x0)))
+
+    def region(self, x0, y0, x1, y1):
+        """Return a copy of the cells in [x0, x1) x [y0, y1)"""
+        x1, y1 = min(x1, self.width), min(y1, self.height)
+        out = np.zeros((max(0, y1 - y0), max(0, x1 - x0)), dtype=self.dtype)
+        if out.size == 0 or not self.chunks:
+            return out
+        for key, chunk_part, out_part in self._overlapping_chunks(x0, y0, x1, y1):
+            chunk = self.chunks.get(key)
+            if chunk is not None:
+                out[out_part] = chunk[chunk_part]
+        return out
+
+    def set_region(self, x0, y0, block):
+        """Copy a 2D block of tile IDs into the map with its top-left corner at (x0, y0)"""
+        block = np.asarray(block)
+        x1 = min(x0 + block.shape[1], self.width)
+        y1 = min(y0 + block.shape[0], self.height)
+        if x1 <= x0 or y1 <= y0:
+            return
+        for key, chunk_part, block_part in self._overlapping_chunks(x0, y0, x1, y1):
+            part = block[block_part]
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                if not part.any():
+                    continue
+                chunk = self.chunks[key] = self._new_chunk()
+            chunk[chunk_part] = part
+            if not chunk.any():
+                del self.chunks[key]
+
+    def rows(self):
+        """Iterate over the map rows as lists of ints"""
+        for y in range(self.height):
+            yield self.region(0, y, self.width, y + 1)[0].tolist()
+
+    def iter_row_blocks(self, rows_per_block):
+        """Yield (y, block) pairs covering the map in horizontal bands"""
+        for y0 in range(0, self.height, rows_per_block):
+            yield y0, self.region(0, y0, self.width, y0 + rows_per_block)
+
+    def iter_chunks(self):
+        """Yield ((chunk_x, chunk_y), chunk) for every allocated chunk"""
+        yield from self.chunks.items()
+
+    def clear(self, tile_id=0):
+        self.chunks.clear()
+        if tile_id == 0:
+            return
+        # Filling with a real tile allocates every chunk
+        size = self.chunk_size
+        for cy in range(-(-self.height // size)):
+            for cx in range(-(-self.width // size)):
+                chunk = np.full((size, size), tile_id, dtype=self.dtype)
+                chunk[:, max(0, self.width - cx * size):] = 0
+                chunk[max(0, self.height - cy * size):, :] = 0
+                self.chunks[(cx, cy)] = chunk
+
+    def resize(self, new_width, new_height):
+        """Resize in place, dropping chunks (and parts of chunks) outside the new bounds"""
+        size = self.chunk_size
+        for key in list(self.chunks):
+            cx, cy = key
+            if cx * size >= new_width or cy * size >= new_height:
+                del self.chunks[key]
+                continue
+            chunk = self.chunks[key]
+            # Clear cells beyond the new edges so growing the map later exposes empty tiles
+            chunk[:, max(0, new_width - cx * size):] = 0
+            chunk[max(0, new_height - cy * size):, :] = 0
+            if not chunk.any():
+                del self.chunks[key]
+        self.width = new_width
+        self.height = new_height
+
+    def copy(self):
+        sparse = SparseTileMap(self.width, self.height, self.dtype, self.chunk_size)
+        sparse.chunks = {key: chunk.copy() for key, chunk in self.chunks.items()}
+        return sparse
+
+    def max_tile_id(self):
+        """Largest tile ID that fits in the storage type"""
+        return int(np.iinfo(self.dtype).max)
+
+    def is_memory_mapped(self):
+        return False
+
+    def load_into_memory(self):
+        pass
+
+
+class LayerStack:
+    """Read-only view of the visible layers of a map flattened into one: each cell
+    holds the tile of the topmost visible layer that isn't empty there. layers is
+    a list (bottom first) of objects with tile_map and visible attributes; it is
+    read on every call, so the view follows layers being shown or hidden."""
+    def __init__(self, layers):
+        self.layers = layers
+
+    def visible_maps(self):
+        return [layer.tile_map for layer in self.layers if layer.visible]
+
+    @property
+    def width(self):
+        return self.layers[0].tile_map.width
+
+    @property
+    def height(self):
+        return self.layers[0].tile_map.height
+
+    @property
+    def dtype(self):
+        return self.layers[0].tile_map.dtype
+
+    @property
+    def is_sparse(self):
+        return all(tile_map.is_sparse for tile_map in self.visible_maps())
+
+    @property
+    def chunk_size(self):
+        maps = self.visible_maps()
+        return maps[0].chunk_size if maps else SPARSE_CHUNK_SIZE
+
+    @property
+    def chunks(self):
+        """Keys of the chunks allocated in any visible layer (when they are all sparse)"""
+        return {key for tile_map in self.visible_maps() for key in list(tile_map.chunks)}
+
+    def region(self, x0, y0, x1, y1):
+        """Return the flattened cells in [x0, x1) x [y0, y1)"""
+        maps = self.visible_maps()
+        if len(maps) == 1:
+            return maps[0].region(x0, y0, x1, y1)
+        if not maps:
+            return np.zeros_like(self.layers[0].tile_map.region(x0, y0, x1, y1))
+        out = maps[-1].region(x0, y0, x1, y1).copy()
+        for tile_map in reversed(maps[:-1]):
+            empty = out == 0
+            if not empty.any():
+                break
+            out[empty] = tile_map.region(x0, y0, x1, y1)[empty]
+        return out
+
+
+def new_tile_map(width, height, dtype=MAP_DTYPE):
+    """Create an empty map, using sparse storage when a dense one would be too big"""
+    if width * height > SPARSE_MAP_CELLS:
+        return SparseTileMap(width, height, dtype)
+    return TileMap(width, height, dtype)